@@ -1,6 +1,6 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
-from .models import User, Storage
+from .models import Blob, ShareLink, User, Storage
 
 # Настраиваем отображение модели User
 class UserAdmin(BaseUserAdmin):
@@ -17,6 +17,19 @@ class StorageAdmin(admin.ModelAdmin):
     list_filter = ('id_user', 'upload_date')
     search_fields = ('original_name', 'id_user__username')
 
+# Настраиваем отображение модели Blob
+class BlobAdmin(admin.ModelAdmin):
+    list_display = ('sha256', 'size', 'refcount', 'created_date')
+    search_fields = ('sha256',)
+
+# Настраиваем отображение модели ShareLink
+class ShareLinkAdmin(admin.ModelAdmin):
+    list_display = ('token', 'storage', 'expiration', 'download_count', 'max_downloads', 'revoked')
+    list_filter = ('revoked',)
+    search_fields = ('token', 'storage__original_name')
+
 # Регистрируем модели
 admin.site.register(User, UserAdmin)
 admin.site.register(Storage, StorageAdmin)
+admin.site.register(Blob, BlobAdmin)
+admin.site.register(ShareLink, ShareLinkAdmin)
@@ -1,6 +1,39 @@
+import os
+import sys
 from django.apps import AppConfig
+from django.conf import settings
+
+
+def is_management_command():
+    # manage.py (django-admin) с любой командой, кроме runserver: migrate, shell, test, бенчмарки и т.п.
+    program = os.path.basename(sys.argv[0]) if sys.argv else ''
+    return program in ('manage.py', 'django-admin') and sys.argv[1:2] != ['runserver']
 
 
 class ApiAppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api_app'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+
+        # Учёт запросов к базе в замерах запроса (метрики и Server-Timing)
+        from django.db.backends.signals import connection_created
+        from .metrics import install_db_wrapper
+        connection_created.connect(install_db_wrapper, dispatch_uid='api_app_metrics_db_wrapper')
+
+        # Фоновые задачи обслуживания выполняются только процессами сервера, а не командами manage.py
+        if is_management_command():
+            return
+
+        # Периодическая очистка истекших токенов в процессе приложения (0 - отключено)
+        interval = getattr(settings, 'TOKEN_SWEEP_INTERVAL', 0)
+        if interval > 0:
+            from .maintenance import clean_expired_tokens, start_sweeper
+            start_sweeper('clean_expired_tokens', clean_expired_tokens, interval)
+
+        # Периодическое удаление файлов, помеченных удалёнными (0 - отключено)
+        interval = getattr(settings, 'FILE_REAP_INTERVAL', 0)
+        if interval > 0:
+            from .maintenance import reap_deleted_files, start_sweeper
+            start_sweeper('reap_deleted_files', reap_deleted_files, interval)
@@ -0,0 +1,224 @@
+"""
+Асинхронные варианты скачивания, просмотра и загрузки файлов для запуска под ASGI-сервером
+(например, `gunicorn -k uvicorn.workers.UvicornWorker backend_project.asgi:application`).
+Чтение файла выполняется блоками в пуле потоков, а между блоками процесс обслуживает
+другие соединения, поэтому число одновременных медленных скачиваний не ограничено числом воркеров.
+Для загрузки это не так: ASGI-обработчик Django получает всё тело запроса (во временный файл)
+до вызова представления, поэтому проверка квоты по Content-Length и разбор multipart выполняются
+уже после приёма файла. Медленные загрузки не занимают воркер, но принимаются целиком; большие файлы
+лучше загружать поблочно (UploadSessionView) или прямой загрузкой в объектное хранилище.
+Проверки доступа, учёт скачиваний и формирование заголовков те же, что в StorageView
+"""
+import asyncio
+from asgiref.sync import sync_to_async
+from django.http import Http404, JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+from rest_framework.exceptions import AuthenticationFailed
+from .authentication import CachedTokenAuthentication
+from .file_delivery import (
+    DELIVERY_PYTHON,
+    TEXT_CONTENT_TYPES,
+    build_offloaded_response,
+    build_text_response,
+    deliver_file,
+    get_delivery_backend,
+    get_http_charset,
+    get_not_modified_response,
+    is_preview_request,
+    set_cache_headers,
+)
+from .log import mask_token
+from .metrics import record_share_link
+from .models import QuotaExceeded, ShareLink, Storage, User
+from .serializers import StorageSerializer
+from .views import MULTIPART_OVERHEAD, StorageView, get_content_length
+import logging
+
+logger = logging.getLogger(__name__)
+
+_sentinel = object()
+
+
+async def aiterate(iterator):
+    """
+    Асинхронная обёртка над синхронным итератором чтения файла: каждый блок читается в пуле потоков
+    """
+    try:
+        while True:
+            chunk = await asyncio.to_thread(next, iterator, _sentinel)
+            if chunk is _sentinel:
+                break
+            yield chunk
+    finally:
+        close = getattr(iterator, 'close', None)
+        if close is not None:
+            await asyncio.to_thread(close)
+
+
+def make_async(response):
+    # Перевод потокового ответа на асинхронный итератор (файл закрывается через closers ответа)
+    if response.streaming and not response.is_async:
+        response.streaming_content = aiterate(iter(response.streaming_content))
+    return response
+
+
+async def aauthenticate(request):
+    """
+    Аутентификация по заголовку Authorization: Token <key>, как в CachedTokenAuthentication
+    """
+    auth = request.headers.get('Authorization', '').split()
+    if len(auth) != 2 or auth[0].lower() != 'token':
+        return None
+    try:
+        user, _ = await sync_to_async(CachedTokenAuthentication().authenticate_credentials)(auth[1])
+    except AuthenticationFailed:
+        return None
+    return user
+
+
+# GET-запрос: асинхронное скачивание файла
+@require_GET
+async def download_file(request, id_file):
+    logger.info('Асинхронное скачивание файла: id_file=%s', id_file)
+    if await aauthenticate(request) is None:
+        return JsonResponse({"detail": "Учетные данные не были предоставлены."}, status=401)
+
+    view = StorageView()
+    try:
+        file_name, content_type, encoded_file_name, file = await sync_to_async(view.get_file_params)(id_file=id_file)
+    except Storage.DoesNotExist:
+        logger.warning('Файл не найден при скачивании: id_file=%s', id_file)
+        return JsonResponse({"detail": "Файл не найден."}, status=404)
+    not_modified = get_not_modified_response(request, file)
+    if not_modified is not None:
+        return not_modified
+
+    await sync_to_async(view.update_last_download_date)(file)
+
+    try:
+        response = await asyncio.to_thread(deliver_file, request, file, content_type)
+    except FileNotFoundError:
+        logger.error('Файл отсутствует в хранилище: id_file=%s', id_file)
+        return JsonResponse({"detail": "Файл не найден."}, status=404)
+    response['Content-Disposition'] = f'attachment; filename="{encoded_file_name}"'
+    response['X-Filename'] = encoded_file_name
+    response['X-Last-Download-Date'] = file.last_download_date.isoformat()
+    return make_async(response)
+
+
+# GET-запрос: асинхронное скачивание файла по специальной ссылке
+@require_GET
+async def download_file_by_token(request, token):
+    logger.info('Асинхронное скачивание файла по токену: token=%s', mask_token(token))
+    try:
+        link = await ShareLink.objects.select_related('storage').aget(token=token)
+    except ShareLink.DoesNotExist:
+        logger.warning('Файл не найден по токену: token=%s', mask_token(token))
+        record_share_link('not_found')
+        return JsonResponse({"detail": "Файл не найден."}, status=404)
+
+    if link.revoked or link.is_expired():
+        logger.warning('Ссылка устарела: id_link=%s', link.pk)
+        record_share_link('expired')
+        return JsonResponse({"detail": "Ссылка устарела."}, status=403)
+
+    view = StorageView()
+    file_name, content_type, encoded_file_name, file = await sync_to_async(view.get_file_params)(file=link.storage)
+    not_modified = get_not_modified_response(request, file)
+    if not_modified is not None:
+        record_share_link('not_modified')
+        return not_modified
+
+    resume = view.is_link_resume(request, link)
+    if not resume and not await sync_to_async(view.register_link_download)(link):
+        logger.warning('Исчерпан лимит скачиваний по ссылке: id_link=%s', link.pk)
+        record_share_link('limit')
+        return JsonResponse({"detail": "Превышено количество скачиваний по ссылке."}, status=403)
+
+    await sync_to_async(view.update_last_download_date)(file)
+
+    try:
+        response = await asyncio.to_thread(deliver_file, request, file, content_type)
+    except FileNotFoundError:
+        logger.error('Файл отсутствует в хранилище: id_file=%s', file.id_file)
+        record_share_link('missing_file')
+        return JsonResponse({"detail": "Файл не найден."}, status=404)
+    record_share_link('hit')
+    if not resume:
+        view.set_link_resume_cookie(request, response, link)
+    response['Content-Disposition'] = f'attachment; filename="{encoded_file_name}"'
+    response['X-Filename'] = encoded_file_name
+    return make_async(response)
+
+
+# GET-запрос: асинхронный просмотр файла
+@require_GET
+async def view_file(request, id_user, id_file):
+    logger.info('Асинхронное предоставление файла для просмотра: id_file=%s', id_file)
+    view = StorageView()
+    try:
+        file_name, content_type, encoded_file_name, file = await sync_to_async(view.get_file_params)(id_file=id_file)
+    except Storage.DoesNotExist:
+        logger.warning('Файл не найден для просмотра: id_file=%s', id_file)
+        raise Http404("Файл не найден")
+    not_modified = get_not_modified_response(request, file)
+    if not_modified is not None:
+        return not_modified
+
+    delivery_backend = get_delivery_backend()
+    try:
+        if content_type in TEXT_CONTENT_TYPES and (delivery_backend == DELIVERY_PYTHON or is_preview_request(request)):
+            response = set_cache_headers(await asyncio.to_thread(build_text_response, request, file, content_type), file)
+        elif delivery_backend != DELIVERY_PYTHON:
+            if content_type in TEXT_CONTENT_TYPES:
+                content_type = f"{content_type}; charset={get_http_charset(file)}"
+            response = build_offloaded_response(file, content_type, delivery_backend, 'inline')
+        else:
+            response = await asyncio.to_thread(deliver_file, request, file, content_type)
+    except FileNotFoundError:
+        logger.error('Файл отсутствует в хранилище: id_file=%s', id_file)
+        raise Http404("Файл не найден")
+
+    response['Content-Disposition'] = f'inline; filename="{encoded_file_name}"'
+    return make_async(response)
+
+
+# POST-запрос: асинхронная загрузка файла (multipart/form-data с полями file и comment).
+# Тело запроса к этому моменту уже принято ASGI-обработчиком целиком (см. описание модуля)
+@csrf_exempt
+@require_POST
+async def upload_file(request, id_user):
+    logger.info('Асинхронная загрузка файла: id_user=%s', id_user)
+    user = await aauthenticate(request)
+    if user is None:
+        return JsonResponse({"detail": "Учетные данные не были предоставлены."}, status=401)
+    if not (user.role == 'admin' or user.is_superuser or user.id_user == id_user):
+        return JsonResponse({"detail": "У вас недостаточно прав для выполнения данного действия."}, status=403)
+
+    if user.id_user != id_user:
+        try:
+            user = await User.objects.aget(id_user=id_user)
+        except User.DoesNotExist:
+            logger.error('Пользователь не найден: id_user=%s', id_user)
+            return JsonResponse({"detail": "Пользователь не найден"}, status=404)
+
+    # Квоту проверяем по Content-Length до разбора multipart-тела
+    content_length = get_content_length(request)
+    if not await sync_to_async(User.objects.has_space)(user.pk, content_length - MULTIPART_OVERHEAD):
+        logger.warning('Загрузка отклонена по квоте: id_user=%s, Content-Length=%s', id_user, content_length)
+        return JsonResponse({"detail": "Недостаточно места: превышена квота пользователя."}, status=413)
+
+    # Разбор multipart-тела (с подсчётом хеша обработчиками загрузки) выполняется в потоке
+    files, data = await sync_to_async(lambda: (request.FILES, request.POST))()
+    file = files.get('file')
+    if file is None:
+        return JsonResponse({"detail": "Файл не передан."}, status=400)
+
+    try:
+        storage_file = await sync_to_async(StorageView().save_uploaded_file)(user, file, data.get('comment', ''))
+    except QuotaExceeded:
+        logger.warning('Файл %s не помещается в квоту: id_user=%s, size=%s', file.name, id_user, file.size)
+        return JsonResponse({"detail": "Недостаточно места: превышена квота пользователя."}, status=413)
+    logger.info('Файл %s загружен успешно', file.name)
+    return JsonResponse(StorageSerializer(storage_file).data, status=201)
@@ -0,0 +1,109 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.authentication import TokenAuthentication
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class LocalTTLCache:
+    """
+    Потокобезопасный LRU-кэш в памяти процесса с ограничением времени жизни записей
+    """
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            item = self.data.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if expires < time.monotonic():
+                del self.data[key]
+                return None
+            self.data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.data[key] = (time.monotonic() + self.ttl, value)
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.data.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+
+local_auth_cache = LocalTTLCache(
+    maxsize=getattr(settings, 'AUTH_CACHE_LOCAL_SIZE', 10000),
+    ttl=getattr(settings, 'AUTH_CACHE_LOCAL_TTL', 5),
+)
+
+
+def get_shared_cache():
+    alias = getattr(settings, 'AUTH_CACHE_ALIAS', None)
+    return caches[alias] if alias else None
+
+
+def get_cache_key(key):
+    return f'auth_token:{key}'
+
+
+def invalidate_token(key):
+    """
+    Удаление токена из кэшей. Локальные кэши других процессов устаревают не позже AUTH_CACHE_LOCAL_TTL
+    """
+    local_auth_cache.delete(key)
+    shared_cache = get_shared_cache()
+    if shared_cache is not None:
+        shared_cache.delete(get_cache_key(key))
+    logger.debug('Токен удалён из кэша аутентификации')
+
+
+def invalidate_user(user_id):
+    # У пользователя может быть токен DRF - удаляем его из кэшей
+    from rest_framework.authtoken.models import Token
+
+    for key in Token.objects.filter(user_id=user_id).values_list('key', flat=True):
+        invalidate_token(key)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    TokenAuthentication с кэшированием пары (пользователь, токен):
+    сначала локальный LRU-кэш процесса (AUTH_CACHE_LOCAL_TTL секунд),
+    затем общий кэш Django (AUTH_CACHE_ALIAS, например Redis, на AUTH_CACHE_TTL секунд),
+    и только при промахе - запрос к базе.
+    Кэш сбрасывается сигналами при удалении токена (выход), изменении и удалении пользователя
+    """
+    def authenticate_credentials(self, key):
+        cached = local_auth_cache.get(key)
+        if cached is None:
+            shared_cache = get_shared_cache()
+            if shared_cache is not None:
+                cached = shared_cache.get(get_cache_key(key))
+            if cached is None:
+                cached = super().authenticate_credentials(key)
+                if shared_cache is not None:
+                    shared_cache.set(get_cache_key(key), cached, getattr(settings, 'AUTH_CACHE_TTL', 300))
+            local_auth_cache.set(key, cached)
+        # Отдаём копии, чтобы изменения объекта в одном запросе не попали в кэш
+        user, token = cached
+        user = copy.copy(user)
+        token = copy.copy(token)
+        token.user = user
+        return user, token
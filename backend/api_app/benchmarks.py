@@ -0,0 +1,660 @@
+"""
+Бенчмарк маршрутов api_app: генерация синтетических данных (команда generate_bench_data)
+и замер задержки, количества запросов к базе и пропускной способности каждого маршрута
+из api_app/urls.py (команда benchmark). Запросы выполняются в процессе через тестовый клиент Django,
+без сетевого сервера, поэтому результаты сравнимы между коммитами на одной машине.
+Нагрузку с одновременными медленными клиентами на запущенный сервер даёт команда bench_slow_clients.
+Запускается только с профилем настроек бенчмарка (backend_project.settings_bench)
+"""
+import hashlib
+import io
+import math
+import os
+import platform
+import random
+import subprocess
+import tempfile
+import time
+import django
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, transaction
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.test import AsyncClient, Client
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from .maintenance import reap_deleted_files, reconcile_usage
+from .metrics import is_enabled as metrics_enabled
+from .models import Blob, ShareLink, Storage, UploadSession, User
+from .upload_handlers import HEAD_SIZE, get_content_metadata
+from .views import StorageView
+import logging
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow не установлен - сценарий эскиза пропускается
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+BENCH_OWNER = 'bench_owner'
+BENCH_ADMIN = 'bench_admin'
+BENCH_USER_PREFIX = 'bench'
+# Пользователи, создаваемые сценариями; удаляются после замера
+BENCH_TEMP_PREFIX = 'benchtmp_'
+BENCH_PASSWORD = 'Bench-passw0rd'
+TEXT_EXTENSIONS = ['txt', 'csv', 'md', 'log']
+BINARY_EXTENSIONS = ['bin', 'dat']
+LARGE_FILE_BLOCK = 8 * 1024 * 1024
+
+
+def is_benchmark_profile():
+    return getattr(settings, 'BENCHMARK_PROFILE', False)
+
+
+def percentile(values, p):
+    # Перцентиль по ближайшему рангу (values отсортированы)
+    if not values:
+        return None
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+def get_git_commit():
+    try:
+        result = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=settings.BASE_DIR, capture_output=True, text=True, timeout=5,
+        )
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return result.stdout.strip() or None
+
+
+# Генерация данных
+
+def make_content(rng, index, max_size):
+    # Содержимое файла из пула: чётные - текст (кириллица и ASCII), нечётные - случайные байты
+    size = rng.randint(1, max_size)
+    if index % 2:
+        return rng.randbytes(size), rng.choice(BINARY_EXTENSIONS)
+    line = f'{index}: строка текстового файла для бенчмарка, line of a benchmark text file\n'.encode()
+    return (line * (size // len(line) + 1))[:size], rng.choice(TEXT_EXTENSIONS)
+
+
+def create_blob_pool(count, max_size, rng):
+    """
+    Пул уникального содержимого, на которое ссылаются записи Storage (как после дедупликации).
+    Возвращает список (blob, расширение, MIME-тип, кодировка)
+    """
+    pool = []
+    for index in range(count):
+        data, ext = make_content(rng, index, max_size)
+        content_type, charset = get_content_metadata(f'file.{ext}', data[:HEAD_SIZE])
+        with transaction.atomic():
+            blob = Blob.objects.acquire(hashlib.sha256(data).hexdigest(), len(data), content=ContentFile(data))
+        pool.append((blob, ext, content_type, charset))
+    return pool
+
+
+def create_users(count, password_hash, batch_size):
+    # Пароль у всех пользователей общий: его хеш считается один раз
+    users = [
+        User(
+            username=f'{BENCH_USER_PREFIX}{number:06d}',
+            email=f'{BENCH_USER_PREFIX}{number:06d}@bench.local',
+            fullname=f'Bench User {number}',
+            password=password_hash,
+        )
+        for number in range(count)
+    ]
+    User.objects.bulk_create(users, batch_size=batch_size)
+    return list(
+        User.objects.filter(username__regex=rf'^{BENCH_USER_PREFIX}[0-9]+$').order_by('pk').values_list('pk', flat=True)
+    )
+
+
+def create_files(owners, pool, batch_size):
+    """
+    Записи Storage пакетами по batch_size: owners - id владельца каждой записи по порядку,
+    содержимое берётся из пула по кругу
+    """
+    created = 0
+    for start in range(0, len(owners), batch_size):
+        batch = []
+        for index in range(start, min(start + batch_size, len(owners))):
+            blob, ext, content_type, charset = pool[index % len(pool)]
+            batch.append(Storage(
+                id_user_id=owners[index],
+                original_name=f'file_{index:07d}.{ext}',
+                comment='',
+                size=blob.size,
+                file=blob.file.name,
+                blob=blob,
+                content_type=content_type,
+                sha256=blob.sha256,
+                charset=charset,
+            ))
+        Storage.objects.bulk_create(batch)
+        created += len(batch)
+        logger.info('Создано записей файлов: %s из %s', created, len(owners))
+    return created
+
+
+def create_large_file(owner_id, index, size, rng):
+    """
+    Большой файл владельца: пишется блоками во временный файл рядом с хранилищем
+    и переносится в него так же, как загруженный файл (см. BlobManager.acquire с path)
+    """
+    directory = os.path.join(settings.MEDIA_ROOT, 'uploads_staging')
+    os.makedirs(directory, exist_ok=True)
+    block = rng.randbytes(min(LARGE_FILE_BLOCK, size))
+    hasher = hashlib.sha256()
+    with tempfile.NamedTemporaryFile(dir=directory, suffix='.bench') as tmp:
+        written = 0
+        while written < size:
+            # Номер файла и смещение в начале блока делают содержимое уникальным
+            part = (index.to_bytes(8, 'big') + written.to_bytes(8, 'big') + block[16:])[:size - written]
+            tmp.write(part)
+            hasher.update(part)
+            written += len(part)
+        tmp.flush()
+        with transaction.atomic():
+            blob = Blob.objects.acquire(hasher.hexdigest(), size, path=tmp.name)
+            return Storage.objects.create(
+                id_user_id=owner_id,
+                original_name=f'large_{index}.bin',
+                comment='',
+                size=size,
+                file=blob.file.name,
+                blob=blob,
+                content_type='application/octet-stream',
+                sha256=blob.sha256,
+            )
+
+
+def generate_data(users, files, owner_files, blobs, blob_max_size, large_files, large_size, batch_size=5000, seed=0):
+    """
+    Синтетические данные для бенчмарка: users пользователей и files записей Storage, из них owner_files
+    у пользователя BENCH_OWNER (его список файлов замеряется), содержимое - пул из blobs файлов
+    до blob_max_size байт, плюс large_files больших файлов по large_size байт для замера скачивания.
+    Возвращает словарь с количеством созданных объектов
+    """
+    rng = random.Random(seed)
+    started = time.monotonic()
+    password_hash = make_password(BENCH_PASSWORD)
+
+    owner = User.objects.create_user(
+        email=f'{BENCH_OWNER}@bench.local', username=BENCH_OWNER, password=BENCH_PASSWORD, fullname='Bench Owner',
+    )
+    User.objects.create_superuser(
+        email=f'{BENCH_ADMIN}@bench.local', username=BENCH_ADMIN, password=BENCH_PASSWORD,
+        fullname='Bench Admin', role='admin',
+    )
+    user_ids = create_users(users, password_hash, batch_size)
+    logger.info('Создано пользователей: %s', len(user_ids))
+
+    pool = create_blob_pool(blobs, blob_max_size, rng)
+    logger.info('Создано уникального содержимого: %s', len(pool))
+
+    owner_files = min(owner_files, files)
+    other_files = files - owner_files
+    owners = [owner.pk] * owner_files
+    if user_ids:
+        owners += [user_ids[index % len(user_ids)] for index in range(other_files)]
+    created = create_files(owners, pool, batch_size)
+
+    for index in range(large_files):
+        create_large_file(owner.pk, index, large_size, rng)
+    logger.info('Создано больших файлов: %s по %s байт', large_files, large_size)
+
+    # Счётчики ссылок на содержимое и занятого места приводятся в соответствие с созданными записями
+    references = (
+        Storage.all_objects.filter(blob=OuterRef('pk')).order_by().values('blob').annotate(total=Count('*')).values('total')
+    )
+    Blob.objects.update(refcount=Coalesce(Subquery(references), 0))
+    reconcile_usage()
+
+    return {
+        'users': len(user_ids) + 2,
+        'files': created + large_files,
+        'blobs': len(pool) + large_files,
+        'seconds': round(time.monotonic() - started, 1),
+    }
+
+
+# Замер маршрутов
+
+class QueryCounter:
+    """
+    Обёртка выполнения запросов к базе (connection.execute_wrapper): количество и суммарное время
+    """
+    def __init__(self):
+        self.count = 0
+        self.time = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.time += time.perf_counter() - started
+
+
+class BenchRequest:
+    """
+    Один запрос сценария: метод клиента, путь и его параметры.
+    upload_bytes - размер передаваемого файла для расчёта пропускной способности загрузки
+    """
+    def __init__(self, method, path, data=None, token=None, headers=None, content_type=None, upload_bytes=0):
+        self.method = method
+        self.path = path
+        self.data = data
+        self.headers = dict(headers or {})
+        if token:
+            self.headers['Authorization'] = f'Token {token}'
+        self.content_type = content_type
+        self.upload_bytes = upload_bytes
+
+    def get_kwargs(self):
+        kwargs = {'headers': self.headers}
+        if self.data is not None:
+            kwargs['data'] = self.data
+        if self.content_type:
+            kwargs['content_type'] = self.content_type
+        return kwargs
+
+
+class Scenario:
+    """
+    Сценарий замера маршрута route: prepare(index) готовит данные и возвращает BenchRequest
+    (подготовка не входит в замер). is_async - маршрут асинхронного представления.
+    repeat ограничивает количество запросов для тяжёлых сценариев
+    """
+    def __init__(self, name, route, prepare, is_async=False, repeat=None, skip=None):
+        self.name = name
+        self.route = route
+        self.prepare = prepare
+        self.is_async = is_async
+        self.repeat = repeat
+        self.skip = skip
+
+
+class BenchContext:
+    """
+    Данные, общие для сценариев: пользователи с токенами, файлы для просмотра и скачивания.
+    Всё, что сценарии создают, удаляется в cleanup, поэтому набор данных не меняется между запусками
+    """
+    def __init__(self, upload_size, chunk_size):
+        self.upload_size = upload_size
+        self.chunk_size = chunk_size
+        self.counter = 0
+        try:
+            self.owner = User.objects.get(username=BENCH_OWNER)
+            self.admin = User.objects.get(username=BENCH_ADMIN)
+        except User.DoesNotExist:
+            raise LookupError('Нет данных бенчмарка: выполните python manage.py generate_bench_data')
+        self.owner_token = Token.objects.get_or_create(user=self.owner)[0].key
+        self.admin_token = Token.objects.get_or_create(user=self.admin)[0].key
+
+        files = Storage.objects.filter(id_user=self.owner)
+        self.last_file_id = Storage.all_objects.order_by('-id_file').values_list('id_file', flat=True).first() or 0
+        self.last_link_id = ShareLink.objects.order_by('-id_link').values_list('id_link', flat=True).first() or 0
+        self.large_file = files.order_by('-size', 'id_file').first()
+        self.text_file = files.filter(content_type__startswith='text/').order_by('id_file').first()
+        self.text_file_name = self.text_file.original_name if self.text_file else None
+        self.zip_ids = list(files.exclude(pk=getattr(self.large_file, 'pk', None)).order_by('id_file').values_list('pk', flat=True)[:10])
+        self.image_file = self.make_image()
+        self.link_token = None
+        if self.large_file:
+            self.link_token = ShareLink.objects.create(
+                storage=self.large_file, token=f'bench{timezone.now():%H%M%S%f}',
+            ).token
+        self.role_user = self.make_user()
+        self.logout_user = self.make_user()
+
+    def next_index(self):
+        self.counter += 1
+        return self.counter
+
+    def make_user(self):
+        # Пароль не задаётся, чтобы не тратить время на хеширование
+        index = self.next_index()
+        return User.objects.create_user(
+            email=f'{BENCH_TEMP_PREFIX}{index}@bench.local', username=f'{BENCH_TEMP_PREFIX}{index}', fullname='Bench Temp',
+        )
+
+    def make_file(self, data=None, name='fixture.txt'):
+        data = data if data is not None else b'benchmark fixture\n'
+        return StorageView().save_uploaded_file(self.owner, SimpleUploadedFile(name, data), 'bench')
+
+    def make_image(self):
+        if Image is None:
+            return None
+        buffer = io.BytesIO()
+        image = Image.effect_noise((1600, 1200), 64).convert('RGB')
+        image.save(buffer, 'JPEG', quality=90)
+        return self.make_file(buffer.getvalue(), 'bench.jpg')
+
+    def make_session(self, size):
+        response = Client().post(
+            reverse('upload_session_create', kwargs={'id_user': self.owner.pk}),
+            data={'name': 'chunked.bin', 'size': size}, content_type='application/json',
+            headers={'Authorization': f'Token {self.owner_token}'},
+        )
+        return response.json()['id_session']
+
+    def upload_chunk(self, id_session, data):
+        return BenchRequest(
+            'put', reverse('upload_session', kwargs={'id_user': self.owner.pk, 'id_session': id_session}),
+            data=data, token=self.owner_token, content_type='application/octet-stream',
+            headers={'Content-Range': f'bytes 0-{len(data) - 1}/{len(data)}'}, upload_bytes=len(data),
+        )
+
+    def list_etag(self):
+        response = Client().get(
+            reverse('files_list-add_file', kwargs={'id_user': self.owner.pk}), {'limit': 50},
+            headers={'Authorization': f'Token {self.owner_token}'},
+        )
+        return response['ETag']
+
+    def cleanup(self):
+        # Удаляем созданные сценариями файлы, ссылки, сессии и пользователей
+        UploadSession.objects.filter(id_user=self.owner).delete()
+        ShareLink.objects.filter(id_link__gt=self.last_link_id).delete()
+        Storage.objects.filter(id_user=self.owner, id_file__gt=self.last_file_id).soft_delete()
+        temp_users = User.objects.filter(username__startswith=BENCH_TEMP_PREFIX)
+        Storage.objects.filter(id_user__in=temp_users).soft_delete()
+        temp_users.delete()
+        if self.text_file:
+            Storage.objects.filter(pk=self.text_file.pk).update(original_name=self.text_file_name)
+        reap_deleted_files()
+
+
+def build_scenarios(ctx):
+    owner = ctx.owner.pk
+    owner_token = ctx.owner_token
+    admin_token = ctx.admin_token
+    text_id = getattr(ctx.text_file, 'pk', 0)
+    large_id = getattr(ctx.large_file, 'pk', 0)
+    no_text = None if ctx.text_file else 'нет текстовых файлов'
+    no_large = None if ctx.large_file else 'нет файлов'
+
+    def url(route, **kwargs):
+        return reverse(route, kwargs=kwargs)
+
+    def upload_data(index):
+        # Уникальное содержимое, чтобы каждая загрузка записывала новый файл, а не находила копию
+        return index.to_bytes(8, 'big') + os.urandom(max(ctx.upload_size - 8, 0))
+
+    def register(index):
+        return BenchRequest('post', url('users_list-add_user'), data={
+            'username': f'{BENCH_TEMP_PREFIX}reg{index}', 'email': f'{BENCH_TEMP_PREFIX}reg{index}@bench.local',
+            'fullname': 'Bench Register', 'password': BENCH_PASSWORD,
+        }, content_type='application/json')
+
+    def logout(index):
+        Token.objects.filter(user=ctx.logout_user).delete()
+        token = Token.objects.create(user=ctx.logout_user).key
+        return BenchRequest('post', url('users_list-add_user'), data={}, token=token, content_type='application/json')
+
+    def delete_user(index):
+        return BenchRequest('delete', url('user_delete-change_role', id_user=ctx.make_user().pk), token=admin_token)
+
+    def upload(index, route='files_list-add_file'):
+        data = upload_data(index)
+        return BenchRequest(
+            'post', url(route, id_user=owner), token=owner_token, upload_bytes=len(data),
+            data={'file': SimpleUploadedFile(f'upload_{index}.bin', data), 'comment': 'bench'},
+        )
+
+    def delete_file(index):
+        return BenchRequest('delete', url('delete_file', id_user=owner, id_file=ctx.make_file().pk), token=owner_token)
+
+    def bulk_delete(index):
+        ids = [ctx.make_file().pk for _ in range(10)]
+        return BenchRequest(
+            'post', url('storage_bulk_delete', id_user=owner), data={'ids': ids}, token=owner_token,
+            content_type='application/json',
+        )
+
+    def session_status(index):
+        return BenchRequest('get', url('upload_session', id_user=owner, id_session=ctx.make_session(ctx.chunk_size)), token=owner_token)
+
+    def complete(index):
+        id_session = ctx.make_session(ctx.upload_size)
+        chunk = ctx.upload_chunk(id_session, upload_data(index))
+        Client().put(chunk.path, **chunk.get_kwargs())
+        return BenchRequest('post', url('upload_session', id_user=owner, id_session=id_session), token=owner_token)
+
+    def cancel(index):
+        return BenchRequest('delete', url('upload_session', id_user=owner, id_session=ctx.make_session(ctx.chunk_size)), token=owner_token)
+
+    def not_modified(index):
+        return BenchRequest(
+            'get', url('files_list-add_file', id_user=owner), data={'limit': 50}, token=owner_token,
+            headers={'If-None-Match': ctx.list_etag()},
+        )
+
+    return [
+        Scenario('users_list_page', 'users_list-add_user', lambda i: BenchRequest(
+            'get', url('users_list-add_user'), data={'limit': 100}, token=admin_token)),
+        Scenario('users_list_files', 'users_list-add_user', lambda i: BenchRequest(
+            'get', url('users_list-add_user'), data={'limit': 100, 'include_files': 1}, token=admin_token), repeat=5),
+        Scenario('user_register', 'users_list-add_user', register),
+        Scenario('user_login', 'users_list-add_user', lambda i: BenchRequest(
+            'post', url('users_list-add_user'), data={'username': BENCH_OWNER}, token=owner_token,
+            content_type='application/json')),
+        Scenario('user_logout', 'users_list-add_user', logout),
+        Scenario('user_info', 'get_user_info', lambda i: BenchRequest('get', url('get_user_info'), token=owner_token)),
+        Scenario('user_change_role', 'user_delete-change_role', lambda i: BenchRequest(
+            'patch', url('user_delete-change_role', id_user=ctx.role_user.pk), data={'role': 'user'},
+            token=admin_token, content_type='application/json')),
+        Scenario('user_delete', 'user_delete-change_role', delete_user),
+        Scenario('files_list_page', 'files_list-add_file', lambda i: BenchRequest(
+            'get', url('files_list-add_file', id_user=owner), data={'limit': 50}, token=owner_token)),
+        Scenario('files_list_all', 'files_list-add_file', lambda i: BenchRequest(
+            'get', url('files_list-add_file', id_user=owner), token=owner_token), repeat=10),
+        Scenario('files_list_not_modified', 'files_list-add_file', not_modified),
+        Scenario('file_upload', 'files_list-add_file', upload, repeat=10),
+        Scenario('file_view', 'file_view', lambda i: BenchRequest(
+            'get', url('file_view', id_user=owner, id_file=text_id), token=owner_token), skip=no_text),
+        Scenario('file_view_text_preview', 'file_view', lambda i: BenchRequest(
+            'get', url('file_view', id_user=owner, id_file=text_id), data={'preview': 1}, token=owner_token), skip=no_text),
+        Scenario('file_preview', 'file_preview', lambda i: BenchRequest(
+            'get', url('file_preview', id_user=owner, id_file=ctx.image_file.pk), data={'size': 256}, token=owner_token),
+            skip=None if ctx.image_file else 'не установлен Pillow'),
+        Scenario('file_download', 'file_download', lambda i: BenchRequest(
+            'get', url('file_download', id_file=large_id), token=owner_token), repeat=10, skip=no_large),
+        Scenario('file_download_range', 'file_download', lambda i: BenchRequest(
+            'get', url('file_download', id_file=large_id), token=owner_token,
+            headers={'Range': 'bytes=0-1048575'}), skip=no_large),
+        Scenario('file_download_by_token', 'file_download_by_token', lambda i: BenchRequest(
+            'get', url('file_download_by_token', token=ctx.link_token)), repeat=10, skip=no_large),
+        Scenario('file_link_create', 'generate_file_link', lambda i: BenchRequest(
+            'post', url('generate_file_link', id_user=owner, id_file=text_id), data={}, token=owner_token,
+            content_type='application/json'), skip=no_text),
+        Scenario('file_links_list', 'generate_file_link', lambda i: BenchRequest(
+            'get', url('generate_file_link', id_user=owner, id_file=text_id), token=owner_token), skip=no_text),
+        Scenario('file_rename', 'delete_file', lambda i: BenchRequest(
+            'patch', url('delete_file', id_user=owner, id_file=text_id), data={'name': f'renamed_{i}.txt'},
+            token=owner_token, content_type='application/json'), skip=no_text),
+        Scenario('file_delete', 'delete_file', delete_file),
+        Scenario('bulk_delete', 'storage_bulk_delete', bulk_delete),
+        Scenario('bulk_zip', 'storage_bulk_zip', lambda i: BenchRequest(
+            'get', url('storage_bulk_zip', id_user=owner), data={'ids': ','.join(map(str, ctx.zip_ids))},
+            token=owner_token), skip=None if ctx.zip_ids else 'нет файлов'),
+        Scenario('upload_session_create', 'upload_session_create', lambda i: BenchRequest(
+            'post', url('upload_session_create', id_user=owner), data={'name': 'chunked.bin', 'size': ctx.chunk_size},
+            token=owner_token, content_type='application/json')),
+        Scenario('upload_chunk', 'upload_session', lambda i: ctx.upload_chunk(
+            ctx.make_session(ctx.chunk_size), upload_data(i)[:ctx.chunk_size].ljust(ctx.chunk_size, b'\0')), repeat=10),
+        Scenario('upload_session_status', 'upload_session', session_status),
+        Scenario('upload_complete', 'upload_session', complete, repeat=10),
+        Scenario('upload_cancel', 'upload_session', cancel),
+        Scenario('async_file_upload', 'async_upload_file', lambda i: upload(i, 'async_upload_file'), is_async=True, repeat=10),
+        Scenario('async_file_view', 'async_file_view', lambda i: BenchRequest(
+            'get', url('async_file_view', id_user=owner, id_file=text_id), token=owner_token), is_async=True, skip=no_text),
+        Scenario('async_file_download', 'async_file_download', lambda i: BenchRequest(
+            'get', url('async_file_download', id_file=large_id), token=owner_token), is_async=True, repeat=10, skip=no_large),
+        Scenario('async_file_download_by_token', 'async_file_download_by_token', lambda i: BenchRequest(
+            'get', url('async_file_download_by_token', token=ctx.link_token)), is_async=True, repeat=10, skip=no_large),
+        Scenario('metrics', 'metrics', lambda i: BenchRequest(
+            'get', url('metrics'), headers={'Authorization': f'Bearer {settings.METRICS_TOKEN}'}),
+            skip=None if settings.METRICS_TOKEN and metrics_enabled() else 'не задан METRICS_TOKEN или не установлен prometheus-client'),
+    ]
+
+
+def consume(response):
+    # Читает тело ответа (потоковое - по частям, не собирая в памяти) и возвращает его размер
+    size = 0
+    if response.streaming:
+        for chunk in response.streaming_content:
+            size += len(chunk)
+    else:
+        size = len(response.content)
+    response.close()
+    return size
+
+
+async def perform_async(client, request):
+    response = await getattr(client, request.method)(request.path, **request.get_kwargs())
+    size = 0
+    if response.streaming and response.is_async:
+        async for chunk in response.streaming_content:
+            size += len(chunk)
+    else:
+        size = consume(response)
+    return response.status_code, size
+
+
+def run_scenario(scenario, ctx, requests, warmup):
+    client = Client()
+    async_client = AsyncClient()
+    latencies = []
+    queries = []
+    db_times = []
+    statuses = {}
+    transferred = 0
+    count = min(requests, scenario.repeat) if scenario.repeat else requests
+
+    for index in range(warmup + count):
+        request = scenario.prepare(ctx.next_index())
+        counter = QueryCounter()
+        with connection.execute_wrapper(counter):
+            started = time.perf_counter()
+            if scenario.is_async:
+                # async_to_sync выполняет обращения к базе из sync_to_async в текущем потоке - они учитываются
+                status_code, size = async_to_sync(perform_async)(async_client, request)
+            else:
+                response = getattr(client, request.method)(request.path, **request.get_kwargs())
+                status_code, size = response.status_code, consume(response)
+            elapsed = time.perf_counter() - started
+        if index < warmup:
+            continue
+        latencies.append(elapsed)
+        queries.append(counter.count)
+        db_times.append(counter.time)
+        statuses[str(status_code)] = statuses.get(str(status_code), 0) + 1
+        transferred += size + request.upload_bytes
+
+    latencies.sort()
+    total = sum(latencies)
+    return {
+        'name': scenario.name,
+        'route': scenario.route,
+        'async': scenario.is_async,
+        'requests': count,
+        'statuses': statuses,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        'mean_ms': round(total / count * 1000, 3),
+        'max_ms': round(latencies[-1] * 1000, 3),
+        'queries': round(sum(queries) / count, 2),
+        'queries_max': max(queries),
+        'db_ms': round(sum(db_times) / count * 1000, 3),
+        'bytes': round(transferred / count),
+        'mb_per_s': round(transferred / total / 1024 / 1024, 2) if total else None,
+        'requests_per_s': round(count / total, 1) if total else None,
+    }
+
+
+def get_routes():
+    from .urls import urlpatterns
+
+    return [pattern.name for pattern in urlpatterns]
+
+
+def run_benchmark(requests=30, warmup=3, names=None, upload_size=1024 * 1024, chunk_size=1024 * 1024, progress=None):
+    """
+    Замер всех сценариев (или выбранных по имени сценария или маршрута в names).
+    Возвращает словарь с описанием окружения (meta), результатами по сценариям (results),
+    пропущенными сценариями (skipped) и маршрутами без сценария (uncovered_routes)
+    """
+    ctx = BenchContext(upload_size, chunk_size)
+    scenarios = build_scenarios(ctx)
+    results = []
+    skipped = {}
+    try:
+        for scenario in scenarios:
+            if names and scenario.name not in names and scenario.route not in names:
+                continue
+            if scenario.skip:
+                skipped[scenario.name] = scenario.skip
+                continue
+            result = run_scenario(scenario, ctx, requests, warmup)
+            results.append(result)
+            if progress:
+                progress(result)
+    finally:
+        ctx.cleanup()
+
+    covered = {scenario.route for scenario in scenarios}
+    return {
+        'meta': {
+            'commit': get_git_commit(),
+            'created': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'platform': platform.platform(),
+            'database': connection.vendor,
+            'file_storage': settings.FILE_STORAGE_BACKEND,
+            'file_delivery': settings.FILE_DELIVERY_BACKEND,
+            'requests': requests,
+            'warmup': warmup,
+            'upload_size': upload_size,
+            'data': {
+                'users': User.objects.count(),
+                'files': Storage.objects.count(),
+                'owner_files': Storage.objects.filter(id_user=ctx.owner).count(),
+                'large_file_size': getattr(ctx.large_file, 'size', None),
+            },
+        },
+        'results': results,
+        'skipped': skipped,
+        'uncovered_routes': [route for route in get_routes() if route not in covered],
+    }
+
+
+def compare_results(previous, current, threshold=10.0):
+    """
+    Сравнение с результатами предыдущего запуска по сценариям с одинаковым именем.
+    Регрессия - рост p50 больше чем на threshold процентов или рост числа запросов к базе.
+    Возвращает список (имя, p50 было, p50 стало, изменение в %, запросов было, стало, регрессия)
+    """
+    previous_results = {result['name']: result for result in previous.get('results', [])}
+    rows = []
+    for result in current['results']:
+        old = previous_results.get(result['name'])
+        if old is None:
+            continue
+        change = (result['p50_ms'] - old['p50_ms']) / old['p50_ms'] * 100 if old['p50_ms'] else 0.0
+        regression = change > threshold or result['queries'] > old['queries']
+        rows.append((result['name'], old['p50_ms'], result['p50_ms'], round(change, 1), old['queries'], result['queries'], regression))
+    return rows
@@ -0,0 +1,103 @@
+import atexit
+import threading
+from django.conf import settings
+from django.db import DatabaseError, transaction
+from django.db.models import Case, DateTimeField, F, PositiveBigIntegerField, Value, When
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+from .models import Storage, User
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Сколько файлов обновлять одним запросом UPDATE при сбросе
+FLUSH_BATCH_SIZE = 500
+
+
+class DownloadTracker:
+    """
+    Буфер событий скачивания файлов.
+    Вместо UPDATE на каждое скачивание события копятся в памяти процесса
+    (для каждого файла - время последнего скачивания и количество скачиваний)
+    и периодически записываются в базу пакетно, по одному запросу на FLUSH_BATCH_SIZE файлов.
+    Интервал сброса задаёт DOWNLOAD_STATS_FLUSH_INTERVAL, при 0 запись выполняется сразу
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.started = False
+
+    def record(self, file: Storage, when=None):
+        when = when or timezone.now()
+        interval = getattr(settings, 'DOWNLOAD_STATS_FLUSH_INTERVAL', 0)
+        if interval <= 0:
+            self.write({file.id_file: (when, 1)})
+            return
+        with self.lock:
+            last, count = self.pending.get(file.id_file, (when, 0))
+            self.pending[file.id_file] = (max(last, when), count + 1)
+        self.start(interval)
+
+    def get_pending(self, id_file):
+        # Ещё не записанные в базу данные о скачиваниях файла: (время, количество) или None
+        return self.pending.get(id_file)
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        if pending:
+            try:
+                self.write(pending)
+            except DatabaseError:
+                # Данные не теряются: возвращаем их в буфер, запись повторится при следующем сбросе
+                self.restore(pending)
+                logger.exception('Не удалось записать статистику скачиваний для %s файлов', len(pending))
+                return 0
+        return len(pending)
+
+    def restore(self, pending):
+        # Объединение не записанных данных с событиями, накопившимися за время попытки записи
+        with self.lock:
+            for id_file, (when, count) in pending.items():
+                last, current = self.pending.get(id_file, (when, 0))
+                self.pending[id_file] = (max(last, when), current + count)
+
+    def write(self, pending):
+        items = list(pending.items())
+        with transaction.atomic():
+            for i in range(0, len(items), FLUSH_BATCH_SIZE):
+                batch = items[i:i + FLUSH_BATCH_SIZE]
+                last_download = Case(
+                    *[When(id_file=id_file, then=Value(when)) for id_file, (when, _) in batch],
+                    output_field=DateTimeField(),
+                )
+                downloads = Case(
+                    *[When(id_file=id_file, then=Value(count)) for id_file, (_, count) in batch],
+                    output_field=PositiveBigIntegerField(),
+                )
+                Storage.objects.filter(id_file__in=[id_file for id_file, _ in batch]).update(
+                    # Другой процесс мог уже записать более позднюю дату
+                    last_download_date=Greatest(Coalesce(F('last_download_date'), last_download), last_download),
+                    download_count=F('download_count') + downloads,
+                )
+            # Дата и счётчик скачиваний есть в списке файлов - меняем версию списков владельцев
+            User.objects.filter(
+                pk__in=Storage.objects.filter(id_file__in=pending).values('id_user')
+            ).update(storage_version=F('storage_version') + 1)
+        logger.debug('Записана статистика скачиваний для %s файлов', len(items))
+
+    def start(self, interval):
+        if self.started:
+            return
+        from .maintenance import start_sweeper
+
+        with self.lock:
+            if self.started:
+                return
+            self.started = True
+        start_sweeper('flush_download_stats', self.flush, interval)
+        # Гарантированная запись накопленных событий при остановке процесса
+        atexit.register(self.flush)
+
+
+download_tracker = DownloadTracker()
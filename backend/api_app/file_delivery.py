@@ -0,0 +1,404 @@
+import codecs
+import contextlib
+import mmap
+import re
+import urllib.parse
+import zipfile
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, HttpResponseRedirect, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.crypto import get_random_string
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+from .file_storage import get_local_path, get_presigned_download_url, open_file, supports_presigned_urls
+from .models import Storage
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Шаблон одного диапазона из заголовка Range: "500-999", "500-", "-500"
+RANGE_SPEC_RE = re.compile(r'^\s*(\d*)\s*-\s*(\d*)\s*$')
+
+# Поддерживаемые способы отдачи файлов (settings.FILE_DELIVERY_BACKEND)
+DELIVERY_PYTHON = 'python'
+DELIVERY_X_ACCEL_REDIRECT = 'x-accel-redirect'
+DELIVERY_X_SENDFILE = 'x-sendfile'
+DELIVERY_PRESIGNED = 'presigned'
+
+# Текстовые файлы, которые при просмотре отдаются с кодировкой utf-8
+TEXT_CONTENT_TYPES = ['text/plain', 'text/html', 'text/csv']
+
+# Ограничение на количество диапазонов в одном запросе (защита от запросов вида "0-0,1-1,2-2,...")
+MAX_RANGES = 16
+
+
+def get_etag(file: Storage):
+    """
+    ETag файла строится из метаданных записи Storage: id, размер и дата загрузки.
+    Содержимое файла после загрузки не меняется, поэтому такой ETag можно считать строгим
+    """
+    return quote_etag(f'{file.id_file}-{file.size}-{int(file.upload_date.timestamp())}')
+
+
+def get_last_modified(file: Storage):
+    return int(file.upload_date.timestamp())
+
+
+def set_cache_headers(response, file: Storage):
+    """
+    Валидаторы (ETag, Last-Modified) и Cache-Control для ответа с содержимым файла.
+    При FILE_CACHE_MAX_AGE=0 браузер каждый раз проверяет актуальность копии условным запросом
+    """
+    response['ETag'] = get_etag(file)
+    response['Last-Modified'] = http_date(get_last_modified(file))
+    max_age = settings.FILE_CACHE_MAX_AGE
+    if max_age > 0:
+        patch_cache_control(response, private=True, max_age=max_age)
+    else:
+        patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def get_not_modified_response(request, file: Storage):
+    """
+    Ответ 304 на условный запрос (If-None-Match, If-Modified-Since), если у клиента актуальная копия файла
+    (или 412 при невыполненном If-Match/If-Unmodified-Since), иначе None
+    """
+    response = get_conditional_response(request, etag=get_etag(file), last_modified=get_last_modified(file))
+    if response is not None:
+        set_cache_headers(response, file)
+    return response
+
+
+def parse_range_header(header, size):
+    """
+    Разбирает заголовок Range (только единицы bytes).
+    Возвращает:
+    - None, если заголовок нужно проигнорировать и отдать файл целиком;
+    - пустой список, если ни один диапазон не может быть удовлетворён (ответ 416);
+    - список кортежей (start, end) с включительными границами.
+    """
+    if not header:
+        return None
+    units, _, specs = header.partition('=')
+    if units.strip().lower() != 'bytes' or not specs:
+        return None
+
+    ranges = []
+    for spec in specs.split(','):
+        match = RANGE_SPEC_RE.match(spec)
+        if not match:
+            # Синтаксически неверный заголовок игнорируем (RFC 9110, 14.2)
+            return None
+        first, last = match.groups()
+        if not first and not last:
+            return None
+        if first:
+            start = int(first)
+            end = int(last) if last else size - 1
+            if last and end < start:
+                return None
+            if start >= size:
+                continue  # неудовлетворимый диапазон
+            end = min(end, size - 1)
+        else:
+            # Суффиксный диапазон: последние N байт
+            suffix = int(last)
+            if suffix == 0:
+                continue
+            start = max(size - suffix, 0)
+            end = size - 1
+        ranges.append((start, end))
+
+    if len(ranges) > MAX_RANGES:
+        return None
+    return ranges
+
+
+def if_range_matches(request, etag, last_modified):
+    """
+    Проверка заголовка If-Range: диапазон отдаётся, только если клиент докачивает ту же версию файла
+    """
+    if_range = request.headers.get('If-Range')
+    if not if_range:
+        return True
+    if_range = if_range.strip()
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        # Для If-Range используется строгое сравнение: слабые ETag не совпадают никогда
+        return if_range == etag
+    return parse_http_date_safe(if_range) == last_modified
+
+
+def get_chunk_size():
+    return getattr(settings, 'FILE_CHUNK_SIZE', 1024 * 1024)
+
+
+def file_iterator(file_name, chunk_size=None, start=0, length=None):
+    """
+    Функция file_iterator позволяет считывать файлы по частям,
+    управляя использованием памяти и делая программу более производительной.
+    file_name - имя файла в хранилище, start и length ограничивают чтение нужным диапазоном байт
+    """
+    chunk_size = chunk_size or get_chunk_size()
+    logger.debug('Итерация по файлу: %s, start=%s, length=%s', file_name, start, length)
+    path = get_local_path(file_name)
+    if path is not None and getattr(settings, 'FILE_ITERATOR_MMAP', False) and length:
+        with open(path, 'rb') as f:
+            # Отображаем файл в память: страницы читаются ядром без промежуточного буфера read()
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                end = start + length
+                for offset in range(start, end, chunk_size):
+                    yield mm[offset:min(offset + chunk_size, end)]
+        return
+    f = open_file(file_name, start, length)
+    try:
+        remaining = length
+        while remaining is None or remaining > 0:
+            chunk = f.read(chunk_size if remaining is None else min(chunk_size, remaining))
+            if not chunk:
+                break
+            if remaining is not None:
+                remaining -= len(chunk)
+            yield chunk
+    finally:
+        f.close()
+
+
+def multipart_iterator(file_name, ranges, parts_headers, boundary):
+    """
+    Формирует тело ответа multipart/byteranges для нескольких диапазонов
+    """
+    for (start, end), part_header in zip(ranges, parts_headers):
+        yield part_header
+        yield from file_iterator(file_name, start=start, length=end - start + 1)
+    yield f'\r\n--{boundary}--\r\n'.encode()
+
+
+def build_file_response(request, file: Storage, content_type):
+    """
+    Формирует ответ с содержимым файла с поддержкой Range/If-Range:
+    200 - файл целиком, 206 - один или несколько диапазонов, 416 - диапазон вне файла
+    """
+    size = file.size
+    etag = get_etag(file)
+    last_modified = get_last_modified(file)
+
+    ranges = None
+    if request.method == 'GET' and if_range_matches(request, etag, last_modified):
+        ranges = parse_range_header(request.headers.get('Range'), size)
+
+    if ranges == []:
+        logger.warning('Запрошенный диапазон вне файла: id_file=%s, Range=%s', file.id_file, request.headers.get('Range'))
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+    elif ranges and len(ranges) == 1:
+        start, end = ranges[0]
+        length = end - start + 1
+        response = FileResponse(open_file(file.file.name, start, length), status=206, content_type=content_type)
+        response.block_size = get_chunk_size()
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = length
+    elif ranges:
+        boundary = get_random_string(length=32)
+        parts_headers = [
+            (
+                f'\r\n--{boundary}\r\n'
+                f'Content-Type: {content_type}\r\n'
+                f'Content-Range: bytes {start}-{end}/{size}\r\n\r\n'
+            ).encode()
+            for start, end in ranges
+        ]
+        length = sum(len(h) for h in parts_headers) + sum(end - start + 1 for start, end in ranges) + len(f'\r\n--{boundary}--\r\n')
+        response = StreamingHttpResponse(
+            multipart_iterator(file.file.name, ranges, parts_headers, boundary),
+            status=206,
+            content_type=f'multipart/byteranges; boundary={boundary}',
+        )
+        response['Content-Length'] = length
+    else:
+        # FileResponse с локальным файлом отдаётся через wsgi.file_wrapper (sendfile), если сервер его поддерживает
+        response = FileResponse(open_file(file.file.name, 0, size), content_type=content_type)
+        response.block_size = get_chunk_size()
+        response['Content-Length'] = size
+
+    response['Accept-Ranges'] = 'bytes'
+    return set_cache_headers(response, file)
+
+
+def get_delivery_backend():
+    backend = getattr(settings, 'FILE_DELIVERY_BACKEND', DELIVERY_PYTHON).lower()
+    if backend not in (DELIVERY_PYTHON, DELIVERY_X_ACCEL_REDIRECT, DELIVERY_X_SENDFILE, DELIVERY_PRESIGNED):
+        logger.error('Неизвестный FILE_DELIVERY_BACKEND=%s, используется python', backend)
+        return DELIVERY_PYTHON
+    if backend == DELIVERY_PRESIGNED and not supports_presigned_urls():
+        logger.error('FILE_DELIVERY_BACKEND=presigned требует объектного хранилища, используется python')
+        return DELIVERY_PYTHON
+    if backend in (DELIVERY_X_ACCEL_REDIRECT, DELIVERY_X_SENDFILE) and get_local_path('') is None:
+        logger.error('FILE_DELIVERY_BACKEND=%s требует локального хранилища, используется python', backend)
+        return DELIVERY_PYTHON
+    return backend
+
+
+def build_offloaded_response(file: Storage, content_type, backend, disposition='attachment'):
+    """
+    Формирует ответ, по которому файл отдаёт клиенту не Django: пустой ответ с заголовком
+    для веб-сервера или перенаправление на подписанную ссылку объектного хранилища.
+    Range, Content-Length и кэширующие заголовки в этом случае обрабатывает веб-сервер (хранилище)
+    """
+    if backend == DELIVERY_PRESIGNED:
+        return HttpResponseRedirect(
+            get_presigned_download_url(file.file.name, file.original_name, content_type, disposition)
+        )
+    response = HttpResponse(content_type=content_type)
+    if backend == DELIVERY_X_ACCEL_REDIRECT:
+        prefix = settings.FILE_DELIVERY_ACCEL_PREFIX.rstrip('/')
+        response['X-Accel-Redirect'] = f'{prefix}/{urllib.parse.quote(file.file.name)}'
+    else:
+        response['X-Sendfile'] = get_local_path(file.file.name)
+    return response
+
+
+def deliver_file(request, file: Storage, content_type, disposition='attachment'):
+    """
+    Отдаёт файл выбранным в настройках способом.
+    При python-режиме файл стримится самим Django (с поддержкой Range), иначе передача
+    байтов отдаётся веб-серверу или объектному хранилищу и воркер gunicorn освобождается сразу
+    """
+    backend = get_delivery_backend()
+    if backend == DELIVERY_PYTHON:
+        return build_file_response(request, file, content_type)
+    logger.debug('Передача файла %s: %s', backend, file.file.name)
+    return build_offloaded_response(file, content_type, backend, disposition)
+
+
+class ZipStreamBuffer:
+    """
+    Буфер, в который zipfile пишет архив. У буфера нет seek/tell, поэтому zipfile пишет
+    записи с дескриптором данных после содержимого и архив можно отдавать клиенту по мере формирования
+    """
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        # Возвращает накопленные данные (пустой список, если писать нечего)
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return [data] if data else []
+
+
+def zip_iterator(entries, chunk_size=None):
+    """
+    Формирует ZIP-архив на лету, без временных файлов.
+    entries - список (имя в архиве, имя файла в хранилище, размер, дата изменения datetime).
+    Файлы не сжимаются (ZIP_STORED): архив собирается со скоростью чтения с диска
+    """
+    chunk_size = chunk_size or get_chunk_size()
+    buffer = ZipStreamBuffer()
+    with zipfile.ZipFile(buffer, mode='w', compression=zipfile.ZIP_STORED) as archive:
+        for arcname, file_name, size, modified in entries:
+            info = zipfile.ZipInfo(arcname, date_time=modified.timetuple()[:6])
+            info.compress_type = zipfile.ZIP_STORED
+            # Размер известен заранее, по нему zipfile сразу выбирает формат ZIP64 для больших файлов
+            info.file_size = size
+            with archive.open(info, mode='w') as dest:
+                for chunk in file_iterator(file_name, chunk_size):
+                    dest.write(chunk)
+                    yield from buffer.pop()
+            yield from buffer.pop()
+    yield from buffer.pop()
+
+
+def text_iterator(source, chunk_size=None, limit_bytes=None, limit_lines=None, encoding='utf-8'):
+    """
+    Читает открытый текстовый файл source по частям, инкрементально декодирует его из encoding
+    (кодировка определяется при загрузке, см. Storage.charset) и отдаёт в UTF-8.
+    Некорректные последовательности байт заменяются символом U+FFFD, а многобайтовые
+    символы на границе блоков собираются декодером, поэтому файл не загружается в память целиком.
+    При заданных limit_bytes/limit_lines чтение прекращается и в конец добавляется отметка об обрезке
+    """
+    chunk_size = chunk_size or get_chunk_size()
+    if limit_bytes:
+        chunk_size = min(chunk_size, limit_bytes)
+    decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+    read_bytes = 0
+    read_lines = 0
+    sent_bytes = 0
+    truncated = False
+
+    with contextlib.closing(source) as f:
+        while True:
+            size = chunk_size
+            if limit_bytes:
+                size = min(size, limit_bytes - read_bytes)
+                if size <= 0:
+                    truncated = bool(f.read(1))
+                    break
+            chunk = f.read(size)
+            final = not chunk
+            text = decoder.decode(chunk, final=final)
+            read_bytes += len(chunk)
+
+            if limit_lines and text.count('\n') >= limit_lines - read_lines:
+                # Обрезаем текст после последней разрешённой строки
+                cut = -1
+                for _ in range(limit_lines - read_lines):
+                    cut = text.index('\n', cut + 1)
+                truncated = cut + 1 < len(text) or bool(f.read(1))
+                text = text[:cut + 1]
+                final = True
+            elif limit_lines:
+                read_lines += text.count('\n')
+
+            if text:
+                data = text.encode('utf-8')
+                sent_bytes += len(data)
+                yield data
+            if final:
+                break
+
+    if truncated:
+        logger.debug('Предпросмотр файла обрезан, показано %s байт', sent_bytes)
+        yield f'\n\n[... файл обрезан, показано {sent_bytes} байт ...]\n'.encode('utf-8')
+
+
+def build_text_response(request, file: Storage, content_type):
+    """
+    Формирует потоковый ответ для просмотра текстового файла.
+    ?preview=1 - вернуть только начало файла (по умолчанию FILE_PREVIEW_KB килобайт),
+    ?preview_kb=N и ?preview_lines=N задают размер предпросмотра явно
+    """
+    limit_bytes = None
+    limit_lines = None
+    if is_preview_request(request):
+        limit_bytes = get_positive_int_param(request, 'preview_kb', settings.FILE_PREVIEW_KB) * 1024
+        limit_lines = get_positive_int_param(request, 'preview_lines', None)
+
+    # Файл открывается сразу, чтобы его отсутствие обнаружилось до начала ответа (FileNotFoundError)
+    source = open_file(file.file.name)
+    return StreamingHttpResponse(
+        text_iterator(source, limit_bytes=limit_bytes, limit_lines=limit_lines, encoding=file.charset or 'utf-8'),
+        content_type=f"{content_type}; charset=utf-8",
+    )
+
+
+def get_http_charset(file: Storage):
+    # Кодировка для заголовка Content-Type при отдаче файла без перекодирования (BOM браузер учитывает сам)
+    return 'utf-8' if file.charset in ('', 'utf-8-sig') else file.charset
+
+
+def is_preview_request(request):
+    return any(request.GET.get(name) for name in ('preview', 'preview_kb', 'preview_lines'))
+
+
+def get_positive_int_param(request, name, default):
+    try:
+        value = int(request.GET[name])
+    except (KeyError, ValueError):
+        return default
+    return value if value > 0 else default
@@ -0,0 +1,269 @@
+"""
+Доступ к содержимому файлов через хранилище Django (settings.STORAGES["default"]).
+Поддерживаются локальный диск (FileSystemStorage, MEDIA_ROOT) и S3-совместимое объектное хранилище
+(storages.backends.s3.S3Storage из пакета django-storages, см. FILE_STORAGE_BACKEND в settings.py).
+Код приложения работает с именами файлов в хранилище (FileField.name), а не с путями на диске
+"""
+import base64
+import contextlib
+import hashlib
+import os
+import urllib.parse
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def get_file_storage():
+    return default_storage
+
+
+def get_local_path(name, storage=None):
+    """
+    Путь к файлу на локальном диске или None, если хранилище не локальное
+    """
+    storage = storage or get_file_storage()
+    try:
+        return storage.path(name)
+    except NotImplementedError:
+        return None
+
+
+def is_local_storage(storage=None):
+    return get_local_path('', storage) is not None
+
+
+def supports_presigned_urls(storage=None):
+    # Подписанные ссылки выдаёт только объектное хранилище (S3Storage)
+    storage = storage or get_file_storage()
+    return hasattr(storage, 'bucket_name') and hasattr(storage, 'connection')
+
+
+def get_object_key(name, storage):
+    # Ключ объекта в бакете с учётом префикса location хранилища
+    return storage._normalize_name(name)
+
+
+class RangeFile:
+    """
+    Файловый объект, ограниченный диапазоном байт [start, start + length).
+    Наличие fileno() позволяет WSGI-серверу (wsgi.file_wrapper в gunicorn) отдать диапазон
+    через os.sendfile без копирования в Python: смещение берётся из текущей позиции файла,
+    а длина - из заголовка Content-Length.
+    tell() и seek() отсчитываются от начала диапазона: по ним FileResponse вычисляет Content-Length
+    """
+    def __init__(self, file_name, start, length):
+        self.file = open(file_name, 'rb')
+        self.file.seek(start)
+        self.start = start
+        self.length = length
+        self.remaining = length
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return b''
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def tell(self):
+        return self.length - self.remaining
+
+    def seekable(self):
+        return True
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self.tell()
+        elif whence == os.SEEK_END:
+            offset += self.length
+        offset = min(max(offset, 0), self.length)
+        self.file.seek(self.start + offset)
+        self.remaining = self.length - offset
+        return offset
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+class ObjectRangeFile:
+    """
+    Потоковое чтение диапазона объекта из S3-совместимого хранилища (GET с заголовком Range):
+    объект не скачивается целиком, данные читаются из ответа по мере отправки клиенту
+    """
+    def __init__(self, name, start, length, storage):
+        params = {'Bucket': storage.bucket_name, 'Key': get_object_key(name, storage)}
+        if start or length is not None:
+            end = '' if length is None else start + length - 1
+            params['Range'] = f'bytes={start}-{end}'
+        client = storage.connection.meta.client
+        try:
+            self.body = client.get_object(**params)['Body']
+        except client.exceptions.NoSuchKey:
+            # Как и для локального файла: отсутствие объекта - FileNotFoundError
+            raise FileNotFoundError(name)
+
+    def read(self, size=-1):
+        return self.body.read(None if size is None or size < 0 else size)
+
+    def close(self):
+        self.body.close()
+
+
+def open_file(name, start=0, length=None, storage=None):
+    """
+    Открывает файл хранилища для потокового чтения с позиции start (не более length байт)
+    """
+    storage = storage or get_file_storage()
+    path = get_local_path(name, storage)
+    if path is not None:
+        if length is None:
+            length = os.path.getsize(path) - start
+        return RangeFile(path, start, length)
+    if supports_presigned_urls(storage):
+        return ObjectRangeFile(name, start, length, storage)
+    # Прочие хранилища Django: читаем через стандартный интерфейс File
+    file = storage.open(name, 'rb')
+    if start:
+        file.seek(start)
+    return file
+
+
+def read_head(name, size, file_size, storage=None):
+    # Первые size байт файла хранилища (file_size - известный размер файла)
+    length = min(size, file_size)
+    if not length:
+        return b''
+    with contextlib.closing(open_file(name, 0, length, storage)) as f:
+        return f.read(length)
+
+
+def get_stored_file_sha256(name, storage=None, chunk_size=1024 * 1024):
+    # Подсчёт SHA-256 файла хранилища потоковым чтением
+    hasher = hashlib.sha256()
+    with contextlib.closing(open_file(name, storage=storage)) as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def iter_stored_files(directory, storage=None):
+    # Имена всех файлов каталога хранилища (рекурсивно)
+    storage = storage or get_file_storage()
+    try:
+        dirs, files = storage.listdir(directory)
+    except FileNotFoundError:
+        return
+    for file_name in files:
+        yield f'{directory}/{file_name}'
+    for dir_name in dirs:
+        yield from iter_stored_files(f'{directory}/{dir_name}', storage)
+
+
+def store_local_file(path, name, storage=None):
+    """
+    Сохраняет файл с локального диска в хранилище под именем name: в локальном хранилище -
+    жёсткой ссылкой без копирования, в объектном - потоковой загрузкой.
+    Возвращает False, если файл с таким именем в локальном хранилище уже есть
+    """
+    storage = storage or get_file_storage()
+    target = get_local_path(name, storage)
+    if target is not None:
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        # Временные файлы загрузки создаются с правами 0600, а ссылка разделяет права с исходным файлом:
+        # без chmod веб-сервер (X-Accel-Redirect, X-Sendfile) не сможет прочитать файл хранилища
+        os.chmod(path, getattr(storage, 'file_permissions_mode', None) or 0o644)
+        try:
+            os.link(path, target)
+        except FileExistsError:
+            return False
+        return True
+    with open(path, 'rb') as f:
+        storage.save(name, File(f))
+    return True
+
+
+def copy_stored_file(source, name, storage=None):
+    """
+    Копирует файл внутри хранилища: жёсткой ссылкой на локальном диске или копированием
+    на стороне объектного хранилища (байты не проходят через приложение).
+    Возвращает False, если файл с таким именем в локальном хранилище уже есть
+    """
+    storage = storage or get_file_storage()
+    source_path = get_local_path(source, storage)
+    if source_path is not None:
+        return store_local_file(source_path, name, storage)
+    if supports_presigned_urls(storage):
+        storage.connection.meta.client.copy(
+            {'Bucket': storage.bucket_name, 'Key': get_object_key(source, storage)},
+            storage.bucket_name,
+            get_object_key(name, storage),
+        )
+        return True
+    with storage.open(source, 'rb') as f:
+        storage.save(name, f)
+    return True
+
+
+def get_presigned_download_url(name, file_name, content_type, disposition='attachment', storage=None):
+    """
+    Подписанная ссылка на скачивание напрямую из объектного хранилища.
+    Имя и тип файла передаются хранилищу, чтобы оно отдало правильные заголовки ответа
+    """
+    storage = storage or get_file_storage()
+    return storage.url(
+        name,
+        parameters={
+            'ResponseContentDisposition': f"{disposition}; filename*=UTF-8''{urllib.parse.quote(file_name)}",
+            'ResponseContentType': content_type,
+        },
+        expire=settings.FILE_PRESIGNED_URL_TTL,
+    )
+
+
+def sha256_to_checksum(sha256):
+    # Контрольная сумма в формате S3 (x-amz-checksum-sha256): base64 от двоичного SHA-256
+    return base64.b64encode(bytes.fromhex(sha256)).decode()
+
+
+def get_presigned_upload(name, size, sha256, storage=None):
+    """
+    Подписанная ссылка для загрузки файла напрямую в объектное хранилище (PUT).
+    Хранилище само проверяет SHA-256 содержимого по заголовку x-amz-checksum-sha256,
+    поэтому после загрузки приложению не нужно читать файл для подсчёта хеша.
+    Возвращает (ссылка, заголовки, которые клиент должен передать в запросе)
+    """
+    storage = storage or get_file_storage()
+    checksum = sha256_to_checksum(sha256)
+    url = storage.connection.meta.client.generate_presigned_url(
+        'put_object',
+        Params={
+            'Bucket': storage.bucket_name,
+            'Key': get_object_key(name, storage),
+            'ContentLength': size,
+            'ChecksumSHA256': checksum,
+        },
+        ExpiresIn=settings.FILE_PRESIGNED_URL_TTL,
+    )
+    return url, {'Content-Length': str(size), 'x-amz-checksum-sha256': checksum}
+
+
+def get_stored_object_info(name, storage=None):
+    """
+    Размер и SHA-256 (в формате S3) загруженного объекта или None, если объекта нет
+    """
+    storage = storage or get_file_storage()
+    client = storage.connection.meta.client
+    try:
+        head = client.head_object(Bucket=storage.bucket_name, Key=get_object_key(name, storage), ChecksumMode='ENABLED')
+    except client.exceptions.ClientError:
+        return None
+    return head['ContentLength'], head.get('ChecksumSHA256')
@@ -0,0 +1,47 @@
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+
+# Дополнительная функция: разбор даты/времени из параметра запроса (2025-03-29 или 2025-03-29T13:53:00Z)
+def parse_datetime_param(name, value):
+    parsed = parse_datetime(value)
+    if parsed is None:
+        date = parse_date(value)
+        if date is None:
+            raise ValidationError({name: "Ожидается дата в формате ISO 8601."})
+        parsed = timezone.datetime(date.year, date.month, date.day)
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed, timezone.get_current_timezone())
+    return parsed
+
+
+# Дополнительная функция: разбор целого неотрицательного числа из параметра запроса
+def parse_int_param(name, value):
+    try:
+        parsed = int(value)
+    except ValueError:
+        raise ValidationError({name: "Ожидается целое число."})
+    if parsed < 0:
+        raise ValidationError({name: "Значение не может быть отрицательным."})
+    return parsed
+
+
+def filter_storage_queryset(queryset, params):
+    """
+    Фильтрация списка файлов по параметрам запроса:
+    name_prefix - начало имени файла (с учётом регистра, чтобы использовался индекс storage_user_name_prefix_idx),
+    size_min/size_max - размер в байтах (включительно),
+    uploaded_after/uploaded_before - дата загрузки (включительно)
+    """
+    if params.get('name_prefix'):
+        queryset = queryset.filter(original_name__startswith=params['name_prefix'])
+    if params.get('size_min'):
+        queryset = queryset.filter(size__gte=parse_int_param('size_min', params['size_min']))
+    if params.get('size_max'):
+        queryset = queryset.filter(size__lte=parse_int_param('size_max', params['size_max']))
+    if params.get('uploaded_after'):
+        queryset = queryset.filter(upload_date__gte=parse_datetime_param('uploaded_after', params['uploaded_after']))
+    if params.get('uploaded_before'):
+        queryset = queryset.filter(upload_date__lte=parse_datetime_param('uploaded_before', params['uploaded_before']))
+    return queryset
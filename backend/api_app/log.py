@@ -0,0 +1,193 @@
+"""
+Логирование приложения (подключается в settings.LOGGING).
+BackgroundHandler передаёт записи в очередь, а форматирование и запись в поток или файл
+выполняет фоновый поток, поэтому обработка запроса не ждёт вывода. При переполнении очереди
+записи отбрасываются, а не задерживают запрос.
+RouteFilter добавляет к записи имя маршрута текущего запроса (см. middleware.LogContextMiddleware),
+понижает подробность логов по маршрутам (LOG_ROUTE_LEVELS) и оставляет только часть
+информационных записей (LOG_SAMPLE_RATE, LOG_ROUTE_SAMPLE_RATES): решение принимается один раз
+на запрос, поэтому записи одного запроса сохраняются или отбрасываются вместе.
+Предупреждения и ошибки не отбрасываются. Токен специальной ссылки из адреса запроса
+в записях заменяется его началом (mask_token)
+"""
+import atexit
+import contextvars
+import copy
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, WatchedFileHandler
+
+# Стандартные атрибуты LogRecord: всё остальное передано через extra и выводится в JSON отдельными полями
+RECORD_ATTRIBUTES = frozenset(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'route'}
+
+
+def get_route(request):
+    # Имя маршрута (а не путь с id), чтобы количество значений не зависело от числа файлов
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    return match.url_name or match.route
+
+
+def mask_token(token):
+    # Токен специальной ссылки - действующий ключ к файлу, в логи попадает только его начало
+    return f'{token[:6]}…' if token else token
+
+
+def redact_token(record, request):
+    # Замена токена из адреса запроса в сообщении и в поле request (записи django.request о статусе ответа)
+    match = getattr(request, 'resolver_match', None)
+    token = match.kwargs.get('token') if match is not None else None
+    if not token:
+        return
+    masked = mask_token(token)
+    record.msg = record.getMessage().replace(token, masked)
+    record.args = None
+    if getattr(record, 'request', None) is not None:
+        record.request = str(record.request).replace(token, masked)
+
+
+def get_level(name):
+    level = logging.getLevelName(name.upper())
+    if not isinstance(level, int):
+        raise ValueError(f'Неизвестный уровень логирования: {name}')
+    return level
+
+
+class RequestLogContext:
+    """
+    Контекст логирования текущего запроса: маршрут определяется после разбора адреса,
+    решение о выборке - при первой информационной записи
+    """
+    __slots__ = ('request', 'sampled')
+
+    def __init__(self, request):
+        self.request = request
+        self.sampled = None
+
+
+current_context = contextvars.ContextVar('current_log_context', default=None)
+
+
+class RouteFilter(logging.Filter):
+    """
+    Маршрут запроса в record.route, уровни логов по маршрутам и выборка информационных записей.
+    Записи вне запроса (команды, фоновые потоки) проходят без изменений
+    """
+    def __init__(self, sample_rate=1.0, route_levels=None, route_sample_rates=None):
+        super().__init__()
+        self.sample_rate = float(sample_rate)
+        self.route_levels = {route: get_level(level) for route, level in (route_levels or {}).items()}
+        self.route_sample_rates = {route: float(rate) for route, rate in (route_sample_rates or {}).items()}
+
+    def filter(self, record):
+        context = current_context.get()
+        # Django пишет статус ответа уже после выхода из middleware, запрос передаётся в записи
+        redact_token(record, context.request if context is not None else getattr(record, 'request', None))
+        if context is None:
+            record.route = None
+            return True
+        route = record.route = get_route(context.request)
+        if record.levelno < self.route_levels.get(route, logging.NOTSET):
+            return False
+        if record.levelno >= logging.WARNING:
+            return True
+        if context.sampled is None:
+            rate = self.route_sample_rates.get(route, self.sample_rate)
+            context.sampled = rate >= 1 or random.random() < rate
+        return context.sampled
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Одна запись - одна строка JSON: time, level, logger, message, route, поля extra и exc_info
+    """
+    def format(self, record):
+        data = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        route = getattr(record, 'route', None)
+        if route:
+            data['route'] = route
+        for key, value in vars(record).items():
+            if key not in RECORD_ATTRIBUTES and not key.startswith('_'):
+                data[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data['exc_info'] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class BackgroundHandler(QueueHandler):
+    """
+    Запись логов в фоновом потоке: в stderr или в файл filename (WatchedFileHandler, совместим с logrotate).
+    Форматтер, заданный в LOGGING, применяется в фоновом потоке. Очередь ограничена queue_size записями,
+    при переполнении записи отбрасываются (количество - в dropped).
+    Поток запускается при первой записи в каждом процессе, поэтому работает и с воркерами gunicorn после fork
+    """
+    def __init__(self, filename='', queue_size=10000):
+        super().__init__(queue.Queue(queue_size))
+        self.target = WatchedFileHandler(filename, encoding='utf-8') if filename else logging.StreamHandler(sys.stderr)
+        self.listener = None
+        self.dropped = 0
+        self._pid = None
+        self._start_lock = threading.Lock()
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def setFormatter(self, fmt):
+        # Форматирование выполняется в фоновом потоке обработчиком вывода
+        self.target.setFormatter(fmt)
+
+    def prepare(self, record):
+        # Сообщение подставляется сразу: аргументы могут измениться после возврата из вызова логгера
+        record = copy.copy(record)
+        record.message = record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        if self._pid != os.getpid():
+            self.start()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def start(self):
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            atexit.register(self.stop)
+            self.listener = QueueListener(self.queue, self.target)
+            self.listener.start()
+            self._pid = os.getpid()
+
+    def _after_fork(self):
+        # Поток родительского процесса в дочернем не работает, а очередь и блокировка могли остаться занятыми
+        self.queue = queue.Queue(self.queue.maxsize)
+        self._start_lock = threading.Lock()
+        self.listener = None
+
+    def stop(self):
+        # Вывод оставшихся в очереди записей при завершении процесса
+        if self.listener is not None and self._pid == os.getpid():
+            self.listener.stop()
+            self.listener = None
+
+    def close(self):
+        self.stop()
+        self.target.close()
+        super().close()
@@ -0,0 +1,306 @@
+import os
+import threading
+import time
+import uuid
+from datetime import timedelta
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.db import DatabaseError, transaction
+from django.db.models import F, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from .file_storage import get_file_storage, get_stored_file_sha256, iter_stored_files, read_head
+from .models import Blob, ShareLink, Storage, UploadSession, User
+from .upload_handlers import HEAD_SIZE, get_content_metadata
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def clean_expired_tokens():
+    """
+    Удаление истекших и отозванных специальных ссылок одним запросом DELETE.
+    Возвращает количество удалённых ссылок
+    """
+    count, _ = ShareLink.objects.filter(Q(expiration__lt=timezone.now()) | Q(revoked=True)).delete()
+    if count:
+        logger.info('Удаление устаревших токенов: %s объектов', count)
+    return count
+
+
+def reap_deleted_files(batch_size=None, max_batches=None, retries=3):
+    """
+    Окончательное удаление файлов, помеченных удалёнными (Storage.deleted_at): записи удаляются
+    пакетами по batch_size (см. StorageQuerySet.bulk_delete), счётчики ссылок на содержимое
+    уменьшаются, файлы без ссылок удаляются с диска после фиксации транзакции
+    (содержимое без ссылок, оставшееся после сбоя, удаляется здесь же).
+    Пакет, который не удалось обработать за retries попыток, остаётся помеченным до следующего запуска.
+    Возвращает количество удалённых записей
+    """
+    batch_size = batch_size or settings.FILE_REAP_BATCH_SIZE
+    total = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        ids = list(
+            Storage.all_objects.filter(deleted_at__isnull=False)
+            .order_by('deleted_at', 'id_file')
+            .values_list('id_file', flat=True)[:batch_size]
+        )
+        if not ids:
+            break
+        for attempt in range(1, retries + 1):
+            try:
+                deleted = Storage.all_objects.filter(pk__in=ids, deleted_at__isnull=False).bulk_delete()
+                break
+            except DatabaseError:
+                if attempt == retries:
+                    logger.exception('Не удалось удалить пакет файлов (%s записей), повтор при следующем запуске', len(ids))
+                    return total
+                logger.warning('Ошибка при удалении пакета файлов, попытка %s из %s', attempt, retries)
+                time.sleep(attempt)
+        total += len(deleted)
+        batches += 1
+
+    # Содержимое без ссылок, которое не удалось удалить после фиксации транзакции (сбой процесса или хранилища)
+    orphans = list(Blob.objects.filter(refcount__lte=0).values_list('pk', flat=True)[:batch_size])
+    if orphans:
+        logger.info('Удалено содержимого без ссылок: %s', Blob.objects.delete_orphans(orphans))
+    if total:
+        logger.info('Удалено помеченных файлов: %s', total)
+    return total
+
+
+def scan_orphan_files(min_age=3600, dry_run=False, batch_size=None):
+    """
+    Сверка каталогов хранилища uploads, blobs и previews с таблицами storage и blobs, а временных файлов
+    загрузки (MEDIA_ROOT/uploads_staging и uploads_direct в хранилище) - с таблицей upload_sessions.
+    Удаляются файлы, на которые не ссылается ни одна запись (например, оставшиеся после сбоя
+    между фиксацией транзакции и удалением файла). Файлы моложе min_age секунд пропускаются,
+    чтобы не задеть загрузки, ещё не записанные в базу. При dry_run файлы только перечисляются.
+    Возвращает список имён файлов-сирот
+    """
+    batch_size = batch_size or settings.FILE_REAP_BATCH_SIZE
+    cutoff = timezone.now() - timedelta(seconds=min_age)
+    orphans = []
+
+    def check(batch, find_referenced, storage):
+        referenced = find_referenced(batch)
+        for name in batch:
+            if name in referenced:
+                continue
+            try:
+                if storage.get_modified_time(name) > cutoff:
+                    continue
+                if not dry_run:
+                    storage.delete(name)
+            except FileNotFoundError:
+                continue
+            except Exception:
+                logger.exception('Не удалось удалить файл-сироту %s', name)
+                continue
+            orphans.append(name)
+
+    def find_stored(names):
+        return set(Storage.all_objects.filter(file__in=names).values_list('file', flat=True)) | \
+            set(Blob.objects.filter(file__in=names).values_list('file', flat=True))
+
+    def find_sessions(names):
+        ids = [os.path.splitext(os.path.basename(name))[0] for name in names]
+        sessions = UploadSession.objects.filter(id_session__in=[i for i in ids if is_uuid(i)])
+        referenced = set()
+        for session in sessions:
+            referenced.update((f'uploads_staging/{session.id_session}.part', session.direct_name))
+        return referenced
+
+    def find_previews(names):
+        # Эскиз нужен, пока есть содержимое с его хешем (previews/ab/cd/<sha256>-<размер>.jpg)
+        hashes = {name: os.path.basename(name).split('-')[0] for name in names}
+        existing = set(Blob.objects.filter(sha256__in=set(hashes.values())).values_list('sha256', flat=True))
+        return {name for name, sha256 in hashes.items() if sha256 in existing}
+
+    file_storage = get_file_storage()
+    # Поблочная загрузка всегда пишет временные файлы на локальный диск, в MEDIA_ROOT
+    staging_storage = FileSystemStorage(location=settings.MEDIA_ROOT)
+    for directory, find_referenced, storage in (
+        ('uploads', find_stored, file_storage),
+        ('blobs', find_stored, file_storage),
+        ('uploads_direct', find_sessions, file_storage),
+        ('previews', find_previews, file_storage),
+        ('uploads_staging', find_sessions, staging_storage),
+    ):
+        batch = []
+        for name in iter_stored_files(directory, storage):
+            batch.append(name)
+            if len(batch) >= batch_size:
+                check(batch, find_referenced, storage)
+                batch = []
+        if batch:
+            check(batch, find_referenced, storage)
+
+    if orphans:
+        logger.info('Файлов-сирот %s: %s', 'найдено' if dry_run else 'удалено', len(orphans))
+    return orphans
+
+
+def relocate_legacy_files(batch_size=None, limit=None):
+    """
+    Перенос файлов, загруженных до дедупликации (плоский каталог uploads), в хранилище
+    по хешу содержимого blobs/ab/cd/<sha256>. Выполняется без остановки сервиса: хеш считается вне
+    транзакции, затем запись блокируется, файл копируется в Blob (на локальном диске - жёсткой ссылкой)
+    и запись Storage переключается на него; старый файл удаляется после фиксации транзакции.
+    Возвращает (количество перенесённых файлов, количество записей без файла в хранилище)
+    """
+    batch_size = batch_size or settings.FILE_REAP_BATCH_SIZE
+    storage = get_file_storage()
+    moved = 0
+    missing = 0
+    last_id = 0
+    while limit is None or moved < limit:
+        batch = list(
+            Storage.all_objects.filter(blob__isnull=True, id_file__gt=last_id)
+            .order_by('id_file')
+            .values_list('id_file', 'file')[:batch_size]
+        )
+        if not batch:
+            break
+        for id_file, name in batch:
+            last_id = id_file
+            if limit is not None and moved >= limit:
+                break
+            if not name or not storage.exists(name):
+                logger.warning('Файл не найден в хранилище при переносе: id_file=%s, %s', id_file, name)
+                missing += 1
+                continue
+            sha256 = get_stored_file_sha256(name, storage)
+            with transaction.atomic():
+                file = Storage.all_objects.select_for_update().filter(pk=id_file, blob__isnull=True, file=name).first()
+                if file is None:
+                    continue  # запись удалена или изменена параллельно
+                blob = Blob.objects.acquire(sha256, storage.size(name), stored_name=name)
+                Storage.all_objects.filter(pk=id_file).update(blob=blob, file=blob.file.name, sha256=sha256)
+                # Ссылка на файл в списке файлов изменилась
+                User.objects.bump_storage_version([file.id_user_id])
+                transaction.on_commit(lambda name=name: storage.delete(name), robust=True)
+            moved += 1
+
+    if moved or missing:
+        logger.info('Перенесено файлов в хранилище по хешу: %s, не найдено в хранилище: %s', moved, missing)
+    return moved, missing
+
+
+def backfill_file_metadata(batch_size=None, limit=None):
+    """
+    Заполнение MIME-типа, кодировки и SHA-256 у записей, загруженных до их сохранения в Storage.
+    Тип и кодировка определяются по началу файла (HEAD_SIZE байт, для объектного хранилища -
+    ранжированным запросом), хеш берётся из Blob. Если файла нет в хранилище, тип определяется по имени.
+    Записи обновляются пакетами по batch_size одним запросом на пакет.
+    Возвращает (количество обновлённых записей, количество записей без файла в хранилище)
+    """
+    batch_size = batch_size or settings.FILE_REAP_BATCH_SIZE
+    storage = get_file_storage()
+    updated = 0
+    missing = 0
+    last_id = 0
+    while limit is None or updated < limit:
+        count = batch_size if limit is None else min(batch_size, limit - updated)
+        batch = list(
+            Storage.all_objects.filter(content_type='', id_file__gt=last_id)
+            .select_related('blob')
+            .order_by('id_file')
+            .only('id_file', 'original_name', 'file', 'size', 'blob__sha256')[:count]
+        )
+        if not batch:
+            break
+        for file in batch:
+            try:
+                head = read_head(file.file.name, HEAD_SIZE, file.size, storage)
+            except FileNotFoundError:
+                logger.warning('Файл не найден в хранилище при заполнении метаданных: id_file=%s', file.id_file)
+                head = b''
+                missing += 1
+            file.content_type, file.charset = get_content_metadata(file.original_name, head)
+            if file.blob is not None:
+                file.sha256 = file.blob.sha256
+        # Изменяются только поля метаданных, параллельные переименования и удаления не затираются
+        Storage.all_objects.bulk_update(batch, ['content_type', 'charset', 'sha256'])
+        updated += len(batch)
+        last_id = batch[-1].id_file
+
+    if updated:
+        logger.info('Заполнены метаданные файлов: %s, не найдено в хранилище: %s', updated, missing)
+    return updated, missing
+
+
+def reconcile_usage(dry_run=False):
+    """
+    Пересчёт счётчиков used_bytes по таблице storage: суммы по всем пользователям считаются
+    одним агрегирующим запросом, расхождения исправляются одним UPDATE с подзапросом.
+    Возвращает список (id_user, было, стало) для пользователей с расхождением
+    """
+    usage = (
+        Storage.objects.filter(id_user=OuterRef('pk'))
+        .order_by().values('id_user').annotate(total=Sum('size')).values('total')
+    )
+    with transaction.atomic():
+        mismatched = list(
+            User.objects.select_for_update()
+            .annotate(actual=Coalesce(Subquery(usage), 0))
+            .exclude(used_bytes=F('actual'))
+            .values_list('id_user', 'used_bytes', 'actual')
+        )
+        if mismatched and not dry_run:
+            User.objects.filter(pk__in=[id_user for id_user, _, _ in mismatched]).update(
+                used_bytes=Coalesce(Subquery(usage), 0)
+            )
+
+    if mismatched:
+        logger.warning('Расхождение счётчиков занятого места у %s пользователей', len(mismatched))
+    return mismatched
+
+
+def is_uuid(value):
+    try:
+        uuid.UUID(value)
+    except ValueError:
+        return False
+    return True
+
+
+class PeriodicSweeper(threading.Thread):
+    """
+    Фоновый поток, периодически выполняющий функцию обслуживания в процессе приложения
+    """
+    def __init__(self, name, func, interval):
+        super().__init__(name=name, daemon=True)
+        self.func = func
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        from django.db import close_old_connections
+
+        while not self.stopped.wait(self.interval):
+            try:
+                self.func()
+            except Exception:
+                logger.exception('Ошибка фоновой задачи %s', self.name)
+            finally:
+                close_old_connections()
+
+    def stop(self):
+        self.stopped.set()
+
+
+_sweepers = {}
+_sweepers_lock = threading.Lock()
+
+
+def start_sweeper(name, func, interval):
+    # Запускаем не более одного потока с данным именем на процесс
+    with _sweepers_lock:
+        if name not in _sweepers:
+            sweeper = PeriodicSweeper(name, func, interval)
+            sweeper.start()
+            _sweepers[name] = sweeper
+            logger.info('Запущена фоновая задача %s с интервалом %s с', name, interval)
+        return _sweepers[name]
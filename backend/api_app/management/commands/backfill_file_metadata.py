@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from api_app.maintenance import backfill_file_metadata
+
+
+class Command(BaseCommand):
+    help = (
+        'Заполняет MIME-тип, кодировку и SHA-256 у файлов, загруженных до их сохранения в базе. '
+        'Можно запускать на работающем сервисе, повторно и по частям'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None, help='Количество записей, обновляемых за один запрос')
+        parser.add_argument('--limit', type=int, default=None, help='Обработать не более указанного количества файлов')
+
+    def handle(self, *args, **options):
+        updated, missing = backfill_file_metadata(batch_size=options['batch_size'], limit=options['limit'])
+        self.stdout.write(self.style.SUCCESS(f'Обновлено записей: {updated}, не найдено в хранилище: {missing}'))
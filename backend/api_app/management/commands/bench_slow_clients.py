@@ -0,0 +1,91 @@
+import asyncio
+import socket
+import statistics
+import time
+import urllib.parse
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = (
+        'Нагрузочный тест: N одновременных медленных клиентов скачивают файл по HTTP. '
+        'Позволяет сравнить запуск под gunicorn (WSGI) и под ASGI-сервером'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('url', help='Адрес скачивания, например http://127.0.0.1:8000/api/async/storage/download/1/')
+        parser.add_argument('--token', default='', help='Токен пользователя для заголовка Authorization')
+        parser.add_argument('--clients', type=int, default=100, help='Количество одновременных клиентов')
+        parser.add_argument('--rate-kb', type=int, default=256, help='Скорость чтения одного клиента, КБ/с')
+        parser.add_argument('--read-kb', type=int, default=16, help='Размер одного чтения из сокета, КБ')
+        parser.add_argument('--timeout', type=float, default=300, help='Ограничение времени на одного клиента, с')
+
+    def handle(self, *args, **options):
+        url = urllib.parse.urlsplit(options['url'])
+        if url.scheme != 'http':
+            raise CommandError('Поддерживаются только адреса http://')
+
+        started = time.monotonic()
+        results = asyncio.run(self.run_clients(url, options))
+        elapsed = time.monotonic() - started
+
+        done = [r for r in results if isinstance(r, tuple)]
+        failed = len(results) - len(done)
+        self.stdout.write(f'Клиентов: {len(results)}, успешно: {len(done)}, ошибок: {failed}, общее время: {elapsed:.2f} с')
+        if done:
+            ttfb = sorted(r[0] for r in done)
+            total = sorted(r[1] for r in done)
+            size = sum(r[2] for r in done)
+            self.stdout.write(
+                f'Первый байт, с: p50={statistics.median(ttfb):.2f} p95={ttfb[int(len(ttfb) * 0.95) - 1]:.2f} max={ttfb[-1]:.2f}'
+            )
+            self.stdout.write(
+                f'Скачивание, с: p50={statistics.median(total):.2f} p95={total[int(len(total) * 0.95) - 1]:.2f} max={total[-1]:.2f}'
+            )
+            self.stdout.write(f'Передано: {size / 1024 / 1024:.1f} МБ, {size / 1024 / 1024 / elapsed:.1f} МБ/с')
+
+    async def run_clients(self, url, options):
+        tasks = [
+            asyncio.wait_for(self.download(url, options), options['timeout'])
+            for _ in range(options['clients'])
+        ]
+        return await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def download(self, url, options):
+        """
+        Один медленный клиент: небольшой приёмный буфер сокета и чтение с ограничением скорости,
+        чтобы сервер не мог сразу сбросить весь файл в буферы ядра
+        """
+        read_size = options['read_kb'] * 1024
+        delay = read_size / (options['rate_kb'] * 1024)
+
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, read_size)
+        sock.setblocking(False)
+        started = time.monotonic()
+        await asyncio.get_running_loop().sock_connect(sock, (url.hostname, url.port or 80))
+        reader, writer = await asyncio.open_connection(sock=sock, limit=read_size * 2)
+
+        path = url.path + (f'?{url.query}' if url.query else '')
+        headers = f'GET {path} HTTP/1.1\r\nHost: {url.netloc}\r\nConnection: close\r\n'
+        if options['token']:
+            headers += f'Authorization: Token {options["token"]}\r\n'
+        writer.write((headers + '\r\n').encode())
+        await writer.drain()
+
+        try:
+            status_line = await reader.readline()
+            ttfb = time.monotonic() - started
+            if b' 200 ' not in status_line and b' 206 ' not in status_line:
+                raise RuntimeError(f'Неожиданный ответ: {status_line!r}')
+            await reader.readuntil(b'\r\n\r\n')
+            size = 0
+            while True:
+                chunk = await reader.read(read_size)
+                if not chunk:
+                    break
+                size += len(chunk)
+                await asyncio.sleep(delay)
+        finally:
+            writer.close()
+        return ttfb, time.monotonic() - started, size
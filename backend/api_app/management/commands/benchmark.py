@@ -0,0 +1,83 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from api_app.benchmarks import compare_results, is_benchmark_profile, run_benchmark
+
+
+class Command(BaseCommand):
+    help = (
+        'Замеряет задержку (p50/p95/p99), количество запросов к базе и пропускную способность '
+        'каждого маршрута api_app на данных generate_bench_data. Результаты можно сохранить в JSON '
+        'и сравнить с предыдущим запуском. Только для профиля backend_project.settings_bench'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=30, help='Количество замеряемых запросов на сценарий')
+        parser.add_argument('--warmup', type=int, default=3, help='Количество запросов прогрева (не учитываются)')
+        parser.add_argument('--only', default='', help='Сценарии или маршруты через запятую (по умолчанию все)')
+        parser.add_argument('--upload-size-kb', type=int, default=1024, help='Размер загружаемого файла, КБ')
+        parser.add_argument('--chunk-size-kb', type=int, default=1024, help='Размер блока поблочной загрузки, КБ')
+        parser.add_argument('--output', default='', help='Файл для сохранения результатов в JSON')
+        parser.add_argument('--compare', default='', help='JSON предыдущего запуска для сравнения')
+        parser.add_argument(
+            '--threshold', type=float, default=10.0,
+            help='Допустимый рост p50 при сравнении, %% (при регрессии команда завершается с ошибкой)',
+        )
+
+    def handle(self, *args, **options):
+        if not is_benchmark_profile():
+            raise CommandError('Команда запускается только с DJANGO_SETTINGS_MODULE=backend_project.settings_bench')
+
+        names = {name.strip() for name in options['only'].split(',') if name.strip()}
+        self.stdout.write(
+            f"{'Сценарий':<30} {'p50, мс':>9} {'p95, мс':>9} {'p99, мс':>9} {'запросов':>9} {'БД, мс':>8} {'МБ/с':>8}  ответы"
+        )
+        try:
+            report = run_benchmark(
+                requests=options['requests'],
+                warmup=options['warmup'],
+                names=names,
+                upload_size=options['upload_size_kb'] * 1024,
+                chunk_size=options['chunk_size_kb'] * 1024,
+                progress=self.write_result,
+            )
+        except LookupError as e:
+            raise CommandError(str(e))
+
+        for name, reason in report['skipped'].items():
+            self.stdout.write(self.style.WARNING(f'Пропущен сценарий {name}: {reason}'))
+        if report['uncovered_routes']:
+            self.stdout.write(self.style.WARNING(f"Маршруты без сценария: {', '.join(report['uncovered_routes'])}"))
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+            self.stdout.write(f"Результаты сохранены в {options['output']}")
+
+        if options['compare']:
+            with open(options['compare'], encoding='utf-8') as f:
+                previous = json.load(f)
+            self.compare(previous, report, options['threshold'])
+
+    def write_result(self, result):
+        statuses = ' '.join(f'{code}x{count}' for code, count in sorted(result['statuses'].items()))
+        line = (
+            f"{result['name']:<30} {result['p50_ms']:>9.2f} {result['p95_ms']:>9.2f} {result['p99_ms']:>9.2f} "
+            f"{result['queries']:>9.1f} {result['db_ms']:>8.2f} {result['mb_per_s'] or 0:>8.1f}  {statuses}"
+        )
+        # Ответы с ошибкой означают, что сценарий замеряет не тот путь выполнения
+        if any(code.startswith(('4', '5')) for code in result['statuses']):
+            line = self.style.WARNING(line)
+        self.stdout.write(line)
+
+    def compare(self, previous, report, threshold):
+        self.stdout.write(f"\nСравнение с коммитом {previous.get('meta', {}).get('commit')}:")
+        regressions = []
+        for name, old_p50, new_p50, change, old_queries, new_queries, regression in compare_results(previous, report, threshold):
+            line = f'{name:<30} p50 {old_p50:.2f} -> {new_p50:.2f} мс ({change:+.1f}%), запросов {old_queries} -> {new_queries}'
+            if regression:
+                regressions.append(name)
+                line = self.style.ERROR(line)
+            self.stdout.write(line)
+        if regressions:
+            raise CommandError(f"Регрессия производительности: {', '.join(regressions)}")
+        self.stdout.write(self.style.SUCCESS('Регрессий не найдено'))
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from api_app.maintenance import clean_expired_tokens
+
+
+class Command(BaseCommand):
+    help = 'Очищает истекшие токены специальных ссылок на файлы (для запуска по расписанию, например из cron)'
+
+    def handle(self, *args, **options):
+        count = clean_expired_tokens()
+        self.stdout.write(self.style.SUCCESS(f'Очищено истекших токенов: {count}'))
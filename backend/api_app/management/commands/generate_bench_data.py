@@ -0,0 +1,52 @@
+import shutil
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from api_app.benchmarks import BENCH_OWNER, generate_data, is_benchmark_profile
+from api_app.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        'Создаёт синтетические данные для бенчмарка: пользователей, записи файлов с общим пулом содержимого '
+        'и большие файлы для замера скачивания. Только для профиля backend_project.settings_bench'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10000, help='Количество пользователей')
+        parser.add_argument('--files', type=int, default=1000000, help='Количество записей файлов')
+        parser.add_argument('--owner-files', type=int, default=1000, help='Сколько из них у замеряемого пользователя bench_owner')
+        parser.add_argument('--blobs', type=int, default=1000, help='Количество уникального содержимого в пуле')
+        parser.add_argument('--blob-max-kb', type=int, default=64, help='Максимальный размер файла из пула, КБ')
+        parser.add_argument('--large-files', type=int, default=1, help='Количество больших файлов')
+        parser.add_argument('--large-size-mb', type=int, default=1024, help='Размер большого файла, МБ')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Количество записей в одном INSERT')
+        parser.add_argument('--seed', type=int, default=0, help='Начальное значение генератора случайных чисел')
+        parser.add_argument('--flush', action='store_true', help='Предварительно очистить базу и каталог файлов бенчмарка')
+
+    def handle(self, *args, **options):
+        if not is_benchmark_profile():
+            raise CommandError('Команда запускается только с DJANGO_SETTINGS_MODULE=backend_project.settings_bench')
+
+        if options['flush']:
+            call_command('flush', interactive=False, verbosity=0)
+            if settings.FILE_STORAGE_BACKEND == 'local':
+                shutil.rmtree(settings.MEDIA_ROOT, ignore_errors=True)
+        elif User.objects.filter(username=BENCH_OWNER).exists():
+            raise CommandError('Данные бенчмарка уже созданы, для пересоздания используйте --flush')
+
+        summary = generate_data(
+            users=options['users'],
+            files=options['files'],
+            owner_files=options['owner_files'],
+            blobs=options['blobs'],
+            blob_max_size=options['blob_max_kb'] * 1024,
+            large_files=options['large_files'],
+            large_size=options['large_size_mb'] * 1024 * 1024,
+            batch_size=options['batch_size'],
+            seed=options['seed'],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Создано пользователей: {summary['users']}, файлов: {summary['files']}, "
+            f"уникального содержимого: {summary['blobs']} за {summary['seconds']} с"
+        ))
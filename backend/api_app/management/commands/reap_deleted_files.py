@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from api_app.maintenance import reap_deleted_files, scan_orphan_files
+
+
+class Command(BaseCommand):
+    help = (
+        'Окончательно удаляет файлы, помеченные удалёнными (для запуска по расписанию, например из cron). '
+        'С --orphans дополнительно сверяет файлы хранилища с базой и удаляет файлы-сироты'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None, help='Количество файлов в одной транзакции')
+        parser.add_argument('--orphans', action='store_true', help='Найти и удалить файлы на диске без записей в базе')
+        parser.add_argument('--min-age', type=int, default=3600, help='Не трогать файлы-сироты моложе указанного числа секунд')
+        parser.add_argument('--dry-run', action='store_true', help='Только показать файлы-сироты, не удаляя их')
+
+    def handle(self, *args, **options):
+        if not options['dry_run']:
+            count = reap_deleted_files(batch_size=options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(f'Удалено помеченных файлов: {count}'))
+
+        if options['orphans']:
+            orphans = scan_orphan_files(
+                min_age=options['min_age'], dry_run=options['dry_run'], batch_size=options['batch_size']
+            )
+            for name in orphans:
+                self.stdout.write(name)
+            action = 'Найдено' if options['dry_run'] else 'Удалено'
+            self.stdout.write(self.style.SUCCESS(f'{action} файлов-сирот: {len(orphans)}'))
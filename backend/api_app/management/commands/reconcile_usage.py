@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from api_app.maintenance import reconcile_usage
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчитывает занятое пользователями место (used_bytes) по таблице storage и исправляет '
+        'расхождения счётчиков, например после ручного изменения данных в базе'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Только показать расхождения, не исправляя их')
+
+    def handle(self, *args, **options):
+        mismatched = reconcile_usage(dry_run=options['dry_run'])
+        for id_user, used_bytes, actual in mismatched:
+            self.stdout.write(f'id_user={id_user}: {used_bytes} -> {actual}')
+        action = 'Найдено' if options['dry_run'] else 'Исправлено'
+        self.stdout.write(self.style.SUCCESS(f'{action} расхождений: {len(mismatched)}'))
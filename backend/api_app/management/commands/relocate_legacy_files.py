@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from api_app.maintenance import relocate_legacy_files
+
+
+class Command(BaseCommand):
+    help = (
+        'Переносит файлы из плоского каталога uploads в хранилище по хешу содержимого '
+        '(blobs/ab/cd/<sha256>). Можно запускать на работающем сервисе, повторно и по частям'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None, help='Количество записей, выбираемых за один запрос')
+        parser.add_argument('--limit', type=int, default=None, help='Перенести не более указанного количества файлов')
+
+    def handle(self, *args, **options):
+        moved, missing = relocate_legacy_files(batch_size=options['batch_size'], limit=options['limit'])
+        self.stdout.write(self.style.SUCCESS(f'Перенесено файлов: {moved}, не найдено на диске: {missing}'))
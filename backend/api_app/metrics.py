@@ -0,0 +1,155 @@
+"""
+Метрики приложения в формате Prometheus (адрес api/metrics/) и замеры для заголовка Server-Timing.
+Замеры запроса (количество и время запросов к базе, именованные интервалы timing()) собираются
+в RequestMetrics текущего запроса (см. middleware.MetricsMiddleware), в том числе в асинхронных
+представлениях: контекст передаётся в потоки sync_to_async.
+Метрики Prometheus собирает пакет prometheus_client; если он не установлен, метрики недоступны,
+а Server-Timing работает. При нескольких воркерах gunicorn метрики процессов объединяются
+через каталог PROMETHEUS_MULTIPROC_DIR (см. deploytoserver.md)
+"""
+import contextlib
+import contextvars
+import os
+import time
+from django.conf import settings
+
+try:
+    import prometheus_client
+    from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, multiprocess
+except ImportError:  # prometheus_client не установлен - метрики Prometheus не собираются
+    prometheus_client = None
+
+# Границы корзин гистограмм: время (секунд) и количество запросов к базе
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+STREAM_BUCKETS = (0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 3600)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+class RequestMetrics:
+    """
+    Замеры одного запроса: запросы к базе и именованные интервалы (секунд) для Server-Timing
+    """
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.db_queries = 0
+        self.db_time = 0.0
+        self.timings = {}
+
+    def get_server_timing(self, elapsed):
+        # Server-Timing: app;dur=12.3, db;dur=1.2;desc="3 queries", storage;dur=5.0
+        entries = [f'app;dur={elapsed * 1000:.1f}', f'db;dur={self.db_time * 1000:.1f};desc="{self.db_queries} queries"']
+        entries += [f'{name};dur={duration * 1000:.1f}' for name, duration in self.timings.items()]
+        return ', '.join(entries)
+
+
+current_request = contextvars.ContextVar('current_request_metrics', default=None)
+
+
+def db_execute_wrapper(execute, sql, params, many, context):
+    # Учёт запросов к базе в замерах текущего запроса (вне запроса, например в фоновых потоках, не учитываются)
+    metrics = current_request.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.db_queries += 1
+        metrics.db_time += time.perf_counter() - started
+
+
+def install_db_wrapper(sender, connection, **kwargs):
+    # Обработчик сигнала connection_created: обёртка добавляется каждому соединению с базой один раз
+    if db_execute_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(db_execute_wrapper)
+
+
+@contextlib.contextmanager
+def timing(name):
+    """
+    Замер участка обработки запроса (например, записи в хранилище) для Server-Timing:
+    with timing('storage'): ...
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics = current_request.get()
+        if metrics is not None:
+            metrics.timings[name] = metrics.timings.get(name, 0.0) + time.perf_counter() - started
+
+
+def is_enabled():
+    return prometheus_client is not None and settings.METRICS_ENABLED
+
+
+if prometheus_client is not None:
+    REQUEST_LATENCY = Histogram(
+        'mycloud_http_request_duration_seconds', 'Время обработки запроса до начала отправки ответа',
+        ['route', 'method', 'status'], buckets=LATENCY_BUCKETS,
+    )
+    DB_QUERIES = Histogram(
+        'mycloud_db_queries_per_request', 'Количество запросов к базе за один запрос',
+        ['route'], buckets=QUERY_BUCKETS,
+    )
+    DB_TIME = Histogram(
+        'mycloud_db_duration_seconds_per_request', 'Суммарное время запросов к базе за один запрос',
+        ['route'], buckets=LATENCY_BUCKETS,
+    )
+    BYTES_RECEIVED = Counter('mycloud_http_request_bytes', 'Получено байт в телах запросов (загрузки файлов)', ['route'])
+    # estimated="true" - объём файла, переданного сервером через sendfile, взят из Content-Length:
+    # при обрыве соединения фактически отправлено меньше
+    BYTES_SENT = Counter(
+        'mycloud_http_response_bytes', 'Отправлено байт в телах ответов (скачивания файлов)', ['route', 'estimated'],
+    )
+    STREAM_DURATION = Histogram(
+        'mycloud_http_stream_duration_seconds', 'Время отправки потокового ответа (файла, архива) клиенту',
+        ['route'], buckets=STREAM_BUCKETS,
+    )
+    ACTIVE_STREAMS = Gauge(
+        'mycloud_http_active_streams', 'Потоковые ответы, отправляемые в данный момент',
+        ['route'], multiprocess_mode='livesum',
+    )
+    SHARE_LINK_REQUESTS = Counter(
+        'mycloud_share_link_requests', 'Запросы скачивания по специальной ссылке по результату', ['result'],
+    )
+
+
+def observe_request(route, method, status_code, elapsed, metrics: RequestMetrics, received):
+    REQUEST_LATENCY.labels(route, method, status_code).observe(elapsed)
+    DB_QUERIES.labels(route).observe(metrics.db_queries)
+    DB_TIME.labels(route).observe(metrics.db_time)
+    if received:
+        BYTES_RECEIVED.labels(route).inc(received)
+
+
+def observe_response(route, sent):
+    BYTES_SENT.labels(route, 'false').inc(sent)
+
+
+def stream_started(route):
+    ACTIVE_STREAMS.labels(route).inc()
+
+
+def stream_finished(route, sent, elapsed, estimated=False):
+    ACTIVE_STREAMS.labels(route).dec()
+    STREAM_DURATION.labels(route).observe(elapsed)
+    BYTES_SENT.labels(route, 'true' if estimated else 'false').inc(sent)
+
+
+def record_share_link(result):
+    """
+    Результат запроса по специальной ссылке: hit, not_modified, not_found, expired, limit, missing_file
+    """
+    if is_enabled():
+        SHARE_LINK_REQUESTS.labels(result).inc()
+
+
+def export_metrics():
+    # Текст метрик для Prometheus и его MIME-тип; при PROMETHEUS_MULTIPROC_DIR - суммарно по всем процессам
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = prometheus_client.REGISTRY
+    return prometheus_client.generate_latest(registry), prometheus_client.CONTENT_TYPE_LATEST
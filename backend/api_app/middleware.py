@@ -0,0 +1,134 @@
+import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from . import metrics
+from .log import RequestLogContext, current_context, get_route
+from .metrics import RequestMetrics, current_request
+
+
+class MetricsMiddleware:
+    """
+    Замеры каждого запроса: время обработки, количество и время запросов к базе, объём полученных
+    и отправленных данных. Для потоковых ответов (файлы, архивы) учитываются время и объём отправки
+    до закрытия ответа и количество одновременно отправляемых ответов.
+    При METRICS_SERVER_TIMING замеры запроса возвращаются в заголовке Server-Timing.
+    Работает и в синхронном (WSGI), и в асинхронном (ASGI) режиме
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        request_metrics = RequestMetrics()
+        token = current_request.set(request_metrics)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_request.reset(token)
+        return self.finish(request, response, request_metrics)
+
+    async def __acall__(self, request):
+        request_metrics = RequestMetrics()
+        token = current_request.set(request_metrics)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_request.reset(token)
+        return self.finish(request, response, request_metrics)
+
+    def finish(self, request, response, request_metrics):
+        elapsed = time.perf_counter() - request_metrics.started
+        if metrics.is_enabled():
+            route = get_route(request)
+            length = request.META.get('CONTENT_LENGTH') or ''
+            received = int(length) if length.isdigit() else 0
+            metrics.observe_request(route, request.method, response.status_code, elapsed, request_metrics, received)
+            if response.streaming:
+                self.track_stream(response, route)
+            else:
+                metrics.observe_response(route, len(response.content))
+        if settings.METRICS_SERVER_TIMING:
+            response['Server-Timing'] = request_metrics.get_server_timing(elapsed)
+        return response
+
+    def track_stream(self, response, route):
+        """
+        Учёт отправки потокового ответа до его закрытия сервером. Считаются фактически отданные
+        блоки, поэтому прерванное скачивание учитывается отправленной частью. FileResponse в режиме
+        WSGI не оборачивается, чтобы сервер мог передать файл через sendfile (wsgi.file_wrapper):
+        его объём берётся из Content-Length и помечается как оценка (estimated)
+        """
+        started = time.perf_counter()
+        sent = [0]
+        estimated = getattr(response, 'file_to_stream', None) is not None and not self.is_async
+        if estimated:
+            sent[0] = int(response.get('Content-Length') or 0)
+        elif response.is_async:
+            response.streaming_content = acount_chunks(response.streaming_content, sent)
+        else:
+            response.streaming_content = count_chunks(response.streaming_content, sent)
+
+        metrics.stream_started(route)
+        close = response.close
+        finished = []
+
+        def close_and_record():
+            try:
+                close()
+            finally:
+                # close может вызываться повторно (тестовый клиент, ASGI-обработчик)
+                if not finished:
+                    finished.append(True)
+                    metrics.stream_finished(route, sent[0], time.perf_counter() - started, estimated)
+
+        response.close = close_and_record
+
+
+class LogContextMiddleware:
+    """
+    Контекст логирования запроса для api_app.log.RouteFilter: имя маршрута в записях логов,
+    уровни и выборка логов по маршрутам
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        token = current_context.set(RequestLogContext(request))
+        try:
+            return self.get_response(request)
+        finally:
+            current_context.reset(token)
+
+    async def __acall__(self, request):
+        token = current_context.set(RequestLogContext(request))
+        try:
+            return await self.get_response(request)
+        finally:
+            current_context.reset(token)
+
+
+def count_chunks(content, sent):
+    for chunk in content:
+        sent[0] += len(chunk)
+        yield chunk
+
+
+async def acount_chunks(content, sent):
+    async for chunk in content:
+        sent[0] += len(chunk)
+        yield chunk
@@ -0,0 +1,32 @@
+# Generated by Django 5.1.7 on 2026-10-17 15:17
+
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_app', '0006_alter_storage_last_download_date'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UploadSession',
+            fields=[
+                ('id_session', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('original_name', models.CharField(max_length=128)),
+                ('comment', models.CharField(blank=True, default='', max_length=128)),
+                ('size', models.BigIntegerField()),
+                ('received_ranges', models.JSONField(blank=True, default=list)),
+                ('created_date', models.DateTimeField(auto_now_add=True, db_column='createddate')),
+                ('updated_date', models.DateTimeField(auto_now=True, db_column='updateddate')),
+                ('id_user', models.ForeignKey(db_column='user_id', on_delete=django.db.models.deletion.CASCADE, related_name='upload_sessions', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'upload_sessions',
+            },
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.1.7 on 2026-10-17 15:19
+
+import api_app.models
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_app', '0007_uploadsession'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Blob',
+            fields=[
+                ('id_blob', models.AutoField(primary_key=True, serialize=False)),
+                ('sha256', models.CharField(max_length=64, unique=True)),
+                ('size', models.BigIntegerField()),
+                ('file', models.FileField(max_length=255, upload_to=api_app.models.blob_upload_to)),
+                ('refcount', models.IntegerField(default=0)),
+                ('created_date', models.DateTimeField(auto_now_add=True, db_column='createddate')),
+            ],
+            options={
+                'db_table': 'blobs',
+            },
+        ),
+        migrations.AddField(
+            model_name='storage',
+            name='blob',
+            field=models.ForeignKey(blank=True, db_column='blob_id', null=True, on_delete=django.db.models.deletion.PROTECT, related_name='storages', to='api_app.blob'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.1.7 on 2026-10-17 15:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_app', '0008_blob'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='storage',
+            index=models.Index(fields=['id_user', '-upload_date', '-id_file'], name='storage_user_upload_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='storage',
+            index=models.Index(fields=['id_user', 'original_name', 'id_file'], name='storage_user_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='storage',
+            index=models.Index(fields=['id_user', 'size', 'id_file'], name='storage_user_size_idx'),
+        ),
+    ]
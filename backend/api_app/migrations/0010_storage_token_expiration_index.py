@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-17 15:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_app', '0009_storage_list_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='storage',
+            name='token_expiration',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.1.7 on 2026-10-17 15:22
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def copy_storage_tokens(apps, schema_editor):
+    # Переносим действующие ссылки из полей Storage.token/token_expiration в отдельную таблицу
+    Storage = apps.get_model('api_app', 'Storage')
+    ShareLink = apps.get_model('api_app', 'ShareLink')
+    ShareLink.objects.bulk_create(
+        ShareLink(storage_id=storage.id_file, token=storage.token, expiration=storage.token_expiration)
+        for storage in Storage.objects.filter(token__isnull=False).only('id_file', 'token', 'token_expiration')
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_app', '0010_storage_token_expiration_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShareLink',
+            fields=[
+                ('id_link', models.AutoField(primary_key=True, serialize=False)),
+                ('token', models.CharField(max_length=32, unique=True)),
+                ('created_date', models.DateTimeField(auto_now_add=True, db_column='createddate')),
+                ('expiration', models.DateTimeField(blank=True, db_index=True, null=True)),
+                ('max_downloads', models.PositiveIntegerField(blank=True, null=True)),
+                ('download_count', models.PositiveIntegerField(default=0)),
+                ('revoked', models.BooleanField(default=False)),
+                ('storage', models.ForeignKey(db_column='file_id', on_delete=django.db.models.deletion.CASCADE, related_name='share_links', to='api_app.storage')),
+            ],
+            options={
+                'db_table': 'share_links',
+            },
+        ),
+        migrations.RunPython(copy_storage_tokens, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='storage',
+            name='token',
+        ),
+        migrations.RemoveField(
+            model_name='storage',
+            name='token_expiration',
+        ),
+    ]
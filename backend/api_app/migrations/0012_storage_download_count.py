@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-17 15:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_app', '0011_sharelink'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='storage',
+            name='download_count',
+            field=models.PositiveBigIntegerField(db_column='downloadcount', default=0),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.1.7 on 2026-10-17 15:34
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_app', '0012_storage_download_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='storage',
+            name='deleted_at',
+            field=models.DateTimeField(blank=True, db_column='deletedat', db_index=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='storage',
+            name='id_user',
+            field=models.ForeignKey(db_column='user_id', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='storages', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.1.7 on 2026-10-17 15:44
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def fill_used_bytes(apps, schema_editor):
+    # Начальное значение счётчика - суммарный размер файлов пользователя (кроме помеченных удалёнными)
+    User = apps.get_model('api_app', 'User')
+    Storage = apps.get_model('api_app', 'Storage')
+    usage = (
+        Storage.objects.filter(id_user=OuterRef('pk'), deleted_at__isnull=True)
+        .order_by().values('id_user').annotate(total=Sum('size')).values('total')
+    )
+    User.objects.update(used_bytes=Coalesce(Subquery(usage), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_app', '0014_uploadsession_sha256'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='quota_bytes',
+            field=models.BigIntegerField(blank=True, db_column='quotabytes', null=True),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='used_bytes',
+            field=models.BigIntegerField(db_column='usedbytes', default=0),
+        ),
+        migrations.RunPython(fill_used_bytes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-17 15:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_app', '0015_user_quota'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='storage_version',
+            field=models.PositiveBigIntegerField(db_column='storageversion', default=0),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.1.7 on 2026-10-17 15:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_app', '0016_user_storage_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='storage',
+            name='charset',
+            field=models.CharField(blank=True, default='', max_length=32),
+        ),
+        migrations.AddField(
+            model_name='storage',
+            name='content_type',
+            field=models.CharField(blank=True, db_column='contenttype', default='', max_length=128),
+        ),
+        migrations.AddField(
+            model_name='storage',
+            name='sha256',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+    ]
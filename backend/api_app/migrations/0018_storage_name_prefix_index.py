@@ -0,0 +1,17 @@
+# Generated by Django 5.1.7 on 2026-10-17 17:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_app', '0017_storage_content_metadata'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='storage',
+            index=models.Index(fields=['id_user', 'original_name'], name='storage_user_name_prefix_idx', opclasses=['int4_ops', 'varchar_pattern_ops']),
+        ),
+    ]
@@ -1,6 +1,17 @@
 import os
-from django.db import models
+import uuid
+from collections import Counter
+from django.conf import settings
+from django.db import IntegrityError, models, transaction
+from django.db.models import Case, F, Q, When
+from django.utils import timezone
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, PermissionsMixin
+from django.core.files.storage import default_storage
+from .file_storage import copy_stored_file, store_local_file
+from .previews import delete_previews
+import logging
+
+logger = logging.getLogger(__name__)
 
 class UserManager(BaseUserManager):
     def create_user(self, email, username, password=None, **extra_fields):
@@ -10,6 +21,8 @@ class UserManager(BaseUserManager):
             raise ValueError('Поле пользователя должно быть заполнено')
 
         email = self.normalize_email(email)
+        # Квота новых пользователей по умолчанию (0 - без ограничения)
+        extra_fields.setdefault('quota_bytes', settings.USER_QUOTA_BYTES or None)
         user = self.model(email=email, username=username, **extra_fields)
         user.set_password(password)
         user.save(using=self._db)
@@ -21,6 +34,60 @@ class UserManager(BaseUserManager):
 
         return self.create_user(email, username, password, **extra_fields)
 
+    def has_space(self, id_user, size):
+        """
+        Предварительная проверка квоты (одна строка по первичному ключу, без подсчёта файлов).
+        Окончательно место резервирует reserve_space при сохранении файла
+        """
+        row = self.filter(pk=id_user).values_list('quota_bytes', 'used_bytes').first()
+        if row is None:
+            return True
+        quota_bytes, used_bytes = row
+        return quota_bytes is None or used_bytes + size <= quota_bytes
+
+    def reserve_space(self, id_user, size):
+        """
+        Увеличивает used_bytes пользователя на size одним условным UPDATE, если квота позволяет:
+        проверка и изменение выполняются атомарно, параллельные загрузки не превысят квоту.
+        Вызывается внутри транзакции сохранения файла, тем же запросом меняется версия списка файлов.
+        Если места нет, выбрасывает QuotaExceeded
+        """
+        updated = self.filter(pk=id_user).filter(
+            Q(quota_bytes__isnull=True) | Q(used_bytes__lte=F('quota_bytes') - size)
+        ).update(used_bytes=F('used_bytes') + size, storage_version=F('storage_version') + 1)
+        if not updated:
+            raise QuotaExceeded(id_user, size)
+
+    def release_space_many(self, sizes):
+        """
+        Уменьшает used_bytes сразу у нескольких пользователей (sizes: {id_user: байт}) одним UPDATE,
+        заодно меняя версию их списков файлов
+        """
+        sizes = {id_user: size for id_user, size in sizes.items() if id_user}
+        if not sizes:
+            return
+        self.filter(pk__in=sizes).update(
+            used_bytes=Case(
+                *[When(pk=id_user, then=F('used_bytes') - size) for id_user, size in sizes.items()],
+                default=F('used_bytes'),
+                output_field=models.BigIntegerField(),
+            ),
+            storage_version=F('storage_version') + 1,
+        )
+
+    def bump_storage_version(self, ids):
+        # Список файлов пользователей изменился: закэшированные клиентами копии списка устарели
+        self.filter(pk__in=ids).update(storage_version=F('storage_version') + 1)
+
+class QuotaExceeded(Exception):
+    """
+    Файл не помещается в квоту пользователя
+    """
+    def __init__(self, id_user, size):
+        super().__init__(f'Превышена квота пользователя {id_user}: {size} байт')
+        self.id_user = id_user
+        self.size = size
+
 class User(AbstractBaseUser, PermissionsMixin):
     id_user = models.AutoField(primary_key=True)
     email = models.EmailField(max_length=128, unique=True, null=False)
@@ -31,6 +98,15 @@ class User(AbstractBaseUser, PermissionsMixin):
     is_active = models.BooleanField(default=True)
     is_staff = models.BooleanField(default=False)
 
+    # Квота на суммарный размер файлов (байт), None - без ограничения
+    quota_bytes = models.BigIntegerField(null=True, blank=True, db_column="quotabytes")
+    # Суммарный размер файлов пользователя (кроме помеченных удалёнными), поддерживается при загрузке
+    # и удалении файлов; пересчитывается командой `python manage.py reconcile_usage`
+    used_bytes = models.BigIntegerField(default=0, db_column="usedbytes")
+    # Версия списка файлов пользователя для ETag ответа со списком: увеличивается при загрузке,
+    # переименовании, удалении файлов и записи статистики скачиваний
+    storage_version = models.PositiveBigIntegerField(default=0, db_column="storageversion")
+
     objects = UserManager()
 
     USERNAME_FIELD = 'username'
@@ -42,28 +118,319 @@ class User(AbstractBaseUser, PermissionsMixin):
     def __str__(self):
         return self.username
 
+def blob_upload_to(blob, filename):
+    # Содержимое хранится по хешу: blobs/ab/cd/abcd...
+    return os.path.join('blobs', blob.sha256[:2], blob.sha256[2:4], blob.sha256)
+
+class BlobManager(models.Manager):
+    def acquire(self, sha256, size, content=None, path=None, stored_name=None):
+        """
+        Возвращает Blob с заданным хешем и увеличивает его счётчик ссылок.
+        Если такого содержимого ещё нет, сохраняет его из content (File),
+        из уже записанного на локальный диск файла path или копирует из файла stored_name,
+        уже загруженного в хранилище (см. file_storage). Blob без ссылок, ещё не удалённый
+        после фиксации транзакции (см. delete_orphans), используется снова вместе с файлом.
+        Содержимое записывается вне транзакций самого метода: при вызове вне transaction.atomic()
+        запись большого файла в хранилище не держит блокировок в базе. Если файл затем не удалось
+        сохранить в Storage, ссылку нужно освободить (Blob.release)
+        """
+        while True:
+            with transaction.atomic(using=self.db):
+                blob = self.select_for_update().filter(sha256=sha256).first()
+                if blob is not None:
+                    self.filter(pk=blob.pk).update(refcount=F('refcount') + 1)
+                    blob.refcount += 1
+                    return blob
+
+            blob = self.model(sha256=sha256, size=size, refcount=1)
+            storage = blob.file.storage
+            name = blob_upload_to(blob, None)
+            created_file = True
+            if path is not None:
+                # False - файл с таким хешем уже лежит на диске (например, остался от прерванной загрузки)
+                created_file = store_local_file(path, name, storage)
+            elif stored_name is not None:
+                created_file = copy_stored_file(stored_name, name, storage)
+            else:
+                name = storage.save(name, content)
+            blob.file.name = name
+
+            try:
+                with transaction.atomic():
+                    blob.save()
+                return blob
+            except IntegrityError:
+                # Такой же файл параллельно загрузил другой запрос - используем его запись.
+                # Свой файл удаляем, только если запись другого запроса ссылается на другой файл
+                if created_file and not self.filter(file=name).exists():
+                    storage.delete(name)
+
+    def release_many(self, counts):
+        """
+        Уменьшает счётчики ссылок сразу у нескольких Blob (counts: {id_blob: количество}) одним UPDATE.
+        Содержимое, на которое не осталось ссылок, удаляется после фиксации транзакции (см. delete_orphans)
+        """
+        if not counts:
+            return
+        with transaction.atomic(using=self.db):
+            ids = list(self.select_for_update().filter(pk__in=counts).values_list('pk', flat=True))
+            if not ids:
+                return
+            self.filter(pk__in=ids).update(refcount=Case(
+                *[When(pk=pk, then=F('refcount') - counts[pk]) for pk in ids],
+                default=F('refcount'),
+            ))
+            orphans = list(self.filter(pk__in=ids, refcount__lte=0).values_list('pk', flat=True))
+            if orphans:
+                transaction.on_commit(lambda: self.delete_orphans(orphans), using=self.db)
+
+    def delete_orphans(self, ids):
+        """
+        Удаляет Blob без ссылок вместе с файлом и эскизами. Запись блокируется и удаляется в одной
+        транзакции с файлом: acquire того же хеша либо успевает увеличить счётчик ссылок (тогда файл
+        остаётся), либо ждёт блокировку и после удаления записи сохраняет содержимое заново.
+        Если файл не удалось удалить, запись остаётся до следующего запуска reap_deleted_files.
+        Возвращает количество удалённых записей
+        """
+        file_storage = self.model._meta.get_field('file').storage
+        deleted = 0
+        for pk in ids:
+            try:
+                with transaction.atomic(using=self.db):
+                    blob = self.select_for_update().filter(pk=pk, refcount__lte=0).first()
+                    if blob is None:
+                        continue  # на содержимое снова сослались
+                    self.filter(pk=pk).delete()
+                    file_storage.delete(blob.file.name)
+            except Exception:
+                logger.exception('Не удалось удалить содержимое без ссылок: id_blob=%s', pk)
+                continue
+            delete_previews(blob.sha256, file_storage)
+            deleted += 1
+        return deleted
+
+class Blob(models.Model):
+    """
+    Уникальное содержимое файла. Несколько записей Storage с одинаковым содержимым
+    ссылаются на один Blob, физический файл удаляется, когда счётчик ссылок становится равен 0
+    """
+    id_blob = models.AutoField(primary_key=True)
+    sha256 = models.CharField(max_length=64, unique=True, null=False)
+    size = models.BigIntegerField()
+    file = models.FileField(upload_to=blob_upload_to, max_length=255)
+    refcount = models.IntegerField(default=0)
+    created_date = models.DateTimeField(auto_now_add=True, db_column="createddate")
+
+    objects = BlobManager()
+
+    class Meta:
+        db_table = "blobs"
+
+    def __str__(self):
+        return self.sha256
+
+    @classmethod
+    def release(cls, id_blob, count=1):
+        """
+        Уменьшает счётчик ссылок на count и удаляет содержимое, если ссылок не осталось.
+        Файл удаляется после фиксации транзакции
+        """
+        cls.objects.release_many({id_blob: count})
+
+class StorageQuerySet(models.QuerySet):
+    def soft_delete(self):
+        """
+        Помечает выбранные файлы удалёнными (deleted_at) одним UPDATE и сразу удаляет ссылки на них,
+        размер файлов сразу вычитается из used_bytes владельцев. Файлы на диске и счётчики ссылок на содержимое освобождает фоновая очистка (см. maintenance.reap_deleted_files).
+        Возвращает список id помеченных файлов
+        """
+        with transaction.atomic(using=self.db):
+            rows = list(self.select_for_update().filter(deleted_at__isnull=True).values_list('id_file', 'id_user', 'size'))
+            if not rows:
+                return []
+            ids = [id_file for id_file, _, _ in rows]
+            sizes = Counter()
+            for _, id_user, size in rows:
+                sizes[id_user] += size
+            ShareLink.objects.using(self.db).filter(storage__in=ids).delete()
+            self.model.all_objects.using(self.db).filter(pk__in=ids).update(deleted_at=timezone.now())
+            User.objects.db_manager(self.db).release_space_many(sizes)
+        return ids
+
+    def bulk_delete(self):
+        """
+        Пакетное удаление выбранных файлов в одной транзакции: связанные ссылки и сами записи
+        удаляются через QuerySet.delete() запросами DELETE ... WHERE ... IN (...), счётчики ссылок
+        на содержимое уменьшаются одним UPDATE, а файлы с диска удаляются после фиксации транзакции.
+        Возвращает список id удалённых файлов
+        """
+        with transaction.atomic(using=self.db):
+            rows = list(self.select_for_update().values_list('id_file', 'blob_id', 'file'))
+            if not rows:
+                return []
+            ids = [id_file for id_file, _, _ in rows]
+            blob_counts = Counter(blob_id for _, blob_id, _ in rows if blob_id)
+            # Файлы, загруженные до дедупликации, лежат на диске отдельно от Blob
+            legacy_names = [name for _, blob_id, name in rows if not blob_id and name]
+
+            Blob.objects.db_manager(self.db).release_many(blob_counts)
+            ShareLink.objects.using(self.db).filter(storage__in=ids).delete()
+            self.model.all_objects.using(self.db).filter(pk__in=ids).delete()
+
+            if legacy_names:
+                file_storage = self.model._meta.get_field('file').storage
+                transaction.on_commit(
+                    lambda: [file_storage.delete(name) for name in legacy_names],
+                    using=self.db,
+                    robust=True,
+                )
+        return ids
+
+class StorageManager(models.Manager.from_queryset(StorageQuerySet)):
+    # Менеджер по умолчанию не показывает файлы, помеченные удалёнными
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at__isnull=True)
+
 class Storage(models.Model):
     id_file = models.AutoField(primary_key=True)
-    id_user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="storages", db_column="user_id")
+    # При удалении пользователя записи его файлов остаются (помеченными удалёнными) до фоновой очистки
+    id_user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name="storages", db_column="user_id")
     original_name = models.CharField(max_length=128, null=False)
     new_name = models.CharField(max_length=128, null=True, blank=True)
     comment = models.CharField(max_length=128, null=False)
     size = models.BigIntegerField()
     upload_date = models.DateTimeField(auto_now_add=True, db_column="uploaddate")
     last_download_date = models.DateTimeField(null=True, auto_now=False, blank=True, db_column="lastdownloaddate")
+    download_count = models.PositiveBigIntegerField(default=0, db_column="downloadcount")
     file = models.FileField(upload_to='uploads/')
-    token = models.CharField(max_length=32, null=True, blank=True)
-    token_expiration = models.DateTimeField(null=True, blank=True)
+    blob = models.ForeignKey(Blob, on_delete=models.PROTECT, null=True, blank=True, related_name="storages", db_column="blob_id")
+    # Метаданные содержимого определяются один раз при загрузке (см. upload_handlers.get_content_metadata):
+    # MIME-тип по сигнатуре файла (иначе по имени), SHA-256 и кодировка текстовых файлов
+    content_type = models.CharField(max_length=128, blank=True, default="", db_column="contenttype")
+    sha256 = models.CharField(max_length=64, blank=True, default="")
+    charset = models.CharField(max_length=32, blank=True, default="")
+
+    deleted_at = models.DateTimeField(null=True, blank=True, db_index=True, db_column="deletedat")
+
+    objects = StorageManager()
+    all_objects = StorageQuerySet.as_manager()  # включая помеченные удалёнными
 
     class Meta:
         db_table = "storage"
+        indexes = [
+            # Составные индексы для курсорной пагинации списка файлов пользователя
+            models.Index(fields=["id_user", "-upload_date", "-id_file"], name="storage_user_upload_idx"),
+            models.Index(fields=["id_user", "original_name", "id_file"], name="storage_user_name_idx"),
+            models.Index(fields=["id_user", "size", "id_file"], name="storage_user_size_idx"),
+            # Поиск по началу имени (LIKE 'abc%'): в PostgreSQL с локалью, отличной от C, обычный индекс
+            # для LIKE не используется, нужен класс операторов varchar_pattern_ops (на других СУБД игнорируется)
+            models.Index(
+                fields=["id_user", "original_name"], name="storage_user_name_prefix_idx",
+                opclasses=["int4_ops", "varchar_pattern_ops"],
+            ),
+        ]
 
     def __str__(self):
         return self.original_name
 
     def delete(self, *args, **kwargs):
-        # Удаляем файл из файловой системы
+        if self.deleted_at is None and self.id_user_id:
+            # Размер помеченных удалёнными файлов уже вычтен из used_bytes (см. soft_delete)
+            User.objects.release_space_many({self.id_user_id: self.size})
+        if self.blob_id:
+            # Файл общий для всех копий: уменьшаем счётчик ссылок на содержимое
+            with transaction.atomic():
+                super(Storage, self).delete(*args, **kwargs)
+                Blob.release(self.blob_id)
+            return
+        # Удаляем файл из хранилища
         if self.file:
-            if os.path.isfile(self.file.path):
-                os.remove(self.file.path)
+            self.file.storage.delete(self.file.name)
         super(Storage, self).delete(*args, **kwargs)
+
+
+class ShareLink(models.Model):
+    """
+    Специальная ссылка на скачивание файла без аутентификации.
+    У файла может быть несколько ссылок, у каждой свой срок действия и лимит скачиваний
+    """
+    id_link = models.AutoField(primary_key=True)
+    storage = models.ForeignKey(Storage, on_delete=models.CASCADE, related_name="share_links", db_column="file_id")
+    token = models.CharField(max_length=32, unique=True, null=False)
+    created_date = models.DateTimeField(auto_now_add=True, db_column="createddate")
+    expiration = models.DateTimeField(null=True, blank=True, db_index=True)
+    max_downloads = models.PositiveIntegerField(null=True, blank=True)
+    download_count = models.PositiveIntegerField(default=0)
+    revoked = models.BooleanField(default=False)
+
+    class Meta:
+        db_table = "share_links"
+
+    def __str__(self):
+        return self.token
+
+    def is_expired(self, now=None):
+        return self.expiration is not None and self.expiration < (now or timezone.now())
+
+class UploadSession(models.Model):
+    """
+    Сессия поблочной (возобновляемой) загрузки файла.
+    Блоки пишутся во временный файл в MEDIA_ROOT/uploads_staging, полученные диапазоны
+    хранятся в received_ranges в виде отсортированного списка [начало, конец) без пересечений.
+    Сессия с sha256 - прямая загрузка клиентом в объектное хранилище по подписанной ссылке
+    (временный объект uploads_direct/<id_session>)
+    """
+    id_session = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    id_user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="upload_sessions", db_column="user_id")
+    original_name = models.CharField(max_length=128, null=False)
+    comment = models.CharField(max_length=128, blank=True, default="")
+    size = models.BigIntegerField()
+    received_ranges = models.JSONField(default=list, blank=True)
+    sha256 = models.CharField(max_length=64, blank=True, default="")
+    created_date = models.DateTimeField(auto_now_add=True, db_column="createddate")
+    updated_date = models.DateTimeField(auto_now=True, db_column="updateddate")
+
+    class Meta:
+        db_table = "upload_sessions"
+
+    def __str__(self):
+        return self.original_name
+
+    @property
+    def staging_path(self):
+        return os.path.join(settings.MEDIA_ROOT, 'uploads_staging', f'{self.id_session}.part')
+
+    @property
+    def direct_name(self):
+        return f'uploads_direct/{self.id_session}'
+
+    @property
+    def is_direct(self):
+        return bool(self.sha256)
+
+    @property
+    def received_size(self):
+        return sum(end - start for start, end in self.received_ranges)
+
+    @property
+    def is_complete(self):
+        return self.received_ranges == [[0, self.size]] or (self.size == 0 and not self.received_ranges)
+
+    def add_range(self, start, end):
+        # Добавляем диапазон и склеиваем пересекающиеся/соседние
+        ranges = sorted(self.received_ranges + [[start, end]])
+        merged = []
+        for range_start, range_end in ranges:
+            if merged and range_start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], range_end)
+            else:
+                merged.append([range_start, range_end])
+        self.received_ranges = merged
+
+    def delete_staging_file(self):
+        # Временный файл удаляется вместе с сессией, в том числе при каскадном удалении
+        # вместе с пользователем (см. signals.upload_session_deleted)
+        if self.is_direct:
+            default_storage.delete(self.direct_name)
+        elif os.path.isfile(self.staging_path):
+            os.remove(self.staging_path)
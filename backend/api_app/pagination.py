@@ -0,0 +1,116 @@
+import base64
+import json
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Курсорная (keyset) пагинация: следующая страница выбирается условием
+    (поле, id) < (значение, id) последней записи, а не OFFSET, поэтому скорость
+    не зависит от номера страницы и использует составные индексы (поле, id).
+    Параметры запроса: limit - размер страницы, cursor - курсор из поля next,
+    ordering - поле сортировки (с "-" для сортировки по убыванию)
+    """
+    page_size = 100
+    max_page_size = 1000
+    limit_query_param = 'limit'
+    cursor_query_param = 'cursor'
+    ordering_query_param = 'ordering'
+    # Поля, по которым разрешена сортировка, и поле-уникальный ключ для разрешения равенств
+    ordering_fields = ()
+    default_ordering = None
+    pk_field = None
+    # Поля с датой: значение в курсоре хранится строкой ISO 8601
+    datetime_fields = ()
+
+    def get_ordering(self, request):
+        ordering = request.query_params.get(self.ordering_query_param, self.default_ordering)
+        if ordering.lstrip('-') not in self.ordering_fields:
+            raise ValidationError({self.ordering_query_param: f"Допустимые значения: {', '.join(self.ordering_fields)}."})
+        return ordering
+
+    def get_limit(self, request):
+        try:
+            limit = int(request.query_params.get(self.limit_query_param, self.page_size))
+        except ValueError:
+            raise ValidationError({self.limit_query_param: "Ожидается целое число."})
+        return max(1, min(limit, self.max_page_size))
+
+    def encode_cursor(self, ordering, obj):
+        field = ordering.lstrip('-')
+        value = getattr(obj, field)
+        if field in self.datetime_fields:
+            value = value.isoformat()
+        raw = json.dumps([ordering, value, getattr(obj, self.pk_field)])
+        return base64.urlsafe_b64encode(raw.encode()).decode()
+
+    def decode_cursor(self, cursor, ordering):
+        try:
+            cursor_ordering, value, pk = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        except (ValueError, TypeError):
+            raise NotFound("Некорректный курсор.")
+        if cursor_ordering != ordering:
+            raise NotFound("Курсор получен для другой сортировки.")
+        if ordering.lstrip('-') in self.datetime_fields:
+            value = parse_datetime(value)
+            if value is None:
+                raise NotFound("Некорректный курсор.")
+        return value, pk
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        ordering = self.get_ordering(request)
+        limit = self.get_limit(request)
+        field = ordering.lstrip('-')
+        descending = ordering.startswith('-')
+        pk_ordering = f'-{self.pk_field}' if descending else self.pk_field
+        queryset = queryset.order_by(ordering, pk_ordering)
+
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            value, pk = self.decode_cursor(cursor, ordering)
+            lookup = 'lt' if descending else 'gt'
+            queryset = queryset.filter(
+                Q(**{f'{field}__{lookup}': value}) | Q(**{field: value, f'{self.pk_field}__{lookup}': pk})
+            )
+
+        # Берём на одну запись больше, чтобы понять, есть ли следующая страница
+        page = list(queryset[:limit + 1])
+        self.has_next = len(page) > limit
+        page = page[:limit]
+        self.next_cursor = self.encode_cursor(ordering, page[-1]) if self.has_next else None
+        return page
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.next_cursor)
+
+    def get_first_link(self):
+        return remove_query_param(self.request.build_absolute_uri(), self.cursor_query_param)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'first': self.get_first_link(),
+            'results': data,
+        })
+
+
+class StorageKeysetPagination(KeysetPagination):
+    ordering_fields = ('upload_date', 'original_name', 'size', 'id_file')
+    default_ordering = '-upload_date'
+    pk_field = 'id_file'
+    datetime_fields = ('upload_date',)
+
+
+class UserKeysetPagination(KeysetPagination):
+    ordering_fields = ('username', 'id_user')
+    default_ordering = 'username'
+    pk_field = 'id_user'
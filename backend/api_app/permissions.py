@@ -18,4 +18,25 @@ class IsAuthenticatedOrViewFile(BasePermission):
                 return True  # Разрешаем, если это метод view_file или download_file_by_token
 
         # Если не view_file или download_file_by_token, проверяем аутентификацию
-        return request.user.is_authenticated
\ No newline at end of file
+        return request.user.is_authenticated
+
+class IsOwnerOrAdmin(BasePermission):
+    """
+    Разрешает доступ аутентифицированному пользователю к его собственным данным (id_user из URL),
+    а администратору (role='admin' или суперпользователь) - к данным любого пользователя.
+    """
+    def has_permission(self, request, view):
+        if not request.user.is_authenticated:
+            return False
+        if request.user.role == 'admin' or request.user.is_superuser:
+            return True
+        return request.user.id_user == view.kwargs.get('id_user')
+
+class IsAdmin(BasePermission):
+    """
+    Разрешает доступ только администратору (role='admin' или суперпользователь).
+    """
+    def has_permission(self, request, view):
+        if not request.user.is_authenticated:
+            return False
+        return request.user.role == 'admin' or request.user.is_superuser
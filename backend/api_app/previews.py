@@ -0,0 +1,201 @@
+"""
+Эскизы (уменьшенные копии) изображений и первой страницы PDF для предпросмотра в списке файлов.
+Эскиз зависит только от содержимого, поэтому хранится в хранилище по хешу Blob
+(previews/ab/cd/<sha256>-<размер>.jpg) и общий для всех копий файла.
+Эскизы создаются в фоне после загрузки файла, а если их ещё нет - при первом запросе.
+Для изображений нужен пакет Pillow, для PDF - утилита pdftoppm (poppler-utils);
+если они не установлены, предпросмотр файлов этих типов недоступен
+"""
+import contextlib
+import io
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.files.base import ContentFile
+from .file_storage import get_file_storage, get_local_path, open_file
+import logging
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow не установлен - эскизы изображений не создаются
+    Image = ImageOps = None
+
+logger = logging.getLogger(__name__)
+
+PREVIEW_CONTENT_TYPE = 'image/jpeg'
+IMAGE_CONTENT_TYPES = ['image/jpeg', 'image/png', 'image/gif', 'image/webp', 'image/bmp', 'image/tiff']
+PDF_CONTENT_TYPES = ['application/pdf']
+
+
+def get_preview_sizes():
+    return settings.PREVIEW_SIZES
+
+
+def get_preview_size(requested=None):
+    # Ближайший не меньший из поддерживаемых размеров (иначе - наибольший), None - предпросмотр отключён
+    sizes = get_preview_sizes()
+    if not sizes:
+        return None
+    if requested is None:
+        return sizes[0]
+    return next((size for size in sizes if size >= requested), sizes[-1])
+
+
+def get_preview_name(sha256, size):
+    return f'previews/{sha256[:2]}/{sha256[2:4]}/{sha256}-{size}.jpg'
+
+
+def can_preview(content_type):
+    if not get_preview_sizes():
+        return False
+    if content_type in IMAGE_CONTENT_TYPES:
+        return Image is not None
+    if content_type in PDF_CONTENT_TYPES:
+        return shutil.which(settings.PREVIEW_PDFTOPPM) is not None
+    return False
+
+
+@contextlib.contextmanager
+def local_copy(name, storage):
+    """
+    Путь к файлу хранилища на локальном диске: для объектного хранилища файл
+    потоково копируется во временный файл, который удаляется после использования
+    """
+    path = get_local_path(name, storage)
+    if path is not None:
+        yield path
+        return
+    with tempfile.NamedTemporaryFile(suffix='.src') as tmp:
+        with contextlib.closing(open_file(name, storage=storage)) as source:
+            shutil.copyfileobj(source, tmp, 1024 * 1024)
+        tmp.flush()
+        yield tmp.name
+
+
+def render_image(path, size):
+    with Image.open(path) as image:
+        # Для JPEG декодер сразу уменьшает изображение в 2-8 раз, не распаковывая его в полном размере
+        image.draft('RGB', (size, size))
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((size, size))
+        if image.mode in ('RGBA', 'LA', 'P'):
+            # Прозрачные области заливаем белым, JPEG не поддерживает прозрачность
+            image = image.convert('RGBA')
+            background = Image.new('RGB', image.size, 'white')
+            background.paste(image, mask=image.getchannel('A'))
+            image = background
+        elif image.mode != 'RGB':
+            image = image.convert('RGB')
+        output = io.BytesIO()
+        image.save(output, 'JPEG', quality=settings.PREVIEW_QUALITY, optimize=True)
+        return output.getvalue()
+
+
+def render_pdf(path, size):
+    # Первая страница PDF сразу в JPEG нужного размера
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        prefix = os.path.join(tmp_dir, 'page')
+        subprocess.run(
+            [settings.PREVIEW_PDFTOPPM, '-f', '1', '-l', '1', '-singlefile', '-jpeg',
+             '-scale-to', str(size), path, prefix],
+            check=True, capture_output=True, timeout=settings.PREVIEW_TIMEOUT,
+        )
+        with open(f'{prefix}.jpg', 'rb') as page:
+            return page.read()
+
+
+def generate_preview(sha256, source_name, content_type, size, storage=None):
+    """
+    Создаёт эскиз содержимого source_name и сохраняет его в хранилище.
+    Возвращает имя эскиза или None, если эскиз создать нельзя
+    """
+    storage = storage or get_file_storage()
+    name = get_preview_name(sha256, size)
+    if storage.exists(name):
+        return name
+    if not can_preview(content_type):
+        return None
+    try:
+        if storage.size(source_name) > settings.PREVIEW_MAX_SOURCE_SIZE:
+            logger.info('Файл слишком большой для создания эскиза: %s', source_name)
+            return None
+        with local_copy(source_name, storage) as path:
+            if content_type in PDF_CONTENT_TYPES:
+                data = render_pdf(path, size)
+            else:
+                data = render_image(path, size)
+    except Exception:
+        logger.warning('Не удалось создать эскиз %s (%s)', source_name, content_type, exc_info=True)
+        return None
+
+    saved_name = storage.save(name, ContentFile(data))
+    if saved_name != name:
+        # Тот же эскиз параллельно сохранил другой процесс, хранилище выбрало другое имя
+        storage.delete(saved_name)
+    logger.debug('Эскиз создан: %s, %s байт', name, len(data))
+    return name
+
+
+class PreviewGenerator:
+    """
+    Пул потоков, создающих эскизы. Одновременные запросы одного эскиза
+    (фоновая генерация после загрузки и показ списка файлов) выполняются один раз
+    """
+    def __init__(self, workers):
+        self.workers = workers
+        self.executor = None
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    def submit(self, sha256, source_name, content_type, size):
+        name = get_preview_name(sha256, size)
+        with self.lock:
+            future = self.pending.get(name)
+            if future is None:
+                if self.executor is None:
+                    self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='preview')
+                future = self.executor.submit(self.run, name, sha256, source_name, content_type, size)
+                self.pending[name] = future
+            return future
+
+    def run(self, name, sha256, source_name, content_type, size):
+        from django.db import close_old_connections
+
+        try:
+            return generate_preview(sha256, source_name, content_type, size)
+        finally:
+            with self.lock:
+                self.pending.pop(name, None)
+            close_old_connections()
+
+    def get(self, sha256, source_name, content_type, size):
+        """
+        Имя готового эскиза; если его ещё нет, эскиз создаётся (или дожидаемся уже начатого создания).
+        Если эскиз не создан за PREVIEW_REQUEST_WAIT секунд, выбрасывает TimeoutError (создание продолжается в фоне)
+        """
+        name = get_preview_name(sha256, size)
+        if get_file_storage().exists(name):
+            return name
+        return self.submit(sha256, source_name, content_type, size).result(timeout=settings.PREVIEW_REQUEST_WAIT)
+
+
+preview_generator = PreviewGenerator(workers=getattr(settings, 'PREVIEW_WORKERS', 2))
+
+
+def schedule_previews(blob, content_type):
+    # Фоновое создание эскизов всех размеров для только что загруженного содержимого
+    if not settings.PREVIEW_ON_UPLOAD or not can_preview(content_type):
+        return
+    for size in get_preview_sizes():
+        preview_generator.submit(blob.sha256, blob.file.name, content_type, size)
+
+
+def delete_previews(sha256, storage=None):
+    # Удаление эскизов содержимого, на которое не осталось ссылок
+    storage = storage or get_file_storage()
+    for size in get_preview_sizes():
+        storage.delete(get_preview_name(sha256, size))
@@ -1,16 +1,41 @@
 from rest_framework import serializers
-from .models import User, Storage
+from .models import ShareLink, User, Storage, UploadSession
+from .download_stats import download_tracker
 
-class StorageSerializer(serializers.ModelSerializer):
+class DynamicFieldsModelSerializer(serializers.ModelSerializer):
+    """
+    Сериализатор, которому можно передать fields - список полей, которые нужно вернуть
+    """
+    def __init__(self, *args, **kwargs):
+        fields = kwargs.pop('fields', None)
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for field_name in set(self.fields) - set(fields):
+                self.fields.pop(field_name)
+
+class StorageSerializer(DynamicFieldsModelSerializer):
     class Meta:
         model = Storage
-        fields = "__all__"
+        exclude = ["deleted_at"]
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        # Добавляем скачивания, ещё не записанные в базу (см. download_stats.DownloadTracker)
+        pending = download_tracker.get_pending(instance.id_file)
+        if pending is not None:
+            when, count = pending
+            if 'last_download_date' in data and (instance.last_download_date is None or instance.last_download_date < when):
+                data['last_download_date'] = self.fields['last_download_date'].to_representation(when)
+            if 'download_count' in data:
+                data['download_count'] += count
+        return data
 
 class UserSerializer(serializers.ModelSerializer):
     storages = StorageSerializer(many=True, read_only=True)  # связь с файлами
     class Meta:
         model = User
-        fields = ["id_user", "username", "fullname", "email", "role", "storages", "password"]
+        fields = ["id_user", "username", "fullname", "email", "role", "quota_bytes", "used_bytes", "storages", "password"]
+        read_only_fields = ["quota_bytes", "used_bytes"]
         extra_kwargs = {
             "password": {"write_only": True},
         }
@@ -24,3 +49,42 @@ class UserSerializer(serializers.ModelSerializer):
             role=validated_data.get('role', 'user')  # Установка роли по умолчанию
         )
         return user
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    received_size = serializers.IntegerField(read_only=True)
+    is_complete = serializers.BooleanField(read_only=True)
+
+    class Meta:
+        model = UploadSession
+        fields = ["id_session", "original_name", "comment", "size", "sha256", "received_ranges", "received_size", "is_complete", "created_date", "updated_date"]
+        read_only_fields = ["id_session", "received_ranges", "created_date", "updated_date"]
+
+    def validate_size(self, value):
+        if value < 0:
+            raise serializers.ValidationError("Размер файла не может быть отрицательным")
+        return value
+
+    def validate_sha256(self, value):
+        value = value.lower()
+        if value and (len(value) != 64 or any(c not in '0123456789abcdef' for c in value)):
+            raise serializers.ValidationError("Ожидается SHA-256 в шестнадцатеричном виде")
+        return value
+
+class UserListSerializer(DynamicFieldsModelSerializer):
+    """
+    Пользователь для списка администратора: агрегаты по файлам считаются в запросе (annotate),
+    список файлов storages заполняется только при prefetch_related
+    """
+    file_count = serializers.IntegerField(read_only=True)
+    total_size = serializers.IntegerField(read_only=True)
+    last_upload = serializers.DateTimeField(read_only=True)
+    storages = StorageSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = User
+        fields = ["id_user", "username", "fullname", "email", "role", "quota_bytes", "used_bytes", "file_count", "total_size", "last_upload", "storages"]
+
+class ShareLinkSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ShareLink
+        fields = ["token", "created_date", "expiration", "max_downloads", "download_count", "revoked"]
@@ -0,0 +1,24 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+from .authentication import invalidate_token, invalidate_user
+from .models import UploadSession, User
+
+
+# Выход из личного кабинета (удаление токена) и удаление пользователя вместе с токеном
+@receiver(post_delete, sender=Token)
+def token_deleted(sender, instance, **kwargs):
+    invalidate_token(instance.key)
+
+
+# Удаление сессии загрузки (отмена, завершение, удаление пользователя) - удаляем её временный файл
+@receiver(post_delete, sender=UploadSession)
+def upload_session_deleted(sender, instance, **kwargs):
+    instance.delete_staging_file()
+
+
+# Изменение пользователя (роль, активность, пароль) - закэшированные данные устарели
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, **kwargs):
+    if not created:
+        invalidate_user(instance.pk)
@@ -1,3 +1,1167 @@
-from django.test import TestCase
+import contextlib
+import hashlib
+import io
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import zipfile
+from datetime import timedelta
+from unittest import mock
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.base import ContentFile
+from django.core.files.storage import Storage as BaseStorage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.db import DatabaseError, transaction
+from django.db.models.signals import post_delete
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.urls import resolve
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.test import APIClient
+from backend_project.settings import route_map
+from .apps import is_management_command
+from .authentication import CachedTokenAuthentication, local_auth_cache
+from .download_stats import DownloadTracker
+from .file_delivery import get_etag, parse_range_header, text_iterator
+from .file_storage import (
+    ObjectRangeFile,
+    RangeFile,
+    copy_stored_file,
+    get_local_path,
+    get_stored_file_sha256,
+    is_local_storage,
+    iter_stored_files,
+    open_file,
+    read_head,
+    store_local_file,
+    supports_presigned_urls,
+)
+from .log import RouteFilter
+from .maintenance import backfill_file_metadata, clean_expired_tokens, reap_deleted_files, relocate_legacy_files
+from .metrics import timing
+from .middleware import MetricsMiddleware
+from .models import Blob, QuotaExceeded, ShareLink, Storage, UploadSession, User
+from .previews import can_preview, get_preview_size
+from .upload_handlers import StagingUploadedFile, detect_charset, get_content_metadata, sniff_content_type
+from .views import StorageView
 
-# Create your tests here.
+
+class TempMediaMixin:
+    """
+    Отдельный временный MEDIA_ROOT на каждый тест: файлы хранилища не пересекаются с рабочими.
+    Статистика скачиваний пишется сразу, эскизы в фоне не создаются
+    """
+    def setUp(self):
+        super().setUp()
+        self.media_root = tempfile.mkdtemp()
+        media_settings = override_settings(
+            MEDIA_ROOT=self.media_root, PREVIEW_ON_UPLOAD=False, DOWNLOAD_STATS_FLUSH_INTERVAL=0,
+        )
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+
+
+def create_user(username, **extra_fields):
+    return User.objects.create_user(f'{username}@example.com', username, 'password', **extra_fields)
+
+
+def upload(user, data, name='file.bin', comment=''):
+    # Сохранение файла тем же путём, что и при загрузке через API
+    return StorageView().save_uploaded_file(user, SimpleUploadedFile(name, data), comment)
+
+
+class ObjectLikeStorage(BaseStorage):
+    # Хранилище без файлов на диске (как S3Storage): path() не поддерживается
+    def __init__(self):
+        self.files = {}
+
+    def _open(self, name, mode='rb'):
+        return ContentFile(self.files[name], name=name)
+
+    def _save(self, name, content):
+        self.files[name] = content.read()
+        return name
+
+    def exists(self, name):
+        return name in self.files
+
+    def listdir(self, path):
+        names = [name[len(path) + 1:] for name in self.files if name.startswith(f'{path}/')]
+        return sorted({name.split('/')[0] for name in names if '/' in name}), sorted(name for name in names if '/' not in name)
+
+
+class StorageBackendTests(SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.storage = ObjectLikeStorage()
+        self.storage.save('uploads/data.bin', ContentFile(b'0123456789'))
+
+    def test_local_storage(self):
+        self.assertTrue(is_local_storage())
+        self.assertFalse(supports_presigned_urls())
+
+    def test_non_local_storage(self):
+        self.assertIsNone(get_local_path('uploads/data.bin', self.storage))
+        self.assertFalse(is_local_storage(self.storage))
+        self.assertFalse(supports_presigned_urls(self.storage))
+        with contextlib.closing(open_file('uploads/data.bin', start=3, storage=self.storage)) as f:
+            self.assertEqual(f.read(), b'3456789')
+        self.assertEqual(read_head('uploads/data.bin', 4, 10, self.storage), b'0123')
+        self.assertEqual(get_stored_file_sha256('uploads/data.bin', self.storage), hashlib.sha256(b'0123456789').hexdigest())
+
+        self.assertTrue(copy_stored_file('uploads/data.bin', 'blobs/copy', self.storage))
+        with tempfile.NamedTemporaryFile() as tmp:
+            tmp.write(b'local')
+            tmp.flush()
+            self.assertTrue(store_local_file(tmp.name, 'blobs/local', self.storage))
+        self.assertEqual(self.storage.open('blobs/copy').read(), b'0123456789')
+        self.assertEqual(self.storage.open('blobs/local').read(), b'local')
+        self.assertEqual(sorted(iter_stored_files('blobs', self.storage)), ['blobs/copy', 'blobs/local'])
+
+    def test_object_range_request(self):
+        client = mock.Mock()
+        client.exceptions.NoSuchKey = KeyError
+        client.get_object.return_value = {'Body': io.BytesIO(b'data')}
+        storage = mock.Mock(bucket_name='cloud', connection=mock.Mock(meta=mock.Mock(client=client)))
+        storage._normalize_name.side_effect = lambda name: f'media/{name}'
+        self.assertTrue(supports_presigned_urls(storage))
+
+        ObjectRangeFile('blobs/file', 5, 10, storage)
+        client.get_object.assert_called_with(Bucket='cloud', Key='media/blobs/file', Range='bytes=5-14')
+        ObjectRangeFile('blobs/file', 5, None, storage)
+        client.get_object.assert_called_with(Bucket='cloud', Key='media/blobs/file', Range='bytes=5-')
+        ObjectRangeFile('blobs/file', 0, None, storage)
+        client.get_object.assert_called_with(Bucket='cloud', Key='media/blobs/file')
+
+        client.get_object.side_effect = KeyError
+        with self.assertRaises(FileNotFoundError):
+            ObjectRangeFile('blobs/missing', 0, None, storage)
+
+
+class ContentMetadataTests(SimpleTestCase):
+    def test_sniff_content_type(self):
+        self.assertEqual(sniff_content_type(b'\x89PNG\r\n\x1a\n' + b'\x00' * 8), 'image/png')
+        self.assertEqual(sniff_content_type(b'RIFF\x00\x00\x00\x00WEBPVP8 '), 'image/webp')
+        self.assertEqual(sniff_content_type(b'\x00\x00\x00\x18ftypheic'), 'image/heic')
+        self.assertEqual(sniff_content_type(b'\x00\x00\x00\x18ftypisom'), 'video/mp4')
+        self.assertEqual(sniff_content_type(b'BM\x36\x00\x00\x00\x00\x00\x00\x00'), 'image/bmp')
+        self.assertIsNone(sniff_content_type(b'BMP is not a bitmap'))
+        # ZIP распознаётся по имени: это может быть и документ Office
+        self.assertIsNone(sniff_content_type(b'PK\x03\x04'))
+
+    def test_content_type_by_signature_then_name(self):
+        self.assertEqual(get_content_metadata('photo.txt', b'%PDF-1.7'), ('application/pdf', ''))
+        self.assertEqual(
+            get_content_metadata('report.docx', b'PK\x03\x04'),
+            ('application/vnd.openxmlformats-officedocument.wordprocessingml.document', ''),
+        )
+        self.assertEqual(get_content_metadata('data', b'\x00\x01'), ('application/octet-stream', ''))
+        self.assertEqual(get_content_metadata('notes.txt', 'Привет'.encode()), ('text/plain', 'utf-8'))
+
+    @override_settings(FILE_TEXT_FALLBACK_ENCODING='cp1251')
+    def test_detect_charset(self):
+        self.assertEqual(detect_charset('Привет'.encode('utf-8-sig')), 'utf-8-sig')
+        self.assertEqual(detect_charset('Привет'.encode('utf-16')), 'utf-16')
+        self.assertEqual(detect_charset('Привет'.encode('cp1251')), 'cp1251')
+        # Многобайтовый символ, обрезанный границей начала файла, не делает файл cp1251
+        self.assertEqual(detect_charset('Привет'.encode()[:-1]), 'utf-8')
+
+
+class StagedUploadTests(TempMediaMixin, TestCase):
+    def test_blob_from_staged_upload_is_world_readable(self):
+        # Веб-сервер (X-Accel-Redirect) работает от другого пользователя и должен читать файлы хранилища
+        data = b'x' * 1024
+        staged = StagingUploadedFile('big.bin', 'application/octet-stream', len(data), None)
+        self.addCleanup(staged.close)
+        staged.write(data)
+        staged.flush()
+        self.assertEqual(os.stat(staged.temporary_file_path()).st_mode & 0o777, 0o600)
+
+        with transaction.atomic():
+            blob = Blob.objects.acquire(hashlib.sha256(data).hexdigest(), len(data), path=staged.temporary_file_path())
+
+        self.assertEqual(os.stat(blob.file.path).st_mode & 0o777, 0o644)
+
+
+class ShareLinkTests(TempMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.owner = create_user('owner')
+        self.other = create_user('other')
+        self.file = upload(self.owner, b'0123456789')
+        self.client = APIClient()
+
+    def create_link(self, max_downloads=None):
+        return ShareLink.objects.create(
+            storage=self.file, token=f'token{ShareLink.objects.count()}',
+            expiration=timezone.now() + timedelta(minutes=5), max_downloads=max_downloads,
+        )
+
+    def download(self, link, range_header=None, client=None):
+        headers = {'Range': range_header} if range_header else {}
+        return (client or self.client).get(f'/api/storage/download/{link.token}/', headers=headers)
+
+    def test_limit_and_expiration(self):
+        link = self.create_link(max_downloads=2)
+        self.assertEqual(self.download(link).status_code, 200)
+        self.assertEqual(self.download(link, client=APIClient()).status_code, 200)
+        self.assertEqual(self.download(link).status_code, 403)
+        link.refresh_from_db()
+        self.assertEqual(link.download_count, 2)
+
+        expired = self.create_link()
+        ShareLink.objects.filter(pk=expired.pk).update(expiration=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(self.download(expired).status_code, 403)
+        revoked = self.create_link()
+        ShareLink.objects.filter(pk=revoked.pk).update(revoked=True)
+        self.assertEqual(self.download(revoked).status_code, 403)
+        self.assertEqual(self.client.get('/api/storage/download/missing/').status_code, 404)
+
+    def test_ranged_requests_do_not_bypass_limit(self):
+        link = self.create_link(max_downloads=1)
+        # Первый запрос клиента считается скачиванием, даже если он начинается не с начала файла
+        self.assertEqual(self.download(link, 'bytes=1-').status_code, 206)
+        # Другой клиент, в том числе с поддельной cookie докачки, не может докачивать файл
+        other = APIClient()
+        self.assertEqual(self.download(link, 'bytes=5-', client=other).status_code, 403)
+        other.cookies['share_link_%s' % link.pk] = str(link.pk)
+        self.assertEqual(self.download(link, 'bytes=5-', client=other).status_code, 403)
+        # Новое скачивание тем же клиентом после исчерпания лимита отклоняется
+        self.assertEqual(self.download(link).status_code, 403)
+        self.assertEqual(self.download(link, 'bytes=0-3').status_code, 403)
+        link.refresh_from_db()
+        self.assertEqual(link.download_count, 1)
+
+    def test_suffix_ranges_from_new_clients_are_counted(self):
+        link = self.create_link(max_downloads=2)
+        self.assertEqual(self.download(link, 'bytes=-4', client=APIClient()).status_code, 206)
+        self.assertEqual(self.download(link, 'bytes=-4', client=APIClient()).status_code, 206)
+        self.assertEqual(self.download(link, 'bytes=-4', client=APIClient()).status_code, 403)
+
+    def test_resume_by_counted_client_is_free(self):
+        link = self.create_link(max_downloads=1)
+        response = self.download(link)
+        self.assertEqual(response.status_code, 200)
+        cookie = response.cookies['share_link_%s' % link.pk]
+        self.assertEqual(cookie['path'], f'/api/storage/download/{link.token}/')
+        self.assertTrue(cookie['httponly'])
+        # Докачка и перемотка разрешены и после исчерпания лимита
+        response = self.download(link, 'bytes=5-')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), b'56789')
+        self.assertEqual(self.download(link, 'bytes=-2').status_code, 206)
+        link.refresh_from_db()
+        self.assertEqual(link.download_count, 1)
+
+        # Cookie другой ссылки на тот же файл не подходит
+        other_link = self.create_link(max_downloads=1)
+        self.client.cookies['share_link_%s' % other_link.pk] = cookie.value
+        self.assertEqual(self.download(other_link, 'bytes=5-').status_code, 206)
+        other_link.refresh_from_db()
+        self.assertEqual(other_link.download_count, 1)
+
+    def test_links_of_other_users_files_are_hidden(self):
+        link = self.create_link()
+        url = f'/api/storage/link/{self.owner.id_user}/{self.file.id_file}/'
+        self.client.force_authenticate(self.other)
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.assertEqual(self.client.delete(url).status_code, 403)
+        link.refresh_from_db()
+        self.assertFalse(link.revoked)
+
+        self.client.force_authenticate(self.owner)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['token'] for item in response.data], [link.token])
+
+
+class ExpiredLinkCleanupTests(TempMediaMixin, TestCase):
+    def test_cleanup_removes_only_expired_and_revoked_links(self):
+        owner = create_user('owner')
+        file = upload(owner, b'data')
+        now = timezone.now()
+        active = ShareLink.objects.create(storage=file, token='active', expiration=now + timedelta(minutes=5))
+        ShareLink.objects.create(storage=file, token='expired', expiration=now - timedelta(minutes=5))
+        ShareLink.objects.create(storage=file, token='revoked', expiration=now + timedelta(minutes=5), revoked=True)
+
+        # Список файлов ссылки не удаляет
+        client = APIClient()
+        client.force_authenticate(owner)
+        self.assertEqual(client.get(f'/api/storage/{owner.id_user}/').status_code, 200)
+        self.assertEqual(ShareLink.objects.count(), 3)
+
+        self.assertEqual(clean_expired_tokens(), 2)
+        self.assertEqual(list(ShareLink.objects.all()), [active])
+
+
+@override_settings(AUTH_CACHE_ALIAS='default')
+class TokenCacheTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        local_auth_cache.clear()
+        cache.clear()
+        self.addCleanup(local_auth_cache.clear)
+        self.user = create_user('user')
+        self.token = Token.objects.create(user=self.user)
+
+    def authenticate(self):
+        return CachedTokenAuthentication().authenticate_credentials(self.token.key)
+
+    def test_cached_credentials_skip_database(self):
+        self.assertEqual(self.authenticate()[0], self.user)
+        with self.assertNumQueries(0):
+            user, token = self.authenticate()
+        self.assertEqual((user, token.key), (self.user, self.token.key))
+        # Без локального кэша данные берутся из общего
+        local_auth_cache.clear()
+        with self.assertNumQueries(0):
+            self.authenticate()
+
+    def test_logout_invalidates_token(self):
+        self.authenticate()
+        self.token.delete()
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+
+    def test_user_change_invalidates_token(self):
+        self.authenticate()
+        self.user.is_active = False
+        self.user.save()
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+
+
+class LoggingTests(SimpleTestCase):
+    def test_share_link_token_is_masked(self):
+        token = 'abcdefghijklmnop'
+        request = RequestFactory().get(f'/api/storage/download/{token}/')
+        request.resolver_match = resolve(request.path)
+        # Так Django пишет ответ 4xx: путь в аргументах сообщения и сам запрос в поле request
+        record = logging.makeLogRecord({
+            'msg': 'Forbidden: %s', 'args': (request.path,), 'levelno': logging.WARNING, 'request': request,
+        })
+        self.assertTrue(RouteFilter().filter(record))
+        self.assertEqual(record.getMessage(), 'Forbidden: /api/storage/download/abcdef…/')
+        self.assertNotIn(token, record.request)
+
+    def test_route_map(self):
+        with mock.patch.dict(os.environ, {'LOG_ROUTE_SAMPLE_RATES': 'file_download: 0.5, file_view:1'}):
+            self.assertEqual(route_map('LOG_ROUTE_SAMPLE_RATES', cast=float), {'file_download': 0.5, 'file_view': 1.0})
+        for value in ('file_download', 'file_download:', 'file_download:fast'):
+            with mock.patch.dict(os.environ, {'LOG_ROUTE_SAMPLE_RATES': value}):
+                with self.assertRaises(ImproperlyConfigured):
+                    route_map('LOG_ROUTE_SAMPLE_RATES', cast=float)
+
+
+class FileViewTests(TempMediaMixin, TestCase):
+    def test_range_file_reports_length_of_range(self):
+        path = os.path.join(self.media_root, 'data.bin')
+        with open(path, 'wb') as f:
+            f.write(b'0123456789')
+        range_file = RangeFile(path, 2, 5)
+        self.addCleanup(range_file.close)
+        self.assertEqual(range_file.read(2), b'23')
+        self.assertEqual(range_file.tell(), 2)
+        self.assertEqual(range_file.seek(0, os.SEEK_END), 5)
+        self.assertEqual(range_file.read(), b'')
+        range_file.seek(1)
+        self.assertEqual(range_file.read(), b'3456')
+
+    def test_inline_view_sends_content_length(self):
+        owner = create_user('owner')
+        data = b'\x89PNG\r\n\x1a\n' + b'0' * 100
+        file = upload(owner, data, name='image.png')
+        response = self.client.get(f'/api/storage/view/{owner.id_user}/{file.id_file}/')
+        self.addCleanup(response.close)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertEqual(response['Content-Length'], str(len(data)))
+        self.assertEqual(b''.join(response.streaming_content), data)
+
+    def test_text_view_is_streamed_as_utf8(self):
+        owner = create_user('owner')
+        text = 'строка\n' * 1000
+        file = upload(owner, text.encode('cp1251'), name='notes.txt')
+        url = f'/api/storage/view/{owner.id_user}/{file.id_file}/'
+        response = self.client.get(url)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'text/plain; charset=utf-8')
+        self.assertEqual(b''.join(response.streaming_content).decode('utf-8'), text)
+
+        response = self.client.get(url, {'preview_lines': 2})
+        self.assertTrue(b''.join(response.streaming_content).decode('utf-8').startswith('строка\nстрока\n\n\n[... файл обрезан'))
+
+
+@mock.patch('api_app.metrics.is_enabled', return_value=True)
+@mock.patch('api_app.metrics.observe_request')
+@mock.patch('api_app.metrics.observe_response')
+@mock.patch('api_app.metrics.stream_started')
+@mock.patch('api_app.metrics.stream_finished')
+class MetricsMiddlewareTests(SimpleTestCase):
+    def get_response(self, response):
+        return MetricsMiddleware(lambda request: response)(RequestFactory().get('/api/storage/download/1/'))
+
+    def test_aborted_stream_counts_sent_bytes(self, stream_finished, *_):
+        response = self.get_response(StreamingHttpResponse(iter([b'a' * 10, b'b' * 10])))
+        response['Content-Length'] = 20
+        # Клиент оборвал соединение после первого блока
+        next(iter(response.streaming_content))
+        response.close()
+        stream_finished.assert_called_once()
+        _, sent, _, estimated = stream_finished.call_args.args
+        self.assertEqual((sent, estimated), (10, False))
+
+    def test_sendfile_response_is_estimated(self, stream_finished, *_):
+        response = self.get_response(FileResponse(io.BytesIO(b'0123456789')))
+        self.assertIsNotNone(response.file_to_stream)
+        response.close()
+        _, sent, _, estimated = stream_finished.call_args.args
+        self.assertEqual((sent, estimated), (10, True))
+
+    async def test_async_file_response_counts_chunks(self, stream_finished, *_):
+        # Под ASGI sendfile недоступен: FileResponse отдаётся блоками и считается точно
+        async def get_response(request):
+            return FileResponse(io.BytesIO(b'0123456789'))
+
+        response = await MetricsMiddleware(get_response)(RequestFactory().get('/api/storage/download/1/'))
+        self.assertEqual(b''.join(response.streaming_content), b'0123456789')
+        response.close()
+        _, sent, _, estimated = stream_finished.call_args.args
+        self.assertEqual((sent, estimated), (10, False))
+
+    @override_settings(METRICS_SERVER_TIMING=True)
+    def test_server_timing(self, *_):
+        def get_response(request):
+            with timing('storage'):
+                pass
+            return HttpResponse(b'ok')
+
+        response = MetricsMiddleware(get_response)(RequestFactory().get('/api/storage/1/'))
+        entries = [entry.split(';')[0] for entry in response['Server-Timing'].split(', ')]
+        self.assertEqual(entries, ['app', 'db', 'storage'])
+        self.assertIn('desc="0 queries"', response['Server-Timing'])
+
+    def test_server_timing_is_disabled_by_default(self, *_):
+        self.assertNotIn('Server-Timing', self.get_response(HttpResponse(b'ok')))
+
+    @mock.patch('api_app.views.metrics_enabled', return_value=True)
+    def test_metrics_view_requires_token(self, *_):
+        with override_settings(METRICS_TOKEN=''):
+            self.assertEqual(self.client.get('/api/metrics/').status_code, 404)
+        with override_settings(METRICS_TOKEN='secret'):
+            self.assertEqual(self.client.get('/api/metrics/', HTTP_AUTHORIZATION='Bearer wrong').status_code, 401)
+
+
+class FileDeliveryTests(TempMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.owner = create_user('owner')
+        self.file = upload(self.owner, 'привет'.encode('cp1251'), name='notes.txt')
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+
+    @override_settings(FILE_DELIVERY_BACKEND='x-accel-redirect', FILE_DELIVERY_ACCEL_PREFIX='/protected-media/')
+    def test_x_accel_redirect(self):
+        response = self.client.get(f'/api/storage/download/{self.file.id_file}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Accel-Redirect'], f'/protected-media/{self.file.file.name}')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="notes.txt"')
+        self.assertEqual(response.content, b'')
+
+        # Текст без перекодирования: кодировку файла браузеру сообщает заголовок
+        response = self.client.get(f'/api/storage/view/{self.owner.id_user}/{self.file.id_file}/')
+        self.assertEqual(response['Content-Type'], 'text/plain; charset=cp1251')
+        self.assertIn('X-Accel-Redirect', response)
+
+    @override_settings(FILE_DELIVERY_BACKEND='x-sendfile')
+    def test_x_sendfile(self):
+        response = self.client.get(f'/api/storage/download/{self.file.id_file}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Sendfile'], self.file.file.path)
+        self.assertEqual(response.content, b'')
+
+    @override_settings(FILE_DELIVERY_BACKEND='unknown')
+    def test_unknown_backend_falls_back_to_python(self):
+        response = self.client.get(f'/api/storage/download/{self.file.id_file}/')
+        self.addCleanup(response.close)
+        self.assertNotIn('X-Accel-Redirect', response)
+        self.assertNotIn('X-Sendfile', response)
+        self.assertEqual(b''.join(response.streaming_content), 'привет'.encode('cp1251'))
+
+
+class AsyncViewTests(TempMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.owner = create_user('owner')
+        self.headers = {'Authorization': f'Token {Token.objects.create(user=self.owner).key}'}
+        self.file = upload(self.owner, b'0123456789', name='digits.bin')
+
+    async def content(self, response):
+        return b''.join([chunk async for chunk in response.streaming_content])
+
+    async def test_download(self):
+        url = f'/api/async/storage/download/{self.file.id_file}/'
+        self.assertEqual((await self.async_client.get(url)).status_code, 401)
+        response = await self.async_client.get(url, headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="digits.bin"')
+        self.assertEqual(await self.content(response), b'0123456789')
+
+        response = await self.async_client.get(url, headers={**self.headers, 'Range': 'bytes=2-4'})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(await self.content(response), b'234')
+
+    async def test_download_by_token_counts_downloads(self):
+        link = await ShareLink.objects.acreate(
+            storage=self.file, token='async', expiration=timezone.now() + timedelta(minutes=5), max_downloads=1,
+        )
+        url = f'/api/async/storage/download/{link.token}/'
+        response = await self.async_client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(await self.content(response), b'0123456789')
+        self.assertEqual((await self.async_client.get(url)).status_code, 403)
+        await link.arefresh_from_db()
+        self.assertEqual(link.download_count, 1)
+
+    async def test_view_and_upload(self):
+        response = await self.async_client.get(f'/api/async/storage/view/{self.owner.id_user}/{self.file.id_file}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(await self.content(response), b'0123456789')
+
+        url = f'/api/async/storage/{self.owner.id_user}/'
+        data = {'file': SimpleUploadedFile('notes.txt', b'hello'), 'comment': 'async'}
+        self.assertEqual((await self.async_client.post(url, data)).status_code, 401)
+        data['file'].seek(0)
+        response = await self.async_client.post(url, data, headers=self.headers)
+        self.assertEqual(response.status_code, 201)
+        file = await Storage.objects.aget(pk=response.json()['id_file'])
+        self.assertEqual((file.original_name, file.comment, file.size), ('notes.txt', 'async', 5))
+
+        other = await sync_to_async(create_user)('other')
+        self.assertEqual((await self.async_client.post(f'/api/async/storage/{other.id_user}/', data, headers=self.headers)).status_code, 403)
+
+
+class TextIteratorTests(SimpleTestCase):
+    def read(self, data, **kwargs):
+        return b''.join(text_iterator(io.BytesIO(data), **kwargs))
+
+    def test_multibyte_characters_split_between_chunks(self):
+        data = 'привет, мир\n'.encode('utf-8') * 3
+        # Блоки по 3 байта разрезают двухбайтовые символы
+        chunks = list(text_iterator(io.BytesIO(data), chunk_size=3))
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(b''.join(chunks), data)
+
+    def test_fallback_encoding_and_invalid_bytes(self):
+        self.assertEqual(self.read('привет'.encode('cp1251'), encoding='cp1251'), 'привет'.encode('utf-8'))
+        self.assertEqual(self.read(b'ab\xffcd'), 'ab\ufffdcd'.encode('utf-8'))
+
+    def test_preview_limits(self):
+        data = b'line1\nline2\nline3\n'
+        self.assertEqual(self.read(data, limit_bytes=len(data)), data)
+        self.assertTrue(self.read(data, limit_bytes=8).startswith(b'line1\nli\n\n[... '))
+        self.assertTrue(self.read(data, limit_lines=2).startswith(b'line1\nline2\n\n\n[... '))
+        self.assertEqual(self.read(data, limit_lines=3), data)
+
+
+class BackgroundTaskTests(SimpleTestCase):
+    def test_sweepers_are_not_started_by_management_commands(self):
+        for argv, expected in (
+            (['manage.py', 'migrate'], True),
+            (['/srv/backend/manage.py', 'benchmark'], True),
+            (['manage.py', 'runserver'], False),
+            (['/srv/venv/bin/gunicorn', 'backend_project.wsgi'], False),
+        ):
+            with mock.patch('sys.argv', argv):
+                self.assertEqual(is_management_command(), expected, argv)
+
+
+class PreviewTests(TempMediaMixin, TestCase):
+    @override_settings(PREVIEW_REQUEST_WAIT=0.05)
+    @mock.patch('api_app.views.can_preview', return_value=True)
+    def test_slow_preview_is_accepted_without_waiting(self, _):
+        owner = create_user('owner')
+        file = upload(owner, b'\x89PNG\r\n\x1a\n', name='image.png')
+        rendered = threading.Event()
+        self.addCleanup(rendered.set)
+
+        def slow_preview(sha256, source_name, content_type, size):
+            rendered.wait(5)
+            return None
+
+        with mock.patch('api_app.previews.generate_preview', side_effect=slow_preview):
+            started = time.monotonic()
+            response = self.client.get(f'/api/storage/preview/{owner.id_user}/{file.id_file}/')
+            self.assertLess(time.monotonic() - started, 1)
+            self.assertEqual(response.status_code, 202)
+            self.assertEqual(response['Retry-After'], '2')
+            rendered.set()
+
+    @override_settings(PREVIEW_SIZES=[256, 1024])
+    def test_preview_size(self):
+        self.assertEqual(get_preview_size(), 256)
+        self.assertEqual(get_preview_size(300), 1024)
+        self.assertEqual(get_preview_size(5000), 1024)
+
+    @override_settings(PREVIEW_SIZES=[])
+    def test_previews_disabled_without_sizes(self):
+        self.assertIsNone(get_preview_size(300))
+        self.assertFalse(can_preview('image/png'))
+
+
+class DownloadTrackerTests(TempMediaMixin, TestCase):
+    def test_failed_flush_keeps_pending_downloads(self):
+        owner = create_user('owner')
+        file = upload(owner, b'data')
+        tracker = DownloadTracker()
+        first = timezone.now() - timedelta(minutes=1)
+        tracker.pending = {file.id_file: (first, 2)}
+
+        with mock.patch.object(tracker, 'write', side_effect=DatabaseError):
+            self.assertEqual(tracker.flush(), 0)
+        self.assertEqual(tracker.get_pending(file.id_file), (first, 2))
+
+        # Скачивание во время неудачной записи складывается с возвращёнными в буфер событиями
+        def write_while_downloading(pending):
+            tracker.pending[file.id_file] = (timezone.now(), 1)
+            raise DatabaseError
+
+        with mock.patch.object(tracker, 'write', side_effect=write_while_downloading):
+            tracker.flush()
+        when, count = tracker.get_pending(file.id_file)
+        self.assertEqual(count, 3)
+        self.assertGreater(when, first)
+
+        self.assertEqual(tracker.flush(), 1)
+        self.assertIsNone(tracker.get_pending(file.id_file))
+        file.refresh_from_db()
+        self.assertEqual(file.download_count, 3)
+        self.assertEqual(file.last_download_date, when)
+
+
+class RangeHeaderTests(SimpleTestCase):
+    def test_parse_range_header(self):
+        for header, expected in (
+            (None, None),
+            ('bytes=0-4', [(0, 4)]),
+            ('bytes=5-', [(5, 9)]),
+            ('bytes=-3', [(7, 9)]),
+            ('bytes=-30', [(0, 9)]),
+            ('bytes=2-100', [(2, 9)]),
+            ('bytes=0-1, 4-5', [(0, 1), (4, 5)]),
+            # Неудовлетворимые диапазоны отбрасываются, пустой список - ответ 416
+            ('bytes=10-', []),
+            ('bytes=-0', []),
+            ('bytes=10-20, 2-3', [(2, 3)]),
+            # Синтаксически неверный заголовок и другие единицы игнорируются
+            ('bytes=5-2', None),
+            ('bytes=a-b', None),
+            ('bytes=-', None),
+            ('items=0-1', None),
+        ):
+            self.assertEqual(parse_range_header(header, 10), expected, header)
+        # Слишком много диапазонов - заголовок игнорируется
+        self.assertEqual(len(parse_range_header('bytes=' + ','.join(f'{i}-{i}' for i in range(16)), 100)), 16)
+        self.assertIsNone(parse_range_header('bytes=' + ','.join(f'{i}-{i}' for i in range(17)), 100))
+
+
+class RangeResponseTests(TempMediaMixin, TestCase):
+    data = b'0123456789'
+
+    def setUp(self):
+        super().setUp()
+        self.owner = create_user('owner')
+        self.file = upload(self.owner, self.data, name='digits.bin')
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+
+    def download(self, **headers):
+        response = self.client.get(f'/api/storage/download/{self.file.id_file}/', headers=headers)
+        self.addCleanup(response.close)
+        return response
+
+    def content(self, response):
+        return b''.join(response.streaming_content) if response.streaming else response.content
+
+    def test_full_download(self):
+        response = self.download()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(response['Content-Length'], '10')
+        self.assertEqual(self.content(response), self.data)
+
+    def test_single_range(self):
+        response = self.download(Range='bytes=2-5')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 2-5/10')
+        self.assertEqual(response['Content-Length'], '4')
+        self.assertEqual(self.content(response), b'2345')
+
+    def test_unsatisfiable_range(self):
+        response = self.download(Range='bytes=20-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */10')
+
+    def test_multiple_ranges(self):
+        response = self.download(Range='bytes=0-1,8-')
+        self.assertEqual(response.status_code, 206)
+        content_type, _, boundary = response['Content-Type'].partition('; boundary=')
+        self.assertEqual(content_type, 'multipart/byteranges')
+        body = self.content(response)
+        self.assertEqual(int(response['Content-Length']), len(body))
+        self.assertEqual(body, (
+            f'\r\n--{boundary}\r\nContent-Type: application/octet-stream\r\nContent-Range: bytes 0-1/10\r\n\r\n01'
+            f'\r\n--{boundary}\r\nContent-Type: application/octet-stream\r\nContent-Range: bytes 8-9/10\r\n\r\n89'
+            f'\r\n--{boundary}--\r\n'
+        ).encode())
+
+    def test_if_range(self):
+        etag = get_etag(self.file)
+        response = self.download(Range='bytes=2-3', If_Range=etag)
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(self.content(response), b'23')
+        # Файл на сервере другой версии: диапазон игнорируется, отдаётся файл целиком
+        for if_range in ('"other"', f'W/{etag}', 'Mon, 01 Jan 2001 00:00:00 GMT'):
+            response = self.download(Range='bytes=2-3', If_Range=if_range)
+            self.assertEqual(response.status_code, 200, if_range)
+            self.assertEqual(self.content(response), self.data)
+
+    def test_conditional_get(self):
+        response = self.download(If_None_Match=get_etag(self.file))
+        self.assertEqual(response.status_code, 304)
+
+
+class QuotaTests(TempMediaMixin, TestCase):
+    def test_reserve_and_release(self):
+        user = create_user('user', quota_bytes=100)
+        User.objects.reserve_space(user.pk, 60)
+        with self.assertRaises(QuotaExceeded):
+            User.objects.reserve_space(user.pk, 41)
+        User.objects.reserve_space(user.pk, 40)
+        user.refresh_from_db()
+        self.assertEqual(user.used_bytes, 100)
+        self.assertFalse(User.objects.has_space(user.pk, 1))
+
+        User.objects.release_space_many({user.pk: 30})
+        user.refresh_from_db()
+        self.assertEqual(user.used_bytes, 70)
+        self.assertTrue(User.objects.has_space(user.pk, 30))
+
+    def test_unlimited_quota(self):
+        user = create_user('user', quota_bytes=None)
+        User.objects.reserve_space(user.pk, 10 ** 12)
+        self.assertTrue(User.objects.has_space(user.pk, 10 ** 12))
+
+    def test_upload_and_delete_update_usage(self):
+        user = create_user('user', quota_bytes=10)
+        file = upload(user, b'12345678')
+        with self.assertRaises(QuotaExceeded):
+            upload(user, b'123')
+        self.assertEqual(Storage.objects.filter(id_user=user).count(), 1)
+
+        Storage.objects.filter(pk=file.pk).soft_delete()
+        user.refresh_from_db()
+        self.assertEqual(user.used_bytes, 0)
+        upload(user, b'123')
+
+    def test_content_is_stored_before_space_is_reserved(self):
+        user = create_user('user', quota_bytes=10)
+        sha256 = hashlib.sha256(b'too large file').hexdigest()
+        reserve_space = User.objects.reserve_space
+
+        def check_stored(id_user, size):
+            # Строка пользователя блокируется только после записи содержимого в хранилище
+            self.assertTrue(Blob.objects.filter(sha256=sha256).exists())
+            return reserve_space(id_user, size)
+
+        with mock.patch.object(User.objects, 'reserve_space', side_effect=check_stored) as reserve:
+            with self.captureOnCommitCallbacks(execute=True):
+                with self.assertRaises(QuotaExceeded):
+                    upload(user, b'too large file')
+        reserve.assert_called_once()
+        # Файл не поместился в квоту: сохранённое содержимое удалено
+        self.assertFalse(Blob.objects.filter(sha256=sha256).exists())
+        self.assertEqual([files for _, _, files in os.walk(self.media_root) if files], [])
+
+
+class BlobRefcountTests(TempMediaMixin, TestCase):
+    def test_dedupe_soft_delete_and_reap(self):
+        first_owner = create_user('first')
+        second_owner = create_user('second')
+        first = upload(first_owner, b'same content')
+        second = upload(second_owner, b'same content')
+        other = upload(first_owner, b'other content')
+
+        # Одинаковое содержимое хранится один раз
+        self.assertEqual(first.blob_id, second.blob_id)
+        self.assertNotEqual(first.blob_id, other.blob_id)
+        blob = Blob.objects.get(pk=first.blob_id)
+        self.assertEqual(blob.refcount, 2)
+        path = blob.file.path
+
+        # Пометка удалённым скрывает файл, но не освобождает содержимое
+        Storage.objects.filter(pk=first.pk).soft_delete()
+        self.assertFalse(Storage.objects.filter(pk=first.pk).exists())
+        self.assertTrue(Storage.all_objects.filter(pk=first.pk).exists())
+        blob.refresh_from_db()
+        self.assertEqual(blob.refcount, 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(reap_deleted_files(), 1)
+        blob.refresh_from_db()
+        self.assertEqual(blob.refcount, 1)
+        self.assertTrue(os.path.exists(path))
+
+        # Последняя ссылка: запись Blob и файл удаляются
+        Storage.objects.filter(pk=second.pk).soft_delete()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(reap_deleted_files(), 1)
+        self.assertFalse(Blob.objects.filter(pk=blob.pk).exists())
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(Blob.objects.get(pk=other.blob_id).refcount, 1)
+
+    def test_acquire_while_release_is_pending_keeps_content(self):
+        owner = create_user('owner')
+        file = upload(owner, b'shared content')
+        blob = file.blob
+        path = blob.file.path
+
+        # Последняя ссылка освобождена, но файл ещё не удалён: тот же файл загружают снова
+        with self.captureOnCommitCallbacks() as callbacks:
+            Storage.objects.filter(pk=file.pk).bulk_delete()
+        again = upload(owner, b'shared content')
+        self.assertEqual(again.blob_id, blob.pk)
+        for callback in callbacks:
+            callback()
+
+        blob.refresh_from_db()
+        self.assertEqual(blob.refcount, 1)
+        self.assertTrue(os.path.exists(path))
+
+    def test_reaper_deletes_through_queryset_delete(self):
+        owner = create_user('owner')
+        files = [upload(owner, data) for data in (b'first', b'second')]
+        ShareLink.objects.create(storage=files[0], token='token')
+        Storage.objects.filter(pk__in=[file.pk for file in files]).soft_delete()
+
+        deleted = []
+        handler = lambda sender, instance, **kwargs: deleted.append(instance.pk)
+        post_delete.connect(handler, sender=Storage)
+        self.addCleanup(post_delete.disconnect, handler, sender=Storage)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(reap_deleted_files(), 2)
+        # Записи удаляются сборщиком Django: сигналы отправляются для каждой записи
+        self.assertEqual(sorted(deleted), [file.pk for file in files])
+        self.assertFalse(Storage.all_objects.exists())
+        self.assertFalse(ShareLink.objects.exists())
+        self.assertFalse(Blob.objects.exists())
+
+    def test_reaper_removes_unreferenced_content(self):
+        owner = create_user('owner')
+        file = upload(owner, b'lost content')
+        path = file.blob.file.path
+        # Сбой между фиксацией транзакции и удалением файла: запись без ссылок осталась
+        Storage.objects.filter(pk=file.pk).update(blob=None)
+        Blob.objects.filter(pk=file.blob_id).update(refcount=0)
+
+        reap_deleted_files()
+        self.assertFalse(Blob.objects.filter(pk=file.blob_id).exists())
+        self.assertFalse(os.path.exists(path))
+
+
+class BulkOperationTests(TempMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.owner = create_user('owner')
+        self.files = [upload(self.owner, data, name=name) for data, name in (
+            (b'first', 'a.txt'), (b'second', 'a.txt'), (b'third', 'b.bin'),
+        )]
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+
+    def test_bulk_delete(self):
+        other_file = upload(create_user('other'), b'foreign')
+        url = f'/api/storage/bulk/{self.owner.id_user}/delete/'
+        ids = [self.files[0].id_file, self.files[2].id_file, other_file.id_file]
+        response = self.client.post(url, {'ids': ids}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {'deleted': sorted(ids[:2]), 'not_found': [other_file.id_file]})
+        self.assertEqual(list(Storage.objects.filter(id_user=self.owner)), [self.files[1]])
+        self.assertTrue(Storage.objects.filter(pk=other_file.pk).exists())
+        self.owner.refresh_from_db()
+        self.assertEqual(self.owner.used_bytes, len(b'second'))
+
+        self.assertEqual(self.client.post(url, {'ids': []}, format='json').status_code, 400)
+        with override_settings(BULK_MAX_FILES=2):
+            self.assertEqual(self.client.post(url, {'ids': [1, 2, 3]}, format='json').status_code, 400)
+
+    def test_zip_stream(self):
+        url = f'/api/storage/bulk/{self.owner.id_user}/zip/'
+        response = self.client.get(url, {'ids': ','.join(str(file.id_file) for file in self.files)})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        self.assertTrue(response.streaming)
+        with zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content))) as archive:
+            # Одинаковые имена различаются суффиксом, файлы не сжимаются
+            self.assertEqual(archive.namelist(), ['a.txt', 'a (1).txt', 'b.bin'])
+            self.assertEqual([archive.read(name) for name in archive.namelist()], [b'first', b'second', b'third'])
+            self.assertEqual({info.compress_type for info in archive.infolist()}, {zipfile.ZIP_STORED})
+
+        response = self.client.get(url, {'ids': f'{self.files[0].id_file},999999'})
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.data['not_found'], [999999])
+
+
+class LegacyRelocationTests(TempMediaMixin, TestCase):
+    def create_legacy_file(self, owner, name, data):
+        # Файл, загруженный до дедупликации: лежит в плоском каталоге uploads без Blob
+        os.makedirs(os.path.join(self.media_root, 'uploads'), exist_ok=True)
+        if data is not None:
+            with open(os.path.join(self.media_root, 'uploads', name), 'wb') as f:
+                f.write(data)
+        return Storage.objects.create(id_user=owner, original_name=name, size=len(data or b''), file=f'uploads/{name}')
+
+    def test_relocate_into_sharded_blobs(self):
+        owner = create_user('owner')
+        first = self.create_legacy_file(owner, 'one.txt', b'legacy content')
+        second = self.create_legacy_file(owner, 'two.txt', b'legacy content')
+        self.create_legacy_file(owner, 'lost.txt', None)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(relocate_legacy_files(), (2, 1))
+        first.refresh_from_db()
+        second.refresh_from_db()
+        sha256 = hashlib.sha256(b'legacy content').hexdigest()
+        self.assertEqual(first.blob_id, second.blob_id)
+        self.assertEqual(first.file.name, f'blobs/{sha256[:2]}/{sha256[2:4]}/{sha256}')
+        self.assertEqual((first.sha256, first.blob.refcount), (sha256, 2))
+        with first.file.open('rb') as f:
+            self.assertEqual(f.read(), b'legacy content')
+        self.assertEqual(os.listdir(os.path.join(self.media_root, 'uploads')), [])
+
+        # Повторный запуск ничего не переносит
+        self.assertEqual(relocate_legacy_files(), (0, 1))
+
+    def test_rename_keeps_stored_file(self):
+        owner = create_user('owner')
+        file = upload(owner, b'data', name='old.txt')
+        client = APIClient()
+        client.force_authenticate(owner)
+        response = client.patch(f'/api/storage/{owner.id_user}/{file.id_file}/', {'name': 'new.txt'})
+        self.assertEqual(response.status_code, 200)
+        renamed = Storage.objects.get(pk=file.pk)
+        self.assertEqual((renamed.original_name, renamed.file.name), ('new.txt', file.file.name))
+
+
+class MetadataBackfillTests(TempMediaMixin, TestCase):
+    def test_upload_stores_metadata(self):
+        data = 'Привет'.encode('cp1251')
+        file = upload(create_user('owner'), data, name='notes.txt')
+        self.assertEqual((file.content_type, file.charset), ('text/plain', 'cp1251'))
+        self.assertEqual(file.sha256, hashlib.sha256(data).hexdigest())
+
+    def test_backfill_fills_missing_metadata(self):
+        owner = create_user('owner')
+        image = upload(owner, b'\x89PNG\r\n\x1a\n' + b'\x00' * 8, name='image.bin')
+        text = upload(owner, 'Привет'.encode(), name='notes.txt')
+        missing = upload(owner, b'missing', name='archive.zip')
+        Storage.objects.update(content_type='', charset='', sha256='')
+        os.remove(missing.blob.file.path)
+
+        self.assertEqual(backfill_file_metadata(batch_size=2), (3, 1))
+        for file, content_type, charset in ((image, 'image/png', ''), (text, 'text/plain', 'utf-8'), (missing, 'application/zip', '')):
+            file.refresh_from_db()
+            self.assertEqual((file.content_type, file.charset), (content_type, charset))
+            self.assertEqual(file.sha256, file.blob.sha256)
+        # Повторный запуск ничего не меняет
+        self.assertEqual(backfill_file_metadata(), (0, 0))
+
+
+class FileListPaginationTests(TempMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.owner = create_user('owner')
+        # Одинаковые размеры проверяют разрешение равенств по id_file
+        self.files = [upload(self.owner, bytes([i]) * size, name=f'{i}.bin') for i, size in enumerate((3, 1, 2, 2, 1, 3, 2))]
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+        self.url = f'/api/storage/{self.owner.id_user}/'
+
+    def collect(self, params):
+        ids = []
+        response = self.client.get(self.url, params)
+        while True:
+            self.assertEqual(response.status_code, 200)
+            self.assertLessEqual(len(response.data['results']), params['limit'])
+            ids.extend(item['id_file'] for item in response.data['results'])
+            if response.data['next'] is None:
+                return ids
+            response = self.client.get(response.data['next'])
+
+    def test_cursor_walks_all_pages_in_order(self):
+        expected = [file.id_file for file in sorted(self.files, key=lambda file: (file.size, file.id_file))]
+        self.assertEqual(self.collect({'limit': 2, 'ordering': 'size'}), expected)
+        expected = [file.id_file for file in sorted(self.files, key=lambda file: (file.size, file.id_file), reverse=True)]
+        self.assertEqual(self.collect({'limit': 3, 'ordering': '-size'}), expected)
+
+    def test_name_prefix_filter(self):
+        response = self.client.get(self.url, {'name_prefix': '1'})
+        self.assertEqual([item['original_name'] for item in response.data], ['1.bin'])
+
+    def test_cursor_is_bound_to_ordering(self):
+        response = self.client.get(self.url, {'limit': 2, 'ordering': 'size'})
+        cursor = response.data['next'].split('cursor=')[1]
+        self.assertEqual(self.client.get(self.url, {'limit': 2, 'ordering': '-size', 'cursor': cursor}).status_code, 404)
+        self.assertEqual(self.client.get(self.url, {'limit': 2, 'cursor': 'garbage'}).status_code, 404)
+        self.assertEqual(self.client.get(self.url, {'limit': 2, 'ordering': 'comment'}).status_code, 400)
+
+
+class FileListCacheTests(TempMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.owner = create_user('owner')
+        self.file = upload(self.owner, b'data')
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+        self.url = f'/api/storage/{self.owner.id_user}/'
+
+    def assert_changed(self, etag):
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        return response['ETag']
+
+    def test_unchanged_list_is_not_modified(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('private', response['Cache-Control'])
+        self.assertIn('no-cache', response['Cache-Control'])
+
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertIn('no-cache', response['Cache-Control'])
+
+    def test_etag_changes_with_list(self):
+        etag = self.client.get(self.url)['ETag']
+        upload(self.owner, b'other', name='other.bin')
+        etag = self.assert_changed(etag)
+
+        self.assertEqual(self.client.patch(f'{self.url}{self.file.id_file}/', {'name': 'renamed.bin'}).status_code, 200)
+        etag = self.assert_changed(etag)
+
+        # Изменения у другого пользователя список не затрагивают
+        upload(create_user('other'), b'data')
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+
+class UploadSessionTests(TempMediaMixin, TestCase):
+    data = b'abcdefghij' * 3
+
+    def setUp(self):
+        super().setUp()
+        self.owner = create_user('owner')
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+        response = self.client.post(f'/api/storage/uploads/{self.owner.id_user}/', {'name': 'notes.txt', 'size': len(self.data)})
+        self.assertEqual(response.status_code, 201)
+        self.session = UploadSession.objects.get(pk=response.data['id_session'])
+        self.url = f'/api/storage/uploads/{self.owner.id_user}/{self.session.pk}/'
+
+    def put_chunk(self, start, end):
+        return self.client.put(
+            self.url, self.data[start:end], content_type='application/octet-stream',
+            headers={'Content-Range': f'bytes {start}-{end - 1}/{len(self.data)}'},
+        )
+
+    def test_out_of_order_chunks(self):
+        self.assertEqual(self.put_chunk(20, 30).data['received_ranges'], [[20, 30]])
+        response = self.put_chunk(0, 10)
+        self.assertEqual(response.data['received_ranges'], [[0, 10], [20, 30]])
+        self.assertFalse(response.data['is_complete'])
+        # Незавершённую загрузку нельзя превратить в файл
+        self.assertEqual(self.client.post(self.url).status_code, 409)
+
+        self.assertEqual(self.put_chunk(5, 25).data['received_ranges'], [[0, 30]])
+        self.assertEqual(self.client.get(self.url).data['received_size'], len(self.data))
+
+        response = self.client.post(self.url)
+        self.assertEqual(response.status_code, 201)
+        file = Storage.objects.get(pk=response.data['id_file'])
+        self.assertEqual(file.sha256, hashlib.sha256(self.data).hexdigest())
+        self.assertEqual(file.content_type, 'text/plain')
+        with file.file.open('rb') as f:
+            self.assertEqual(f.read(), self.data)
+        self.assertFalse(UploadSession.objects.filter(pk=self.session.pk).exists())
+        self.assertFalse(os.path.exists(self.session.staging_path))
+        self.owner.refresh_from_db()
+        self.assertEqual(self.owner.used_bytes, len(self.data))
+
+    def test_quota_exceeded_on_completion_releases_content(self):
+        self.put_chunk(0, 30)
+        User.objects.filter(pk=self.owner.pk).update(quota_bytes=10)
+        with mock.patch.object(User.objects, 'has_space', return_value=True):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.assertEqual(self.client.post(self.url).status_code, 413)
+        self.assertFalse(Blob.objects.exists())
+        self.assertFalse(Storage.objects.exists())
+        # Сессия остаётся: загрузку можно завершить после освобождения места
+        self.assertTrue(os.path.exists(self.session.staging_path))
+        User.objects.filter(pk=self.owner.pk).update(quota_bytes=None)
+        self.assertEqual(self.client.post(self.url).status_code, 201)
+
+    def test_chunk_outside_file(self):
+        response = self.client.put(
+            self.url + '?offset=25', self.data[:10], content_type='application/octet-stream',
+        )
+        self.assertEqual(response.status_code, 416)
+
+    def test_cancel_removes_staging_file(self):
+        self.assertTrue(os.path.exists(self.session.staging_path))
+        self.assertEqual(self.client.delete(self.url).status_code, 204)
+        self.assertFalse(os.path.exists(self.session.staging_path))
+
+    def test_deleting_user_removes_staging_file(self):
+        self.put_chunk(0, 10)
+        self.owner.delete()
+        self.assertFalse(UploadSession.objects.filter(pk=self.session.pk).exists())
+        self.assertFalse(os.path.exists(self.session.staging_path))
+
+    def test_other_users_cannot_touch_session(self):
+        self.client.force_authenticate(create_user('other'))
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+        self.assertEqual(self.put_chunk(0, 10).status_code, 403)
+
+
+class UserListTests(TempMediaMixin, TestCase):
+    def test_list_requires_admin(self):
+        client = APIClient()
+        self.assertEqual(client.get('/api/users/').status_code, 401)
+        client.force_authenticate(create_user('user'))
+        self.assertEqual(client.get('/api/users/').status_code, 403)
+        self.assertEqual(client.get('/api/users/', {'include_files': 1}).status_code, 403)
+
+    def test_admin_list_is_paginated_by_default(self):
+        users = [create_user(f'user{i}') for i in range(3)]
+        upload(users[0], b'12345')
+        client = APIClient()
+        client.force_authenticate(create_user('zadmin', role='admin'))
+        with mock.patch('api_app.pagination.UserKeysetPagination.page_size', 2):
+            response = client.get('/api/users/')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual([item['username'] for item in response.data['results']], ['user0', 'user1'])
+            self.assertEqual(response.data['results'][0]['file_count'], 1)
+            self.assertEqual(response.data['results'][0]['total_size'], 5)
+            self.assertNotIn('storages', response.data['results'][0])
+            response = client.get(response.data['next'])
+        self.assertEqual([item['username'] for item in response.data['results']], ['user2', 'zadmin'])
+        self.assertIsNone(response.data['next'])
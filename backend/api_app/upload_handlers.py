@@ -0,0 +1,173 @@
+import codecs
+import hashlib
+import mimetypes
+import os
+import tempfile
+from django.conf import settings
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, MemoryFileUploadHandler, TemporaryFileUploadHandler
+
+# Сигнатуры в начале файла для определения типа содержимого: (смещение, байты, MIME-тип)
+CONTENT_SIGNATURES = [
+    (0, b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (0, b'\xff\xd8\xff', 'image/jpeg'),
+    (0, b'GIF87a', 'image/gif'),
+    (0, b'GIF89a', 'image/gif'),
+    (0, b'II*\x00', 'image/tiff'),
+    (0, b'MM\x00*', 'image/tiff'),
+    (0, b'%PDF-', 'application/pdf'),
+    (0, b'\x1f\x8b', 'application/gzip'),
+    (0, b'7z\xbc\xaf\x27\x1c', 'application/x-7z-compressed'),
+    (0, b'Rar!\x1a\x07', 'application/vnd.rar'),
+    (0, b'ID3', 'audio/mpeg'),
+    (0, b'OggS', 'audio/ogg'),
+    (0, b'fLaC', 'audio/flac'),
+    (0, b'\x1a\x45\xdf\xa3', 'video/webm'),
+]
+# Сколько байт начала файла читается для определения типа и кодировки
+HEAD_SIZE = 64 * 1024
+# Форматы в контейнере RIFF различаются по байтам 8-12
+RIFF_FORMATS = {b'WEBP': 'image/webp', b'WAVE': 'audio/wav', b'AVI ': 'video/x-msvideo'}
+# Форматы ISO BMFF (ftyp) различаются по основному бренду, остальные бренды считаем видео mp4
+FTYP_BRANDS = {b'heic': 'image/heic', b'heix': 'image/heic', b'mif1': 'image/heif', b'avif': 'image/avif', b'qt  ': 'video/quicktime'}
+
+
+def sniff_content_type(data):
+    """
+    MIME-тип по сигнатуре в первых байтах файла или None, если сигнатура не распознана.
+    ZIP-архивы не распознаются: в них хранятся и документы (docx, xlsx, odt), тип которых точнее по имени
+    """
+    if data[:4] == b'RIFF':
+        return RIFF_FORMATS.get(data[8:12])
+    if data[4:8] == b'ftyp':
+        return FTYP_BRANDS.get(data[8:12], 'video/mp4')
+    # У BMP короткая сигнатура, поэтому дополнительно проверяем зарезервированные нулевые байты заголовка
+    if data[:2] == b'BM' and data[6:10] == b'\x00\x00\x00\x00':
+        return 'image/bmp'
+    for offset, signature, content_type in CONTENT_SIGNATURES:
+        if data[offset:offset + len(signature)] == signature:
+            return content_type
+    return None
+
+
+def detect_charset(head):
+    """
+    Кодировка текстового файла по его началу: BOM, иначе UTF-8, если начало корректно
+    декодируется, иначе FILE_TEXT_FALLBACK_ENCODING (например, cp1251 для старых файлов Windows)
+    """
+    if head.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    if head.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return 'utf-16'
+    try:
+        # final=False: последний многобайтовый символ мог быть обрезан границей блока
+        codecs.getincrementaldecoder('utf-8')().decode(head, final=False)
+    except UnicodeDecodeError:
+        return settings.FILE_TEXT_FALLBACK_ENCODING
+    return 'utf-8'
+
+
+def get_content_metadata(name, head, sniffed_content_type=None):
+    """
+    MIME-тип и кодировка файла для записи в Storage при загрузке: тип по сигнатуре содержимого
+    (если распознан), иначе по имени файла; кодировка определяется только для текстовых файлов.
+    head - начало файла (HEAD_SIZE байт)
+    """
+    content_type = (
+        sniffed_content_type or sniff_content_type(head)
+        or mimetypes.guess_type(name)[0] or 'application/octet-stream'
+    )
+    charset = detect_charset(head) if content_type.startswith('text/') else ''
+    return content_type, charset
+
+
+def read_uploaded_head(file):
+    # Начало загруженного файла для определения метаданных (файл уже на диске или в памяти)
+    file.seek(0)
+    head = file.read(HEAD_SIZE)
+    file.seek(0)
+    return head
+
+
+def get_file_sha256(file, chunk_size=1024 * 1024):
+    """
+    SHA-256 уже посчитанный обработчиком загрузки, либо (если файл получен иначе) подсчёт по блокам
+    """
+    sha256 = getattr(file, 'sha256', None)
+    if sha256:
+        return sha256
+    hasher = hashlib.sha256()
+    if isinstance(file, str):
+        with open(file, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                hasher.update(chunk)
+    else:
+        for chunk in file.chunks(chunk_size):
+            hasher.update(chunk)
+        file.seek(0)
+    return hasher.hexdigest()
+
+
+class HashingUploadHandlerMixin:
+    """
+    Считает SHA-256 файла по мере получения блоков запроса, без повторного чтения файла,
+    и определяет тип содержимого по первому блоку. Хеш доступен в атрибуте sha256 загруженного файла,
+    распознанный по сигнатуре тип заменяет content_type, переданный клиентом
+    """
+    def new_file(self, *args, **kwargs):
+        self.sha256 = hashlib.sha256()
+        self.sniffed_content_type = None
+        return super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        result = super().receive_data_chunk(raw_data, start)
+        # None означает, что блок принят этим обработчиком, а не передан следующему
+        if result is None:
+            self.sha256.update(raw_data)
+            if start == 0:
+                self.sniffed_content_type = sniff_content_type(raw_data)
+        return result
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        if file is not None:
+            file.sha256 = self.sha256.hexdigest()
+            file.sniffed_content_type = self.sniffed_content_type
+            if self.sniffed_content_type:
+                file.content_type = self.sniffed_content_type
+        return file
+
+
+class StagingUploadedFile(TemporaryUploadedFile):
+    """
+    Временный файл загрузки в MEDIA_ROOT/uploads_staging, на той же файловой системе, что и хранилище:
+    после загрузки он переносится в хранилище по хешу жёсткой ссылкой, без копирования
+    (см. BlobManager.acquire с path). Файл удаляется при закрытии, после обработки запроса
+    """
+    def __init__(self, name, content_type, size, charset, content_type_extra=None):
+        directory = os.path.join(settings.MEDIA_ROOT, 'uploads_staging')
+        os.makedirs(directory, exist_ok=True)
+        _, ext = os.path.splitext(name)
+        file = tempfile.NamedTemporaryFile(suffix='.upload' + ext, dir=directory)
+        super(TemporaryUploadedFile, self).__init__(file, name, content_type, size, charset, content_type_extra)
+
+
+class StagingFileUploadHandler(TemporaryFileUploadHandler):
+    """
+    Обработчик, записывающий тело загружаемого файла сразу в MEDIA_ROOT/uploads_staging (а не в /tmp)
+    """
+    def new_file(self, *args, **kwargs):
+        FileUploadHandler.new_file(self, *args, **kwargs)
+        self.file = StagingUploadedFile(self.file_name, self.content_type, 0, self.charset, self.content_type_extra)
+
+
+class HashingMemoryFileUploadHandler(HashingUploadHandlerMixin, MemoryFileUploadHandler):
+    pass
+
+
+class HashingTemporaryFileUploadHandler(HashingUploadHandlerMixin, TemporaryFileUploadHandler):
+    pass
+
+
+class HashingStagingFileUploadHandler(HashingUploadHandlerMixin, StagingFileUploadHandler):
+    pass
@@ -1,5 +1,6 @@
 from django.urls import path
-from .views import UserView, StorageView
+from .views import MetricsView, UserView, StorageView, StorageBulkView, UploadSessionView
+from . import async_views
 
 urlpatterns = [
     path("users/", UserView.as_view(), name="users_list-add_user"),  # Для GET: список пользователей и POST: создание нового пользователя, вход (выход) в(из) личный кабинет
@@ -7,8 +8,19 @@ urlpatterns = [
     path("users/<int:id_user>/", UserView.as_view(), name="user_delete-change_role"),  # Для DELETE: удаление пользователя и PATCH: изменение роли
     path("storage/<int:id_user>/", StorageView.as_view(), name='files_list-add_file'),  # Для GET: список файлов пользователя и POST: загрузка файла
     path("storage/view/<int:id_user>/<int:id_file>/", StorageView.as_view(), name='file_view'),  # Для GET: просмотр файла
+    path("storage/preview/<int:id_user>/<int:id_file>/", StorageView.as_view(), name='file_preview'),  # Для GET: эскиз файла (изображения, первой страницы PDF)
     path("storage/download/<int:id_file>/", StorageView.as_view(), name='file_download'),  # Для GET: скачивание файла
     path("storage/download/<str:token>/", StorageView.as_view(), name='file_download_by_token'),  # Для GET: скачивание файла по уникальному токену
     path("storage/link/<int:id_user>/<int:id_file>/", StorageView.as_view(), name='generate_file_link'),  # Для POST: генерация ссылки
     path("storage/<int:id_user>/<int:id_file>/", StorageView.as_view(), name='delete_file'),  # Для DELETE: удаления файла по его id и PATCH: переименование файла
+    path("storage/bulk/<int:id_user>/delete/", StorageBulkView.as_view(), name='storage_bulk_delete'),  # Для POST: удаление нескольких файлов
+    path("storage/bulk/<int:id_user>/zip/", StorageBulkView.as_view(), name='storage_bulk_zip'),  # Для GET: скачивание нескольких файлов ZIP-архивом
+    path("storage/uploads/<int:id_user>/", UploadSessionView.as_view(), name='upload_session_create'),  # Для POST: создание сессии поблочной загрузки
+    # Асинхронные варианты (для запуска под ASGI-сервером)
+    path("async/storage/<int:id_user>/", async_views.upload_file, name='async_upload_file'),  # Для POST: загрузка файла
+    path("async/storage/view/<int:id_user>/<int:id_file>/", async_views.view_file, name='async_file_view'),  # Для GET: просмотр файла
+    path("async/storage/download/<int:id_file>/", async_views.download_file, name='async_file_download'),  # Для GET: скачивание файла
+    path("async/storage/download/<str:token>/", async_views.download_file_by_token, name='async_file_download_by_token'),  # Для GET: скачивание файла по токену
+    path("storage/uploads/<int:id_user>/<uuid:id_session>/", UploadSessionView.as_view(), name='upload_session'),  # Для PUT: запись блока, GET: состояние, POST: завершение, DELETE: отмена загрузки
+    path("metrics/", MetricsView.as_view(), name='metrics'),  # Для GET: метрики в формате Prometheus (Authorization: Bearer <METRICS_TOKEN>)
 ]
@@ -3,23 +3,88 @@ import os
 from django.conf import settings
 from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
 from django.views import View
-from django.utils.crypto import get_random_string
+from django.utils.crypto import constant_time_compare, get_random_string
 from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import parse_etags, quote_etag
+from django.db import transaction
+from django.db.models import Count, F, Max, Prefetch, Q, Sum
+from django.db.models.functions import Coalesce
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.exceptions import AuthenticationFailed
 from rest_framework.permissions import AllowAny, IsAuthenticated
 import urllib.parse
-from .serializers import UserSerializer, StorageSerializer
-from .models import User, Storage
-from .permissions import IsAuthenticatedOrViewFile
+from .serializers import UserSerializer, UserListSerializer, ShareLinkSerializer, StorageSerializer, UploadSessionSerializer
+from .models import Blob, QuotaExceeded, ShareLink, User, Storage, UploadSession
+from .upload_handlers import HEAD_SIZE, StagingUploadedFile, get_content_metadata, get_file_sha256, read_uploaded_head
+from .filters import filter_storage_queryset
+from .pagination import StorageKeysetPagination, UserKeysetPagination
+from .download_stats import download_tracker
+from .file_storage import (
+    get_presigned_upload,
+    get_stored_file_sha256,
+    get_stored_object_info,
+    open_file,
+    read_head,
+    sha256_to_checksum,
+    supports_presigned_urls,
+)
+from .permissions import IsAdmin, IsAuthenticatedOrViewFile, IsOwnerOrAdmin
+from .log import mask_token
+from .metrics import export_metrics, is_enabled as metrics_enabled, record_share_link, timing
+from .previews import PREVIEW_CONTENT_TYPE, can_preview, get_preview_size, preview_generator, schedule_previews
+from .file_delivery import (
+    DELIVERY_PYTHON,
+    TEXT_CONTENT_TYPES,
+    build_offloaded_response,
+    build_text_response,
+    deliver_file,
+    get_chunk_size,
+    get_delivery_backend,
+    get_http_charset,
+    get_not_modified_response,
+    get_positive_int_param,
+    is_preview_request,
+    set_cache_headers,
+    zip_iterator,
+)
 import logging
 
-# Настройка логирования
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+# Обработчики, формат и уровни логов задаются в settings.LOGGING (см. api_app/log.py).
+# В логи не передаются request.data (пароли, файлы) и наборы записей: только идентификаторы
 logger = logging.getLogger(__name__)
 
+# Запас на заголовки частей multipart-запроса при предварительной проверке квоты по Content-Length
+MULTIPART_OVERHEAD = 64 * 1024
+# Через сколько секунд повторить запрос эскиза, который ещё создаётся
+PREVIEW_RETRY_AFTER = 2
+
+
+# Ответ на загрузку файла, который не помещается в квоту пользователя
+def quota_exceeded_response():
+    return Response({"detail": "Недостаточно места: превышена квота пользователя."}, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+
+def get_content_length(request):
+    try:
+        return int(request.META.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        return 0
+
+
+def get_link_resume_cookie(link: ShareLink):
+    # Имя и соль подписанной cookie, разрешающей докачку файла по ссылке: cookie одной ссылки не подходит к другой
+    return f'share_link_{link.pk}', f'share_link_resume:{link.pk}'
+
+
+def get_link_resume_max_age(link: ShareLink):
+    # Докачка разрешена, пока действует ссылка
+    if link.expiration is None:
+        return None
+    return max(int((link.expiration - timezone.now()).total_seconds()), 1)
+
 class UserView(APIView):
     permission_classes = [AllowAny]
     # Метод для обработки GET-запрос: получение списка всех пользователей с данными или получение данных о пользователе по токену
@@ -28,10 +93,38 @@ class UserView(APIView):
         if request.path == '/api/users/user_info/':
             return self.get_user_info(request)
         
-        queryset = User.objects.all()
-        serializer = UserSerializer(queryset, many=True)
-        logger.debug('Список пользователей: %s', queryset)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return self.list_users(request)
+
+    # Дополнительный метод к GET-запросу: список пользователей для администратора
+    def list_users(self, request):
+        """
+        Список пользователей с количеством файлов, их общим размером и датой последней загрузки,
+        посчитанными одним запросом. Список файлов каждого пользователя возвращается
+        только при ?include_files=1 (одним дополнительным запросом).
+        Список всегда отдаётся постранично ({"next", "first", "results"}, ?limit= и ?cursor=),
+        чтобы запрос не загружал всех пользователей сразу. Доступен только администратору
+        """
+        self.permission_classes = [IsAdmin]
+        self.check_permissions(request)
+        active_files = Q(storages__deleted_at__isnull=True)
+        queryset = User.objects.annotate(
+            file_count=Count('storages', filter=active_files),
+            total_size=Coalesce(Sum('storages__size', filter=active_files), 0),
+            last_upload=Max('storages__upload_date', filter=active_files),
+        )
+        fields = None
+        if request.query_params.get('include_files') in ('1', 'true'):
+            queryset = queryset.prefetch_related(
+                Prefetch('storages', queryset=Storage.objects.order_by('-upload_date', '-id_file'))
+            )
+        else:
+            fields = [name for name in UserListSerializer.Meta.fields if name != 'storages']
+
+        paginator = UserKeysetPagination()
+        page = paginator.paginate_queryset(queryset, request, view=self)
+        serializer = UserListSerializer(page, many=True, fields=fields)
+        logger.debug('Список пользователей: %s записей', len(serializer.data))
+        return paginator.get_paginated_response(serializer.data)
         
     def get_user_info(self, request):
         logger.info('GET запрос: Получение данных о пользователе по токену')
@@ -39,6 +132,8 @@ class UserView(APIView):
         self.check_permissions(request)
 
         user = request.user
+        # Пользователь мог быть взят из кэша аутентификации, счётчик занятого места читаем из базы
+        quota_bytes, used_bytes = User.objects.filter(pk=user.pk).values_list('quota_bytes', 'used_bytes').get()
         user_data = {
             'id_user': user.id_user,
             'email': user.email,
@@ -48,13 +143,15 @@ class UserView(APIView):
             'is_active': user.is_active,
             'is_staff': user.is_staff,
             'is_superuser': user.is_superuser,
+            'quota_bytes': quota_bytes,
+            'used_bytes': used_bytes,
         }
         logger.debug('Данные о пользователе: %s', user_data)
         return Response(user_data)
 
     # Метод для обработки POST-запроса: создание нового пользователя, вход и выход в(из) личного кабинета
     def post(self, request):
-        logger.info('POST запрос с данными: %s', request.data)
+        logger.info('POST запрос: %s', request.path)
         if len(request.data) == 1 and list(request.data.keys())[0] == 'username' :     
             # вход в личный кабинет
             return self.login_user(request)
@@ -75,7 +172,7 @@ class UserView(APIView):
         return Response(status=204)
 
     def create_user(self, request):
-        logger.info('Создание нового пользователя с данными: %s', request.data)
+        logger.info('Создание нового пользователя: %s', request.data.get('username'))
         serializer = UserSerializer(data=request.data)
         if serializer.is_valid():
             user = serializer.save()
@@ -89,7 +186,10 @@ class UserView(APIView):
         self.permission_classes = [IsAuthenticated]
         try:
             self.check_permissions(request)
-            user = User.objects.get(username=request.data["username"])
+            # Пользователь уже получен при аутентификации по токену
+            user = request.user
+            if user.username != request.data["username"]:
+                user = User.objects.get(username=request.data["username"])
         except AuthenticationFailed:
             logger.error('Аутентификация не удалась для пользователя: %s', request.data["username"])
             return Response({"detail": "Не авторизован."}, status=status.HTTP_401_UNAUTHORIZED)
@@ -112,18 +212,18 @@ class UserView(APIView):
         id_user = kwargs.get("id_user")
         try:
             user = User.objects.get(id_user=id_user)
-            # Получаем все связанные записи Storage и удаляем их
-            storages = user.storages.all()
-            for storage in storages:
-                storage.delete()  # вызывется метод delete из Storage, и файл будет удалён из файловой системы
-            user.delete()
+            with transaction.atomic():
+                # Файлы пользователя только помечаются удалёнными (один UPDATE),
+                # записи и файлы на диске удаляет фоновая очистка
+                user.storages.all().soft_delete()
+                user.delete()
             logger.info('Пользователь и его файлы удалены:: %s', id_user)
             return Response(status=status.HTTP_204_NO_CONTENT)
         except User.DoesNotExist:
             logger.warning('Пользователь не найден по user ID: %s', id_user)
             return Response({"detail": "Пользователь не найден."}, status=status.HTTP_404_NOT_FOUND)
 
-    # Метод для обработки PATCH-запроса: изменение роли пользователя
+    # Метод для обработки PATCH-запроса: изменение роли или квоты пользователя
     def patch(self, request, **kwargs):
         logger.info('PATCH запрос на изменение роли пользователя: %s', kwargs.get("id_user"))
         self.permission_classes = [IsAuthenticated]
@@ -145,32 +245,54 @@ class UserView(APIView):
             serializer = UserSerializer(user)
             logger.info('Роль пользователя успешно обновлена: %s', user.username)
             return Response(serializer.data, status=status.HTTP_200_OK)
+
+        if "quota_bytes" in request.data:
+            return self.update_quota(request, user)
         
-        logger.error('Неправильное поле для обновления: %s', request.data)
+        logger.error('Неправильное поле для обновления: %s', list(request.data))
         return Response({"detail": "Неправильное поле для обновления."}, status=status.HTTP_400_BAD_REQUEST)
 
 
+    # Дополнительный метод к PATCH-запросу: изменение квоты пользователя (только администратор)
+    def update_quota(self, request, user):
+        if not (request.user.role == 'admin' or request.user.is_superuser):
+            logger.warning('Попытка изменить квоту без прав администратора: %s', request.user.username)
+            return Response({"detail": "У вас недостаточно прав для выполнения данного действия."}, status=status.HTTP_403_FORBIDDEN)
+        quota_bytes = request.data["quota_bytes"]
+        try:
+            quota_bytes = None if quota_bytes in (None, "") else int(quota_bytes)
+        except (TypeError, ValueError):
+            quota_bytes = -1
+        if quota_bytes is not None and quota_bytes < 0:
+            return Response({"quota_bytes": ["Ожидается неотрицательное число байт или null."]}, status=status.HTTP_400_BAD_REQUEST)
+        # Меняем только квоту: счётчик used_bytes мог измениться после чтения пользователя
+        user.quota_bytes = quota_bytes
+        user.save(update_fields=['quota_bytes'])
+        user.refresh_from_db(fields=['used_bytes'])
+        logger.info('Квота пользователя %s: %s', user.username, quota_bytes)
+        return Response(UserSerializer(user).data, status=status.HTTP_200_OK)
+
+
 class StorageView(APIView):
     permission_classes = [IsAuthenticatedOrViewFile]
     
-    # Метод для Обновления поля last_download_date
+    # Метод для Обновления поля last_download_date (и счётчика скачиваний)
     def update_last_download_date(self, file: Storage):
-        logger.info(f'Обновление даты последнего скачивания для файла: {file.original_name}')
+        logger.debug('Обновление даты последнего скачивания для файла: id_file=%s', file.id_file)
         file.last_download_date = timezone.now()
-        file.save(update_fields=['last_download_date'])
-
-    # Метод для очистки истекших токенов для специальных ссылок
-    def clean_expired_tokens(self):
-        objects = Storage.objects.filter(token_expiration__lt=timezone.now())
-        # Обновляем истекшие токены, очищая поля token и token_expiration
-        if objects:
-            logger.info(f'Удаление устаревших токенов {len(objects)} объектов')
-            objects.update(token=None, token_expiration=None)
+        # Запись в базу выполняется пакетно в фоне (см. DOWNLOAD_STATS_FLUSH_INTERVAL)
+        download_tracker.record(file, file.last_download_date)
 
     # Метод для обработки GET-запроса: получение списка всех файлов пользователя, просмотр файла, скачивание файла
     def get(self, request, id_user=None, id_file=None, token=None):
-        logger.info('GET запрос: id_user=%s, id_file=%s, token=%s', id_user, id_file, token)
-        if id_user and id_file:
+        logger.info('GET запрос: id_user=%s, id_file=%s, token=%s', id_user, id_file, mask_token(token))
+        if id_user and id_file and request.resolver_match.url_name == 'generate_file_link':
+            # список ссылок на файл
+            return self.list_file_links(request, id_user, id_file)
+        elif id_user and id_file and request.resolver_match.url_name == 'file_preview':
+            # эскиз файла
+            return self.preview_file(request, id_user, id_file)
+        elif id_user and id_file:
             # просмотр файла
             return self.view_file(request, id_user, id_file)
         elif id_file:
@@ -180,73 +302,152 @@ class StorageView(APIView):
             # скачивание файла по токену(специальной ссылке)
             return self.download_file_by_token(request, token)
         else:
-            self.clean_expired_tokens()  # удаляем истекшие ссылки
             # получение списка всех файлов
-            queryset = Storage.objects.filter(id_user=id_user)
-            serializer = StorageSerializer(queryset, many=True)
-            return Response(serializer.data, status=status.HTTP_200_OK)
-    
-    # Дополнительный метод к view_file, download_file, download_file_by_token
-    def get_file_params(self, id_file=None, token=None, options=None):
+            return self.list_files(request, id_user)
+
+    # Дополнительный метод к GET-запросу: список файлов пользователя
+    def list_files(self, request, id_user):
         """
-        Метод для получения файла, путь к нему, MIME-тип, имя файла
+        Список файлов с фильтрами (см. filter_storage_queryset), сортировкой ?ordering=
+        и выбором полей ?fields=id_file,original_name,size.
+        При передаче ?limit= или ?cursor= список отдаётся постранично: {"next", "first", "results"},
+        иначе - целиком, как раньше.
+        ETag списка строится из версии списка файлов пользователя (User.storage_version): если список
+        не изменился, на условный запрос возвращается 304 без чтения файлов из базы
         """
-        logger.debug('Получение параметров файла: id_file=%s, token=%s', id_file, token)
-        if token:
-            file = Storage.objects.get(token=token)
-        elif id_file: 
-            file = Storage.objects.get(id_file=id_file)
+        version = User.objects.filter(pk=id_user).values_list('storage_version', flat=True).first()
+        etag = quote_etag(f'{id_user}-{version}-{request.accepted_renderer.format}')
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = self.build_file_list(request, id_user)
+        if response.status_code in (status.HTTP_200_OK, status.HTTP_304_NOT_MODIFIED):
+            response['ETag'] = etag
+            patch_cache_control(response, private=True, no_cache=True)
+        return response
 
-        file_path = file.file.path
+    # Дополнительный метод к list_files: выборка и сериализация списка файлов
+    def build_file_list(self, request, id_user):
+        queryset = filter_storage_queryset(Storage.objects.filter(id_user=id_user), request.query_params)
 
-        if options == "os.path" and not os.path.exists(file_path):
-            logger.error('Файл не найден: %s', file_path)
-            raise Http404("Файл не найден")
+        fields = None
+        if request.query_params.get('fields'):
+            fields = [name.strip() for name in request.query_params['fields'].split(',') if name.strip()]
+            unknown = set(fields) - set(StorageSerializer().fields)
+            if unknown:
+                return Response({"fields": f"Неизвестные поля: {', '.join(sorted(unknown))}."}, status=status.HTTP_400_BAD_REQUEST)
+            # Из базы читаем только нужные колонки
+            queryset = queryset.only(*fields)
 
-        # Получаем MIME-тип файла
-        content_type, _ = mimetypes.guess_type(file_path)
-        
-        # Если MIME-тип не удалось определить, устанавливаем значение по умолчанию
-        if content_type is None:
-            content_type = 'application/octet-stream'
-        encoded_file_name = urllib.parse.quote(file.original_name)
+        paginator = StorageKeysetPagination()
+        if paginator.limit_query_param in request.query_params or paginator.cursor_query_param in request.query_params:
+            page = paginator.paginate_queryset(queryset, request, view=self)
+            serializer = StorageSerializer(page, many=True, fields=fields)
+            return paginator.get_paginated_response(serializer.data)
 
-        return file_path, content_type, encoded_file_name, file
+        if paginator.ordering_query_param in request.query_params:
+            queryset = queryset.order_by(paginator.get_ordering(request), 'id_file')
+        serializer = StorageSerializer(queryset, many=True, fields=fields)
+        return Response(serializer.data, status=status.HTTP_200_OK)
     
-    # Дополнительный метод к download_file, download_file_by_token
-    def file_iterator(self, file_name, chunk_size=512):
+    # Дополнительный метод к view_file, download_file, download_file_by_token
+    def get_file_params(self, id_file=None, file=None):
         """
-        Функция file_iterator позволяtn считывать файлы по частям, 
-        управляя использованием памяти и делая программу более производительной
+        Метод для получения файла, его имя в хранилище, MIME-тип, имя файла.
+        Можно передать уже полученную запись Storage в file.
+        Все данные берутся из записи (один запрос по первичному ключу), хранилище не опрашивается:
+        если файла в хранилище нет, FileNotFoundError возникает при его открытии
         """
-        logger.debug('Итерация по файлу: %s', file_name)
-        with open(file_name, 'rb') as f:
-            while True:
-                chunk = f.read(chunk_size)
-                if not chunk:
-                    break
-                yield chunk
+        logger.debug('Получение параметров файла: id_file=%s', id_file or file.id_file)
+        if file is None:
+            file = Storage.objects.get(id_file=id_file)
+
+        file_name = file.file.name
+
+        # MIME-тип определён по содержимому при загрузке; для записей без него (до backfill_file_metadata) - по имени
+        content_type = file.content_type or mimetypes.guess_type(file.original_name)[0] or 'application/octet-stream'
+        encoded_file_name = urllib.parse.quote(file.original_name)
 
+        return file_name, content_type, encoded_file_name, file
+    
     # Метод для обработки GET-запроса: просмотр файла    
     def view_file(self, request, id_user, id_file):
         logger.info('Предоставление файла для просмотра: id_file=%s', id_file)
         try:
-            file_path, content_type, encoded_file_name, _ = self.get_file_params(id_file=id_file, options="os.path")
+            file_name, content_type, encoded_file_name, file = self.get_file_params(id_file=id_file)
+            # Копия файла у браузера актуальна - отвечаем 304 без содержимого
+            not_modified = get_not_modified_response(request, file)
+            if not_modified is not None:
+                return not_modified
+            delivery_backend = get_delivery_backend()
 
-            # Если файл текстовый, открываем его с кодировкой
-            if content_type in ['text/plain', 'text/html', 'text/csv']:
-                with open(file_path, 'r', encoding='utf-8') as file:
-                    response = HttpResponse(file.read(), content_type=f"{content_type}; charset=utf-8")
+            if content_type in TEXT_CONTENT_TYPES and (delivery_backend == DELIVERY_PYTHON or is_preview_request(request)):
+                # Текстовый файл отдаём потоком с декодированием в utf-8 (или только его начало при предпросмотре)
+                response = set_cache_headers(build_text_response(request, file, content_type), file)
+            elif delivery_backend != DELIVERY_PYTHON:
+                # Передачу файла выполняет веб-сервер, текстовым файлам явно указываем кодировку
+                if content_type in TEXT_CONTENT_TYPES:
+                    content_type = f"{content_type}; charset={get_http_charset(file)}"
+                response = build_offloaded_response(file, content_type, delivery_backend, 'inline')
             else:
                 # Для остальных типов файлов, используем FileResponse
-                response = FileResponse(open(file_path, 'rb'), content_type=content_type)
+                response = FileResponse(open_file(file_name), content_type=content_type)
+                response.block_size = get_chunk_size()
+                # Размер известен из записи, в том числе для объектного хранилища
+                response['Content-Length'] = file.size
+                set_cache_headers(response, file)
 
             response['Content-Disposition'] = f'inline; filename="{encoded_file_name}"'
             return response
         except Storage.DoesNotExist:
             logger.warning('Файл не найден для просмотра: id_file=%s', id_file)
             raise Http404("Файл не найден")
+        except FileNotFoundError:
+            logger.error('Файл отсутствует в хранилище: id_file=%s', id_file)
+            raise Http404("Файл не найден")
         
+    # Метод для обработки GET-запроса: эскиз изображения или первой страницы PDF
+    def preview_file(self, request, id_user, id_file):
+        """
+        Уменьшенная копия файла для списка файлов (?size= - длинная сторона в пикселях,
+        выбирается ближайший из PREVIEW_SIZES). Эскиз зависит только от содержимого,
+        поэтому кэшируется браузером надолго и проверяется по ETag.
+        Если эскиза ещё нет и он не создан за PREVIEW_REQUEST_WAIT секунд, возвращается 202 с Retry-After
+        """
+        logger.info('Эскиз файла: id_file=%s', id_file)
+        try:
+            file = Storage.objects.select_related('blob').get(id_file=id_file, id_user=id_user)
+        except Storage.DoesNotExist:
+            logger.warning('Файл не найден для эскиза: id_file=%s', id_file)
+            raise Http404("Файл не найден")
+
+        _, content_type, _, _ = self.get_file_params(file=file)
+        # Эскизы хранятся по хешу содержимого, файлам до дедупликации они недоступны
+        if file.blob is None or not can_preview(content_type):
+            return Response({"detail": "Предпросмотр для этого файла недоступен."}, status=status.HTTP_404_NOT_FOUND)
+
+        size = get_preview_size(get_positive_int_param(request, 'size', None))
+        etag = quote_etag(f'{file.blob.sha256}-{size}')
+        cache_control = f'private, max-age={settings.PREVIEW_CACHE_MAX_AGE}, immutable'
+        if_none_match = request.headers.get('If-None-Match')
+        if if_none_match and (etag in parse_etags(if_none_match) or if_none_match.strip() == '*'):
+            response = HttpResponse(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            try:
+                with timing('preview'):
+                    preview_name = preview_generator.get(file.blob.sha256, file.blob.file.name, content_type, size)
+            except TimeoutError:
+                # Эскиз досоздаётся в фоне: воркер не ждёт его, клиент повторяет запрос позже
+                logger.info('Эскиз создаётся: id_file=%s', id_file)
+                response = Response({"detail": "Эскиз создаётся, повторите запрос позже."}, status=status.HTTP_202_ACCEPTED)
+                response['Retry-After'] = PREVIEW_RETRY_AFTER
+                return response
+            if preview_name is None:
+                return Response({"detail": "Не удалось создать эскиз файла."}, status=status.HTTP_404_NOT_FOUND)
+            response = FileResponse(open_file(preview_name), content_type=PREVIEW_CONTENT_TYPE)
+        response['ETag'] = etag
+        response['Cache-Control'] = cache_control
+        return response
+
     # Вариант 2:работает но 2 проблемы:
     # 1. не отображает нормально русские буквы в txt файлах, 
     # 2. если браузер не поддерживает просмотр то скачивает файл, но под непонятным именем
@@ -272,11 +473,15 @@ class StorageView(APIView):
     def download_file(self, request, id_file):
         logger.info('Скачивание файла: id_file=%s', id_file)
         try:
-            file_path, content_type, encoded_file_name, file = self.get_file_params(id_file=id_file)
+            file_name, content_type, encoded_file_name, file = self.get_file_params(id_file=id_file)
+            # Ответ 304 не считается скачиванием
+            not_modified = get_not_modified_response(request, file)
+            if not_modified is not None:
+                return not_modified
 
             self.update_last_download_date(file)
 
-            response = StreamingHttpResponse(self.file_iterator(file_path), content_type=content_type)
+            response = deliver_file(request, file, content_type)
             response['Content-Disposition'] = f'attachment; filename="{encoded_file_name}"'
             response['X-Filename'] = encoded_file_name
             
@@ -285,30 +490,91 @@ class StorageView(APIView):
         except Storage.DoesNotExist:
             logger.warning('Файл не найден при скачивании: id_file=%s', id_file)
             return HttpResponse(status=404)
+        except FileNotFoundError:
+            logger.error('Файл отсутствует в хранилище: id_file=%s', id_file)
+            return HttpResponse(status=404)
     
     # Метод к GET-запросу: скачивание файла по ссылке
     def download_file_by_token(self, request, token):
-        logger.info('Скачивание файла по токену: token=%s', token)
+        logger.info('Скачивание файла по токену: token=%s', mask_token(token))
+        # Ссылка и файл получаются одним запросом по уникальному индексу token
         try:
-            file_path, content_type, encoded_file_name, file = self.get_file_params(token=token, options="os.path")
+            link = ShareLink.objects.select_related('storage').get(token=token)
+        except ShareLink.DoesNotExist:
+            logger.warning('Файл не найден по токену: token=%s', mask_token(token))
+            record_share_link('not_found')
+            return Response({"detail": "Файл не найден."}, status=status.HTTP_404_NOT_FOUND)
 
-            # Проверяем, не истек ли токен
-            if file.token_expiration < timezone.now():
-                logger.warning('Ссылка устарела для токена: %s', token)
-                return Response({"detail": "Ссылка устарела."}, status=status.HTTP_403_FORBIDDEN)
+        # Проверяем, не отозвана ли ссылка и не истек ли токен
+        if link.revoked or link.is_expired():
+            logger.warning('Ссылка устарела: id_link=%s', link.pk)
+            record_share_link('expired')
+            return Response({"detail": "Ссылка устарела."}, status=status.HTTP_403_FORBIDDEN)
 
-            # Обновляем поле last_download_date
-            self.update_last_download_date(file)
+        file_name, content_type, encoded_file_name, file = self.get_file_params(file=link.storage)
+        # Ответ 304 не расходует лимит скачиваний по ссылке
+        not_modified = get_not_modified_response(request, file)
+        if not_modified is not None:
+            record_share_link('not_modified')
+            return not_modified
 
-            response = StreamingHttpResponse(self.file_iterator(file_path), content_type=content_type)
-            response['Content-Disposition'] = f'attachment; filename="{encoded_file_name}"'
-            response['X-Filename'] = encoded_file_name
-            logger.info('Файл %s успешно скачан по токену', encoded_file_name)
-            return response
+        resume = self.is_link_resume(request, link)
+        if not resume and not self.register_link_download(link):
+            logger.warning('Исчерпан лимит скачиваний по ссылке: id_link=%s', link.pk)
+            record_share_link('limit')
+            return Response({"detail": "Превышено количество скачиваний по ссылке."}, status=status.HTTP_403_FORBIDDEN)
 
-        except Storage.DoesNotExist:
-            logger.warning('Файл не найден по токену: token=%s', token)
+        # Обновляем поле last_download_date
+        self.update_last_download_date(file)
+
+        try:
+            response = deliver_file(request, file, content_type)
+        except FileNotFoundError:
+            logger.error('Файл отсутствует в хранилище: id_file=%s', file.id_file)
+            record_share_link('missing_file')
             return Response({"detail": "Файл не найден."}, status=status.HTTP_404_NOT_FOUND)
+        record_share_link('hit')
+        if not resume:
+            self.set_link_resume_cookie(request, response, link)
+        response['Content-Disposition'] = f'attachment; filename="{encoded_file_name}"'
+        response['X-Filename'] = encoded_file_name
+        logger.info('Файл %s успешно скачан по токену', encoded_file_name)
+        return response
+
+    # Дополнительный метод к download_file_by_token: докачка файла по ссылке
+    def is_link_resume(self, request, link: ShareLink):
+        """
+        Докачка - запрос с Range не от начала файла от клиента, чьё скачивание по ссылке уже учтено.
+        Учтённому скачиванию сервер выдаёт подписанную cookie (см. set_link_resume_cookie),
+        поэтому докачку нельзя подделать заголовками, а проверка не зависит от кэша и воркера,
+        принявшего запрос. Докачка лимит не расходует и разрешена и после его исчерпания
+        """
+        range_header = request.headers.get('Range', '').replace(' ', '')
+        if not range_header or range_header.startswith('bytes=0-'):
+            return False
+        name, salt = get_link_resume_cookie(link)
+        value = request.get_signed_cookie(name, default=None, salt=salt, max_age=get_link_resume_max_age(link))
+        return value == str(link.pk)
+
+    # Дополнительный метод к download_file_by_token: учёт скачивания по ссылке с лимитом
+    def register_link_download(self, link: ShareLink):
+        """
+        Новым скачиванием считается любой запрос, кроме докачки (см. is_link_resume), в том числе
+        первый запрос клиента с Range не от начала файла.
+        Счётчик увеличивается условным UPDATE, поэтому лимит не превышается при параллельных запросах
+        """
+        links = ShareLink.objects.filter(pk=link.pk)
+        if link.max_downloads is not None:
+            links = links.filter(download_count__lt=F('max_downloads'))
+        return links.update(download_count=F('download_count') + 1) == 1
+
+    # Дополнительный метод к download_file_by_token: разрешение на докачку учтённого скачивания
+    def set_link_resume_cookie(self, request, response, link: ShareLink):
+        name, salt = get_link_resume_cookie(link)
+        response.set_signed_cookie(
+            name, str(link.pk), salt=salt, max_age=get_link_resume_max_age(link),
+            path=request.path, secure=request.is_secure(), httponly=True, samesite='Lax',
+        )
 
     # Метод для обработки POST-запроса: загрузка нового файла, генерации ссылки
     def post(self, request, id_user=None, id_file=None):
@@ -323,6 +589,8 @@ class StorageView(APIView):
     # Дополнительный метод к POST-запросу post: генерация ссылки
     def generate_file_link(self, request, id_user, id_file):
         logger.info('Генерация ссылки для файла: id_user=%s, id_file=%s', id_user, id_file)
+        self.permission_classes = [IsOwnerOrAdmin]
+        self.check_permissions(request)
         # Проверяем, существует ли файл
         try:
             storage_item = Storage.objects.get(id_file=id_file, id_user=id_user)
@@ -330,77 +598,138 @@ class StorageView(APIView):
             logger.error('Файл не найден: id_user=%s, id_file=%s', id_user, id_file)
             return Response({"detail": "Файл не найден."}, status=status.HTTP_404_NOT_FOUND)
 
-        # Генерируем уникальный токен
-        unique_token = get_random_string(length=32)
+        # Срок действия (в минутах) и лимит скачиваний можно передать в запросе
+        try:
+            expires_in = int(request.data.get("expires_in") or settings.SHARE_LINK_TTL_MINUTES)
+            max_downloads = int(request.data["max_downloads"]) if request.data.get("max_downloads") else None
+        except (TypeError, ValueError):
+            logger.error('Некорректные параметры ссылки: expires_in=%s, max_downloads=%s',
+                         request.data.get("expires_in"), request.data.get("max_downloads"))
+            return Response({"detail": "Некорректные параметры ссылки."}, status=status.HTTP_400_BAD_REQUEST)
+        if expires_in <= 0 or (max_downloads is not None and max_downloads <= 0):
+            return Response({"detail": "Некорректные параметры ссылки."}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Сохраняем токен
-        storage_item.token = unique_token
-        storage_item.token_expiration = timezone.now() + timezone.timedelta(minutes=5)
-        storage_item.save()
+        # Генерируем уникальный токен и сохраняем ссылку (у файла может быть несколько ссылок)
+        share_link = ShareLink.objects.create(
+            storage=storage_item,
+            token=get_random_string(length=32),
+            expiration=timezone.now() + timezone.timedelta(minutes=expires_in),
+            max_downloads=max_downloads,
+        )
 
         # Формируем ссылку
-        link = request.build_absolute_uri(f"/api/storage/download/{unique_token}/")
-        logger.info('Ссылка сгенерирована: %s', link)
+        link = request.build_absolute_uri(f"/api/storage/download/{share_link.token}/")
+        logger.info('Ссылка сгенерирована: id_file=%s, id_link=%s', id_file, share_link.pk)
+
+        data = ShareLinkSerializer(share_link).data
+        data["link"] = link
+        return Response(data, status=status.HTTP_200_OK)
+
+    # Дополнительный метод к GET-запросу: список действующих ссылок на файл
+    def list_file_links(self, request, id_user, id_file):
+        logger.info('Список ссылок для файла: id_user=%s, id_file=%s', id_user, id_file)
+        # Ссылки файла видят только его владелец (id_user из адреса) и администратор
+        self.permission_classes = [IsOwnerOrAdmin]
+        self.check_permissions(request)
+        links = ShareLink.objects.filter(storage__id_user=id_user, storage_id=id_file, revoked=False).order_by('-created_date')
+        return Response(ShareLinkSerializer(links, many=True).data, status=status.HTTP_200_OK)
+
+    # Дополнительный метод к DELETE-запросу: отзыв ссылок на файл (всех или одной по ?token=)
+    def revoke_file_links(self, request, id_user, id_file):
+        logger.info('Отзыв ссылок для файла: id_user=%s, id_file=%s', id_user, id_file)
+        self.permission_classes = [IsOwnerOrAdmin]
+        self.check_permissions(request)
+        links = ShareLink.objects.filter(storage__id_user=id_user, storage_id=id_file, revoked=False)
+        if request.query_params.get('token'):
+            links = links.filter(token=request.query_params['token'])
+        count = links.update(revoked=True)
+        logger.info('Отозвано ссылок: %s', count)
+        return Response({"revoked": count}, status=status.HTTP_200_OK)
 
-        return Response({"link": link}, status=status.HTTP_200_OK)
-    
     # Дополнительный метод к POST-запросу post: загрузка нового файла
     def upload_file(self, request, id_user):
         logger.info('Загрузка файла: id_user=%s', id_user)
-        file = request.data["file"]
-        comment = request.data["comment"]
-        
         try:
-            user = User.objects.get(id_user=id_user)
+            # Пользователь уже получен при аутентификации, если загружает в своё хранилище
+            user = request.user if request.user.id_user == id_user else User.objects.get(id_user=id_user)
         except User.DoesNotExist:
             logger.error('Пользователь не найден: id_user=%s', id_user)
-            return Response({"detail": "Пользователь не найден"}, status=status.HTTP_404_NOT_FOUND)
-
-        # Сохраняем файл и информацию о файле в базе данных
-        storage_file = Storage(
-            id_user=user,
-            original_name=file.name,
-            comment=comment,
-            size=file.size,
-            file=file
-        )
-        storage_file.save()
+            return Response({"detail": "Пользователь не найден"}, status=status.HTTP_404_NOT_FOUND)
+
+        # Квоту проверяем по Content-Length до разбора тела запроса (request.data),
+        # чтобы не принимать заведомо не помещающийся файл
+        content_length = get_content_length(request)
+        if not User.objects.has_space(user.pk, content_length - MULTIPART_OVERHEAD):
+            logger.warning('Загрузка отклонена по квоте: id_user=%s, Content-Length=%s', id_user, content_length)
+            return quota_exceeded_response()
 
-        if file.name.replace(' ', '_') != storage_file.file.name.split('/')[-1]:
-            new_name = storage_file.file.name.split('/')[-1]  # Получаем имя файла без пути
-            logger.warning("Файл %s уже существует. Изменяем его на %s", file.name, new_name)
-            storage_file.new_name = new_name
-            storage_file.save()
+        file = request.data["file"]
+        comment = request.data["comment"]
+        try:
+            self.save_uploaded_file(user, file, comment)
+        except QuotaExceeded:
+            logger.warning('Файл %s не помещается в квоту: id_user=%s, size=%s', file.name, id_user, file.size)
+            return quota_exceeded_response()
         logger.info('Файл %s загружен успешно', file.name)
         return self.get(request, id_user)
+
+    # Дополнительный метод к upload_file: сохранение загруженного файла и записи о нём
+    def save_uploaded_file(self, user, file, comment):
+        # Одинаковое содержимое хранится на диске один раз: ищем его по хешу, посчитанному при загрузке
+        sha256 = get_file_sha256(file)
+        # Тип содержимого определён обработчиком загрузки по первому блоку, кодировка - по началу файла
+        content_type, charset = get_content_metadata(
+            file.name, read_uploaded_head(file), getattr(file, 'sniffed_content_type', None),
+        )
+        # Содержимое записывается в хранилище до транзакции: загрузка большого файла в объектное хранилище
+        # не держит блокировку строки пользователя, которую берёт reserve_space
+        with timing('storage'):
+            if isinstance(file, StagingUploadedFile):
+                # Файл уже записан на диск хранилища обработчиком загрузки - переносим его без копирования
+                blob = Blob.objects.acquire(sha256, file.size, path=file.temporary_file_path())
+            else:
+                blob = Blob.objects.acquire(sha256, file.size, content=file)
+        try:
+            with transaction.atomic():
+                # Резервирование места в квоте (QuotaExceeded, если его нет) и запись о файле - одна короткая транзакция
+                User.objects.reserve_space(user.pk, file.size)
+                storage_file = Storage.objects.create(
+                    id_user=user,
+                    original_name=file.name,
+                    comment=comment,
+                    size=file.size,
+                    file=blob.file.name,
+                    blob=blob,
+                    content_type=content_type,
+                    sha256=sha256,
+                    charset=charset,
+                )
+                transaction.on_commit(lambda: schedule_previews(blob, content_type))
+        except Exception:
+            # Запись о файле не создана: освобождаем ссылку, содержимое без ссылок удаляется из хранилища
+            Blob.release(blob.pk)
+            raise
+        if blob.refcount > 1:
+            logger.info('Файл %s совпадает с уже загруженным содержимым %s', file.name, sha256)
+        return storage_file
     
     # Метод для обработки PATCH-запроса: переименование файла
     def patch(self, request, id_user, id_file):
         logger.info('PATCH запрос для переименования файла: id_user=%s, id_file=%s', id_user, id_file)
         new_name = request.data["name"]
-        # Проверяем, существует ли файл с таким именем
-        if os.path.exists(os.path.join(settings.MEDIA_ROOT, "uploads", new_name)):
-            logger.error('Файл с таким именем уже существует: %s', new_name)
-            return Response({"detail": "Файл с таким именем уже существует"}, status=status.HTTP_400_BAD_REQUEST)        
         try:
             file_to_rename = Storage.objects.get(id_file=id_file)
-            old_file_path = file_to_rename.file.path
-            new_file_path = os.path.join(os.path.dirname(old_file_path), new_name.replace(" ", "_"))
-            os.rename(old_file_path, new_file_path)
+            # Имя файла на диске не зависит от original_name, поэтому переименование меняет только запись в базе
             file_to_rename.original_name = new_name
-            file_to_rename.file.name = os.path.join('uploads', new_name.replace(" ", "_"))
             file_to_rename.new_name = None
-            file_to_rename.save()
-            serializer = StorageSerializer(file_to_rename)
-
+            with transaction.atomic():
+                file_to_rename.save(update_fields=['original_name', 'new_name'])
+                User.objects.bump_storage_version([file_to_rename.id_user_id])
             logger.info('Файл переименован: %s', new_name)
-            return Response(serializer.data, status=status.HTTP_200_OK)
+            return Response(StorageSerializer(file_to_rename).data, status=status.HTTP_200_OK)
         except Storage.DoesNotExist:
             logger.error('Файл с указанным id_file=%s не существует в базе данных', id_file)
             return Response({"detail": f"Файл с указанным id_file = {id_file} не существует в базе данных"}, status=status.HTTP_404_NOT_FOUND)
-        except FileNotFoundError:
-            logger.error('Файл для переименования не найден на файловой системе: id_file=%s', id_file)
-            return Response({"detail": "Файл для переименования не найден на файловой системе"}, status=status.HTTP_404_NOT_FOUND)
         except Exception as e:
             logger.exception('Ошибка при переименовании файла: %s', str(e))
             return Response({"detail": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -408,9 +737,13 @@ class StorageView(APIView):
     # Метод для обработки DELETE-запроса: удаление файла по ID
     def delete(self, request, id_user, id_file): 
         logger.info('DELETE запрос для файла: id_user=%s, id_file=%s', id_user, id_file)       
+        if request.resolver_match.url_name == 'generate_file_link':
+            # отзыв ссылок на файл
+            return self.revoke_file_links(request, id_user, id_file)
         try:
             file = Storage.objects.get(id_user=id_user, id_file=id_file)
-            file.delete()
+            # Файл помечается удалённым, с диска его удаляет фоновая очистка
+            Storage.objects.filter(pk=file.pk).soft_delete()
             logger.info('Файл с id_file=%s был успешно удалён', id_file)
             return Response(status=status.HTTP_204_NO_CONTENT)
         except Storage.DoesNotExist:
@@ -419,3 +752,353 @@ class StorageView(APIView):
         except Exception as e:
             logger.exception('Ошибка при удалении файла: %s', str(e))
             return Response({"detail": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class StorageBulkView(APIView):
+    """
+    Групповые операции над файлами пользователя:
+    POST storage/bulk/<id_user>/delete/ {"ids": [1, 2, 3]} - удаление нескольких файлов одним запросом
+    (файлы помечаются удалёнными, с диска их удаляет фоновая очистка)
+    GET storage/bulk/<id_user>/zip/?ids=1,2,3 - скачивание выбранных файлов одним ZIP-архивом
+    """
+    permission_classes = [IsOwnerOrAdmin]
+
+    # Дополнительный метод: список id файлов из запроса (JSON-список или строка "1,2,3")
+    def get_ids(self, value):
+        if isinstance(value, str):
+            value = [item for item in value.split(',') if item.strip()]
+        if not isinstance(value, list) or not value:
+            raise ValueError('Требуется непустой список id файлов.')
+        ids = list(dict.fromkeys(int(item) for item in value))
+        if len(ids) > settings.BULK_MAX_FILES:
+            raise ValueError(f'За один запрос можно обработать не более {settings.BULK_MAX_FILES} файлов.')
+        return ids
+
+    # Метод для обработки POST-запроса: удаление нескольких файлов
+    def post(self, request, id_user):
+        logger.info('Групповое удаление файлов: id_user=%s', id_user)
+        try:
+            ids = self.get_ids(request.data.get('ids'))
+        except (TypeError, ValueError) as e:
+            logger.warning('Некорректный список файлов для удаления: %s', e)
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        deleted = Storage.objects.filter(id_user=id_user, id_file__in=ids).soft_delete()
+        deleted_set = set(deleted)
+        not_found = [id_file for id_file in ids if id_file not in deleted_set]
+        logger.info('Удалено файлов: %s, не найдено: %s', len(deleted), len(not_found))
+        return Response({"deleted": sorted(deleted), "not_found": not_found}, status=status.HTTP_200_OK)
+
+    # Метод для обработки GET-запроса: скачивание нескольких файлов ZIP-архивом
+    def get(self, request, id_user):
+        logger.info('Скачивание файлов архивом: id_user=%s', id_user)
+        try:
+            ids = self.get_ids(request.query_params.get('ids'))
+        except (TypeError, ValueError) as e:
+            logger.warning('Некорректный список файлов для архива: %s', e)
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        files = {file.id_file: file for file in Storage.objects.filter(id_user=id_user, id_file__in=ids)}
+        not_found = [id_file for id_file in ids if id_file not in files]
+        if not_found:
+            logger.warning('Файлы для архива не найдены: %s', not_found)
+            return Response({"detail": "Файлы не найдены.", "not_found": not_found}, status=status.HTTP_404_NOT_FOUND)
+
+        # Одинаковые имена в архиве различаем суффиксом: "name (1).txt"
+        entries = []
+        used_names = set()
+        for id_file in ids:
+            file = files[id_file]
+            arcname = file.original_name
+            stem, ext = os.path.splitext(arcname)
+            number = 1
+            while arcname in used_names:
+                arcname = f'{stem} ({number}){ext}'
+                number += 1
+            used_names.add(arcname)
+            entries.append((arcname, file.file.name, file.size, timezone.localtime(file.upload_date)))
+
+        for file in files.values():
+            download_tracker.record(file)
+
+        response = StreamingHttpResponse(zip_iterator(entries), content_type='application/zip')
+        file_name = f'files_{timezone.now():%Y%m%d_%H%M%S}.zip'
+        response['Content-Disposition'] = f'attachment; filename="{file_name}"'
+        response['X-Filename'] = file_name
+        return response
+
+
+class UploadSessionView(APIView):
+    """
+    Поблочная (возобновляемая) загрузка файла:
+    1. POST storage/uploads/<id_user>/ {"name", "size", "comment"} - создание сессии
+    2. PUT storage/uploads/<id_user>/<id_session>/ с заголовком Content-Range: bytes start-end/size
+       (или параметром ?offset=start) и телом-блоком - запись блока, можно повторять и докачивать
+    3. GET storage/uploads/<id_user>/<id_session>/ - какие диапазоны уже получены
+    4. POST storage/uploads/<id_user>/<id_session>/ - завершение загрузки и создание записи Storage
+    DELETE storage/uploads/<id_user>/<id_session>/ - отмена загрузки
+    Для объектного хранилища возможна прямая загрузка, минуя Django: при создании сессии
+    {"name", "size", "sha256", "direct": true} в ответе приходят upload_url и upload_headers,
+    клиент загружает файл PUT-запросом по этой ссылке и затем завершает сессию (шаг 4)
+    """
+    permission_classes = [IsOwnerOrAdmin]
+
+    # Дополнительный метод: получение сессии загрузки пользователя
+    def get_session(self, id_user, id_session, for_update=False):
+        queryset = UploadSession.objects.all()
+        if for_update:
+            queryset = queryset.select_for_update()
+        return queryset.get(id_session=id_session, id_user=id_user)
+
+    # Дополнительный метод: ответ с состоянием сессии
+    def session_response(self, session, status_code=status.HTTP_200_OK, **extra):
+        data = UploadSessionSerializer(session).data
+        data["chunk_size"] = settings.UPLOAD_CHUNK_SIZE
+        data.update(extra)
+        return Response(data, status=status_code)
+
+    # Метод для обработки GET-запроса: состояние сессии загрузки
+    def get(self, request, id_user, id_session):
+        logger.info('GET запрос состояния загрузки: id_user=%s, id_session=%s', id_user, id_session)
+        try:
+            return self.session_response(self.get_session(id_user, id_session))
+        except UploadSession.DoesNotExist:
+            logger.warning('Сессия загрузки не найдена: id_session=%s', id_session)
+            return Response({"detail": "Сессия загрузки не найдена."}, status=status.HTTP_404_NOT_FOUND)
+
+    # Метод для обработки POST-запроса: создание сессии или завершение загрузки
+    def post(self, request, id_user, id_session=None):
+        if id_session:
+            return self.complete_upload(request, id_user, id_session)
+        return self.create_session(request, id_user)
+
+    # Дополнительный метод к POST-запросу post: создание сессии загрузки
+    def create_session(self, request, id_user):
+        logger.info('Создание сессии загрузки: id_user=%s', id_user)
+        try:
+            user = request.user if request.user.id_user == id_user else User.objects.get(id_user=id_user)
+        except User.DoesNotExist:
+            logger.error('Пользователь не найден: id_user=%s', id_user)
+            return Response({"detail": "Пользователь не найден"}, status=status.HTTP_404_NOT_FOUND)
+
+        direct = str(request.data.get("direct", "")).lower() in ("1", "true")
+        if direct and not supports_presigned_urls():
+            logger.warning('Прямая загрузка недоступна для текущего хранилища')
+            return Response({"detail": "Прямая загрузка в хранилище не поддерживается."}, status=status.HTTP_400_BAD_REQUEST)
+        if direct and not request.data.get("sha256"):
+            return Response({"sha256": ["Для прямой загрузки требуется SHA-256 файла."]}, status=status.HTTP_400_BAD_REQUEST)
+
+        serializer = UploadSessionSerializer(data={
+            "original_name": request.data.get("name"),
+            "size": request.data.get("size"),
+            "comment": request.data.get("comment", ""),
+            "sha256": request.data.get("sha256", "") if direct else "",
+        })
+        if not serializer.is_valid():
+            logger.warning('Невалидные данные сессии загрузки: %s', serializer.errors)
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        # Размер файла известен заранее - не начинаем загрузку, которая не поместится в квоту
+        if not User.objects.has_space(user.pk, serializer.validated_data["size"]):
+            logger.warning('Сессия загрузки отклонена по квоте: id_user=%s, size=%s', id_user, serializer.validated_data["size"])
+            return quota_exceeded_response()
+
+        session = serializer.save(id_user=user)
+        if session.is_direct:
+            # Файл загружается клиентом напрямую в хранилище, хранилище само проверяет его SHA-256
+            upload_url, upload_headers = get_presigned_upload(session.direct_name, session.size, session.sha256)
+            logger.info('Сессия прямой загрузки создана: id_session=%s, size=%s', session.id_session, session.size)
+            return self.session_response(
+                session, status.HTTP_201_CREATED, upload_url=upload_url, upload_headers=upload_headers,
+            )
+
+        os.makedirs(os.path.dirname(session.staging_path), exist_ok=True)
+        # Создаём временный файл нужного размера, блоки будут записываться в него по смещениям
+        with open(session.staging_path, 'wb') as staging_file:
+            staging_file.truncate(session.size)
+        logger.info('Сессия загрузки создана: id_session=%s, size=%s', session.id_session, session.size)
+        return self.session_response(session, status.HTTP_201_CREATED)
+
+    # Дополнительный метод к PUT-запросу: смещение блока из Content-Range или ?offset=
+    def get_chunk_offset(self, request, session):
+        content_range = request.headers.get('Content-Range')
+        if content_range:
+            units, _, spec = content_range.partition(' ')
+            byte_range, _, total = spec.partition('/')
+            start, _, _ = byte_range.partition('-')
+            if units != 'bytes' or not start.isdigit() or (total not in ('*', '') and total != str(session.size)):
+                raise ValueError(content_range)
+            return int(start)
+        return int(request.query_params.get('offset', 0))
+
+    # Метод для обработки PUT-запроса: запись блока файла
+    def put(self, request, id_user, id_session):
+        try:
+            session = self.get_session(id_user, id_session)
+        except UploadSession.DoesNotExist:
+            logger.warning('Сессия загрузки не найдена: id_session=%s', id_session)
+            return Response({"detail": "Сессия загрузки не найдена."}, status=status.HTTP_404_NOT_FOUND)
+        if session.is_direct:
+            return Response({"detail": "Файл загружается напрямую в хранилище по upload_url."}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            offset = self.get_chunk_offset(request, session)
+            length = int(request.headers.get('Content-Length') or 0)
+        except ValueError:
+            logger.warning('Некорректное смещение блока: id_session=%s', id_session)
+            return Response({"detail": "Некорректный Content-Range или offset."}, status=status.HTTP_400_BAD_REQUEST)
+
+        if offset < 0 or offset + length > session.size:
+            logger.warning('Блок выходит за границы файла: id_session=%s, offset=%s, length=%s', id_session, offset, length)
+            return Response({"detail": "Блок выходит за границы файла."}, status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+
+        logger.debug('Запись блока: id_session=%s, offset=%s, length=%s', id_session, offset, length)
+        # Тело запроса читаем из потока частями и сразу пишем во временный файл по смещению
+        written = 0
+        stream = request.stream
+        with open(session.staging_path, 'r+b') as staging_file:
+            staging_file.seek(offset)
+            while stream is not None and written < length:
+                chunk = stream.read(min(get_chunk_size(), length - written))
+                if not chunk:
+                    break
+                staging_file.write(chunk)
+                written += len(chunk)
+
+        # Если соединение оборвалось, засчитываем только реально записанную часть блока
+        with transaction.atomic():
+            session = self.get_session(id_user, id_session, for_update=True)
+            if written:
+                session.add_range(offset, offset + written)
+                session.save(update_fields=['received_ranges', 'updated_date'])
+        return self.session_response(session)
+
+    # Дополнительный метод к POST-запросу post: завершение загрузки
+    def complete_upload(self, request, id_user, id_session):
+        logger.info('Завершение загрузки: id_user=%s, id_session=%s', id_user, id_session)
+        try:
+            session = self.get_session(id_user, id_session)
+        except UploadSession.DoesNotExist:
+            logger.warning('Сессия загрузки не найдена: id_session=%s', id_session)
+            return Response({"detail": "Сессия загрузки не найдена."}, status=status.HTTP_404_NOT_FOUND)
+
+        if session.is_direct:
+            return self.complete_direct_upload(session)
+
+        if not session.is_complete:
+            logger.warning('Файл получен не полностью: id_session=%s, получено %s из %s', id_session, session.received_size, session.size)
+            return Response(
+                {"detail": "Файл получен не полностью.", "received_ranges": session.received_ranges},
+                status=status.HTTP_409_CONFLICT,
+            )
+        if not User.objects.has_space(id_user, session.size):
+            logger.warning('Файл не помещается в квоту: id_session=%s, size=%s', id_session, session.size)
+            return quota_exceeded_response()
+
+        try:
+            # Блоки могли прийти в любом порядке, поэтому хеш считаем по собранному файлу
+            sha256 = get_file_sha256(session.staging_path)
+            with open(session.staging_path, 'rb') as staging_file:
+                content_type, charset = get_content_metadata(session.original_name, staging_file.read(HEAD_SIZE))
+            # Временный файл переносится в хранилище жёсткой ссылкой, без копирования
+            with timing('storage'):
+                blob = Blob.objects.acquire(sha256, session.size, path=session.staging_path)
+        except FileNotFoundError:
+            # Временный файл удалён: сессию параллельно завершили или отменили
+            logger.warning('Временный файл загрузки не найден: id_session=%s', id_session)
+            return Response({"detail": "Сессия загрузки не найдена."}, status=status.HTTP_404_NOT_FOUND)
+        return self.save_session_file(session, blob, sha256, content_type, charset, 'поблочно')
+
+    # Дополнительный метод к complete_upload: завершение прямой загрузки в объектное хранилище
+    def complete_direct_upload(self, session):
+        info = get_stored_object_info(session.direct_name)
+        if info is None:
+            logger.warning('Файл ещё не загружен в хранилище: id_session=%s', session.id_session)
+            return Response({"detail": "Файл ещё не загружен в хранилище."}, status=status.HTTP_409_CONFLICT)
+
+        size, checksum = info
+        if checksum is None:
+            # Хранилище не сохранило контрольную сумму - проверяем хеш, прочитав объект
+            logger.warning('Хранилище не вернуло SHA-256, хеш считается чтением файла: id_session=%s', session.id_session)
+            valid = get_stored_file_sha256(session.direct_name) == session.sha256
+        else:
+            valid = checksum == sha256_to_checksum(session.sha256)
+        if size != session.size or not valid:
+            logger.warning('Загруженный файл не совпадает с заявленным: id_session=%s', session.id_session)
+            session.delete()
+            return Response({"detail": "Размер или SHA-256 загруженного файла не совпадают с заявленными."}, status=status.HTTP_400_BAD_REQUEST)
+        if not User.objects.has_space(session.id_user_id, session.size):
+            logger.warning('Файл не помещается в квоту: id_session=%s, size=%s', session.id_session, session.size)
+            return quota_exceeded_response()
+
+        # Содержимое копируется в хранилище по хешу на стороне хранилища, временный объект удаляется
+        blob = Blob.objects.acquire(session.sha256, session.size, stored_name=session.direct_name)
+        # Начало файла читается ранжированным запросом к хранилищу, без загрузки объекта целиком
+        content_type, charset = get_content_metadata(session.original_name, read_head(blob.file.name, HEAD_SIZE, session.size))
+        return self.save_session_file(session, blob, session.sha256, content_type, charset, 'напрямую в хранилище')
+
+    # Дополнительный метод к complete_upload: запись о файле из завершённой загрузки
+    def save_session_file(self, session, blob, sha256, content_type, charset, method):
+        """
+        Содержимое уже записано в хранилище (Blob.objects.acquire вне транзакции), поэтому транзакция
+        короткая: резервирование места в квоте, запись о файле и удаление сессии.
+        Если сессию параллельно завершили или отменили или файл не помещается в квоту,
+        ссылка на содержимое освобождается
+        """
+        try:
+            with transaction.atomic():
+                session = self.get_session(session.id_user_id, session.id_session, for_update=True)
+                User.objects.reserve_space(session.id_user_id, session.size)
+                storage_file = Storage.objects.create(
+                    id_user_id=session.id_user_id,
+                    original_name=session.original_name,
+                    comment=session.comment,
+                    size=session.size,
+                    file=blob.file.name,
+                    blob=blob,
+                    content_type=content_type,
+                    sha256=sha256,
+                    charset=charset,
+                )
+                session.delete()
+                transaction.on_commit(lambda: schedule_previews(blob, content_type))
+        except UploadSession.DoesNotExist:
+            Blob.release(blob.pk)
+            logger.warning('Сессия загрузки завершена или отменена параллельно: id_session=%s', session.id_session)
+            return Response({"detail": "Сессия загрузки не найдена."}, status=status.HTTP_404_NOT_FOUND)
+        except QuotaExceeded:
+            Blob.release(blob.pk)
+            logger.warning('Файл не помещается в квоту: id_session=%s, size=%s', session.id_session, session.size)
+            return quota_exceeded_response()
+        except Exception:
+            Blob.release(blob.pk)
+            raise
+
+        logger.info('Файл %s загружен %s', session.original_name, method)
+        return Response(StorageSerializer(storage_file).data, status=status.HTTP_201_CREATED)
+
+    # Метод для обработки DELETE-запроса: отмена загрузки
+    def delete(self, request, id_user, id_session):
+        logger.info('Отмена загрузки: id_user=%s, id_session=%s', id_user, id_session)
+        try:
+            self.get_session(id_user, id_session).delete()
+        except UploadSession.DoesNotExist:
+            logger.warning('Сессия загрузки не найдена: id_session=%s', id_session)
+            return Response({"detail": "Сессия загрузки не найдена."}, status=status.HTTP_404_NOT_FOUND)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class MetricsView(View):
+    """
+    Метрики приложения в формате Prometheus (см. api_app.metrics).
+    Доступ только с заголовком Authorization: Bearer <METRICS_TOKEN>; если токен не задан
+    или пакет prometheus_client не установлен, адрес недоступен
+    """
+    # Метод для обработки GET-запроса: выдача метрик
+    def get(self, request):
+        if not settings.METRICS_TOKEN or not metrics_enabled():
+            raise Http404("Метрики отключены")
+        if not constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {settings.METRICS_TOKEN}'):
+            logger.warning('Запрос метрик без действительного токена')
+            return HttpResponse(status=401)
+        body, content_type = export_metrics()
+        return HttpResponse(body, content_type=content_type)
@@ -12,7 +12,8 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 
 import os
 from pathlib import Path
-from decouple import config
+from decouple import Csv, config
+from django.core.exceptions import ImproperlyConfigured
 
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -20,6 +21,177 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Хранилище файлов пользователей:
+# local - локальный диск сервера, каталог MEDIA_ROOT (по умолчанию),
+# s3 - S3-совместимое объектное хранилище (AWS S3, MinIO и т.п.), нужны пакеты django-storages и boto3
+FILE_STORAGE_BACKEND = config('FILE_STORAGE_BACKEND', default='local')
+if FILE_STORAGE_BACKEND == 's3':
+    STORAGES = {
+        "default": {
+            "BACKEND": "storages.backends.s3.S3Storage",
+            "OPTIONS": {
+                "bucket_name": config('S3_BUCKET_NAME'),
+                "endpoint_url": config('S3_ENDPOINT_URL', default=None),
+                "access_key": config('S3_ACCESS_KEY', default=None),
+                "secret_key": config('S3_SECRET_KEY', default=None),
+                "region_name": config('S3_REGION_NAME', default=None),
+                "location": config('S3_LOCATION', default=''),
+                "default_acl": None,
+                "querystring_auth": True,
+                # Имена файлов в хранилище уникальны (хеш содержимого), проверка существования не нужна
+                "file_overwrite": True,
+            },
+        },
+        "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+    }
+# Время жизни (в секундах) подписанных ссылок на скачивание и прямую загрузку в объектное хранилище
+FILE_PRESIGNED_URL_TTL = config('FILE_PRESIGNED_URL_TTL', default=300, cast=int)
+
+# Способ отдачи файлов пользователям:
+# python - файл читается и стримится самим Django (по умолчанию),
+# x-accel-redirect - передача файла отдаётся nginx через заголовок X-Accel-Redirect,
+# x-sendfile - передача файла отдаётся веб-серверу через заголовок X-Sendfile (Apache mod_xsendfile, lighttpd),
+# presigned - перенаправление на подписанную ссылку объектного хранилища (только для FILE_STORAGE_BACKEND=s3)
+FILE_DELIVERY_BACKEND = config('FILE_DELIVERY_BACKEND', default='python')
+# Внутренний (internal) location nginx, указывающий на MEDIA_ROOT
+FILE_DELIVERY_ACCEL_PREFIX = config('FILE_DELIVERY_ACCEL_PREFIX', default='/protected-media/')
+# Размер блока (в байтах) при чтении файлов в python-режиме, когда сервер не поддерживает sendfile
+FILE_CHUNK_SIZE = config('FILE_CHUNK_SIZE', default=1024 * 1024, cast=int)
+# Читать файлы через mmap вместо read() (только для диапазонов multipart/byteranges)
+FILE_ITERATOR_MMAP = config('FILE_ITERATOR_MMAP', default=False, cast=bool)
+# Размер предпросмотра текстовых файлов (?preview=1) по умолчанию, в килобайтах
+FILE_PREVIEW_KB = config('FILE_PREVIEW_KB', default=64, cast=int)
+# Рекомендуемый размер блока для поблочной загрузки файлов, в байтах
+UPLOAD_CHUNK_SIZE = config('UPLOAD_CHUNK_SIZE', default=8 * 1024 * 1024, cast=int)
+# Квота новых пользователей на суммарный размер файлов (байт), 0 - без ограничения.
+# Квоту отдельного пользователя меняет администратор (PATCH users/<id_user>/ {"quota_bytes"})
+USER_QUOTA_BYTES = config('USER_QUOTA_BYTES', default=0, cast=int)
+# Максимальное количество файлов в одном групповом запросе (удаление, скачивание архивом)
+BULK_MAX_FILES = config('BULK_MAX_FILES', default=1000, cast=int)
+# Интервал (в секундах) пакетной записи в базу даты последнего скачивания и счётчика скачиваний.
+# 0 - запись при каждом скачивании
+DOWNLOAD_STATS_FLUSH_INTERVAL = config('DOWNLOAD_STATS_FLUSH_INTERVAL', default=5, cast=int)
+
+# Срок действия специальной ссылки на файл по умолчанию, в минутах
+SHARE_LINK_TTL_MINUTES = config('SHARE_LINK_TTL_MINUTES', default=5, cast=int)
+
+# Интервал (в секундах) фоновой очистки истекших токенов ссылок в процессе приложения.
+# 0 - отключено, очистка выполняется командой `python manage.py clean_expired_tokens` (например, из cron)
+TOKEN_SWEEP_INTERVAL = config('TOKEN_SWEEP_INTERVAL', default=0, cast=int)
+
+# Удалённые файлы сначала только помечаются, записи и файлы на диске удаляет
+# команда `python manage.py reap_deleted_files` (например, из cron).
+# Интервал (в секундах) очистки в процессе приложения, 0 - отключено (по умолчанию): включать только
+# в одном процессе, иначе очистку одновременно выполняет каждый воркер gunicorn
+FILE_REAP_INTERVAL = config('FILE_REAP_INTERVAL', default=0, cast=int)
+# Количество файлов, удаляемых за одну транзакцию
+FILE_REAP_BATCH_SIZE = config('FILE_REAP_BATCH_SIZE', default=500, cast=int)
+
+# Кодировка текстовых файлов, которые не являются корректным UTF-8 (определяется при загрузке)
+FILE_TEXT_FALLBACK_ENCODING = config('FILE_TEXT_FALLBACK_ENCODING', default='cp1251')
+# Время (секунд), в течение которого браузер использует закэшированный файл без проверки.
+# 0 - каждый раз проверять условным запросом (ответ 304 без содержимого, если файл не изменился)
+FILE_CACHE_MAX_AGE = config('FILE_CACHE_MAX_AGE', default=0, cast=int)
+
+# Эскизы изображений и первой страницы PDF для предпросмотра (GET storage/preview/<id_user>/<id_file>/?size=).
+# Для изображений нужен пакет Pillow, для PDF - утилита pdftoppm (пакет poppler-utils)
+# Размеры эскизов (длинная сторона в пикселях) через запятую, пусто - предпросмотр отключён
+try:
+    PREVIEW_SIZES = sorted(config('PREVIEW_SIZES', default='256,1024', cast=Csv(cast=int)))
+    if any(size <= 0 for size in PREVIEW_SIZES):
+        raise ValueError(PREVIEW_SIZES)
+except ValueError:
+    raise ImproperlyConfigured('PREVIEW_SIZES: ожидаются положительные целые числа через запятую')
+# Создавать эскизы в фоне сразу после загрузки файла (иначе - при первом запросе)
+PREVIEW_ON_UPLOAD = config('PREVIEW_ON_UPLOAD', default=True, cast=bool)
+# Количество потоков, создающих эскизы, в каждом процессе приложения
+PREVIEW_WORKERS = config('PREVIEW_WORKERS', default=2, cast=int)
+# Качество JPEG эскизов
+PREVIEW_QUALITY = config('PREVIEW_QUALITY', default=80, cast=int)
+# Файлы больше этого размера (байт) не обрабатываются
+PREVIEW_MAX_SOURCE_SIZE = config('PREVIEW_MAX_SOURCE_SIZE', default=100 * 1024 * 1024, cast=int)
+# Максимальное время создания эскиза (секунд)
+PREVIEW_TIMEOUT = config('PREVIEW_TIMEOUT', default=30, cast=int)
+# Сколько секунд запрос эскиза ждёт его создания. Не готовый за это время эскиз досоздаётся в фоне,
+# а клиент получает ответ 202 с Retry-After: долгое создание эскизов не занимает воркеры приложения
+PREVIEW_REQUEST_WAIT = config('PREVIEW_REQUEST_WAIT', default=1.0, cast=float)
+PREVIEW_PDFTOPPM = config('PREVIEW_PDFTOPPM', default='pdftoppm')
+# Время кэширования эскиза браузером (секунд): содержимое файла не меняется, поэтому эскиз можно кэшировать надолго
+PREVIEW_CACHE_MAX_AGE = config('PREVIEW_CACHE_MAX_AGE', default=365 * 24 * 3600, cast=int)
+
+# Метрики в формате Prometheus (адрес api/metrics/, нужен пакет prometheus-client).
+# Адрес доступен только с заголовком Authorization: Bearer <METRICS_TOKEN>, пустой токен - адрес отключён
+METRICS_ENABLED = config('METRICS_ENABLED', default=True, cast=bool)
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
+# Добавлять в ответы заголовок Server-Timing (время обработки, запросы к базе, запись в хранилище)
+METRICS_SERVER_TIMING = config('METRICS_SERVER_TIMING', default=False, cast=bool)
+
+# Логирование (см. api_app/log.py): запись в фоновом потоке в stderr или в файл LOG_FILE,
+# формат text или json (одна запись - одна строка JSON с маршрутом запроса)
+LOG_LEVEL = config('LOG_LEVEL', default='INFO')
+LOG_FORMAT = config('LOG_FORMAT', default='text')
+LOG_FILE = config('LOG_FILE', default='')
+LOG_QUEUE_SIZE = config('LOG_QUEUE_SIZE', default=10000, cast=int)
+# Доля запросов, информационные записи которых попадают в лог (предупреждения и ошибки пишутся всегда)
+LOG_SAMPLE_RATE = config('LOG_SAMPLE_RATE', default=1.0, cast=float)
+
+
+def route_map(name, cast=str):
+    # Разбор настройки вида маршрут:значение,маршрут:значение в словарь
+    result = {}
+    for item in config(name, default='', cast=Csv()):
+        route, separator, value = (part.strip() for part in item.partition(':'))
+        try:
+            if not separator or not route or not value:
+                raise ValueError(item)
+            result[route] = cast(value)
+        except ValueError:
+            raise ImproperlyConfigured(f'{name}: ожидается список маршрут:значение через запятую, получено "{item}"')
+    return result
+
+
+# Уровень и доля записей по имени маршрута, например: file_download:WARNING,upload_session:WARNING
+LOG_ROUTE_LEVELS = route_map('LOG_ROUTE_LEVELS')
+LOG_ROUTE_SAMPLE_RATES = route_map('LOG_ROUTE_SAMPLE_RATES', cast=float)
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'text': {'format': '%(asctime)s - %(levelname)s - %(message)s'},
+        'json': {'()': 'api_app.log.JsonFormatter'},
+    },
+    'filters': {
+        'route': {
+            '()': 'api_app.log.RouteFilter',
+            'sample_rate': LOG_SAMPLE_RATE,
+            'route_levels': LOG_ROUTE_LEVELS,
+            'route_sample_rates': LOG_ROUTE_SAMPLE_RATES,
+        },
+    },
+    'handlers': {
+        'background': {
+            'class': 'api_app.log.BackgroundHandler',
+            'filename': LOG_FILE,
+            'queue_size': LOG_QUEUE_SIZE,
+            'formatter': LOG_FORMAT,
+            'filters': ['route'],
+        },
+    },
+    'loggers': {
+        'api_app': {'handlers': ['background'], 'level': LOG_LEVEL, 'propagate': False},
+        'django': {'handlers': ['background'], 'level': 'INFO', 'propagate': False},
+    },
+    'root': {'handlers': ['background'], 'level': 'WARNING'},
+}
+
+# Обработчики загрузки считают SHA-256 файла на лету для дедупликации содержимого и определяют его тип.
+# Большие файлы пишутся сразу в MEDIA_ROOT/uploads_staging и переносятся в хранилище жёсткой ссылкой
+FILE_UPLOAD_HANDLERS = [
+    'api_app.upload_handlers.HashingMemoryFileUploadHandler',
+    'api_app.upload_handlers.HashingStagingFileUploadHandler',
+]
+
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/5.1/howto/deployment/checklist/
 
@@ -54,6 +226,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Первым, чтобы замер включал время остальных middleware
+    'api_app.middleware.MetricsMiddleware',
+    'api_app.middleware.LogContextMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -69,12 +244,20 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.AllowAny',
     ],
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.TokenAuthentication',
+        'api_app.authentication.CachedTokenAuthentication',
         'rest_framework.authentication.BasicAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ),
 }
 
+# Кэширование аутентификации по токену (api_app.authentication.CachedTokenAuthentication):
+# время жизни записи в локальном кэше процесса (сек), его размер,
+# алиас общего кэша из CACHES (пусто - только локальный кэш) и время жизни записи в нём (сек)
+AUTH_CACHE_LOCAL_TTL = config('AUTH_CACHE_LOCAL_TTL', default=5, cast=int)
+AUTH_CACHE_LOCAL_SIZE = config('AUTH_CACHE_LOCAL_SIZE', default=10000, cast=int)
+AUTH_CACHE_ALIAS = config('AUTH_CACHE_ALIAS', default='') or None
+AUTH_CACHE_TTL = config('AUTH_CACHE_TTL', default=300, cast=int)
+
 CORS_ORIGIN_ALLOW_ALL = True
 
 # Позволяет клиенту видеть эти заголовоки
@@ -83,6 +266,12 @@ CORS_EXPOSE_HEADERS = [
     'Content-Disposition',
     'Content-Type',
     'X-Last-Download-Date',
+    'Accept-Ranges',
+    'Content-Range',
+    'Content-Length',
+    'ETag',
+    'Last-Modified',
+    'Server-Timing',
 ]
 
 ROOT_URLCONF = 'backend_project.urls'
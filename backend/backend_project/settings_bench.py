@@ -0,0 +1,50 @@
+'''
+Профиль настроек для бенчмарков api_app (команды generate_bench_data и benchmark).
+
+Использует отдельную одноразовую базу и каталог файлов, рабочие данные не затрагиваются:
+    DJANGO_SETTINGS_MODULE=backend_project.settings_bench python manage.py benchmark
+
+По умолчанию база - SQLite в каталоге BENCH_DIR. Для замеров на PostgreSQL: BENCH_DATABASE=postgres,
+параметры подключения берутся из DATABASE_*, а имя базы - из BENCH_DATABASE_NAME
+'''
+
+import os
+import tempfile
+from decouple import config
+
+# Обязательные параметры основного профиля для SQLite не нужны: если их нет в .env, подставляем заглушки
+for name in ('SECRET_KEY', 'ALLOWED_HOSTS', 'DATABASE_NAME', 'DATABASE_USER', 'DATABASE_PASSWORD', 'DATABASE_HOST', 'DATABASE_PORT'):
+    os.environ.setdefault(name, config(name, default='benchmark'))
+
+from .settings import *  # noqa: E402,F401,F403
+from .settings import DATABASES  # noqa: E402
+
+# Признак профиля: команды бенчмарка создают и удаляют данные и без него не запускаются
+BENCHMARK_PROFILE = True
+
+DEBUG = False
+ALLOWED_HOSTS = ['testserver', '127.0.0.1', 'localhost']
+
+# Каталог для базы SQLite и файлов бенчмарка: по умолчанию во временном каталоге системы, вне репозитория
+BENCH_DIR = config('BENCH_DIR', default=os.path.join(tempfile.gettempdir(), 'my_cloud_bench'))
+MEDIA_ROOT = os.path.join(BENCH_DIR, 'media')
+
+BENCH_DATABASE = config('BENCH_DATABASE', default='sqlite')
+if BENCH_DATABASE == 'postgres':
+    DATABASES = {
+        'default': {**DATABASES['default'], 'NAME': config('BENCH_DATABASE_NAME', default='cloud_bench')},
+    }
+else:
+    os.makedirs(BENCH_DIR, exist_ok=True)
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.path.join(BENCH_DIR, 'db.sqlite3'),
+        }
+    }
+
+# Фоновые задачи отключены, чтобы они не искажали замеры: эскизы создаются при первом запросе,
+# помеченные удалёнными файлы удаляются командой reap_deleted_files
+PREVIEW_ON_UPLOAD = False
+FILE_REAP_INTERVAL = 0
+TOKEN_SWEEP_INTERVAL = 0
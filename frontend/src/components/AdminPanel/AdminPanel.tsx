@@ -11,13 +11,9 @@ interface User {
     username: string;
     fullname: string;
     role: string;
-    storages: File[];
-}
-
-interface File {
-    id_file: number;
-    original_name: string;
-    size: number;
+    file_count: number;  // количество файлов пользователя
+    total_size: number;  // общий размер файлов в байтах
+    last_upload: string | null;  // дата последней загрузки
 }
 
 /**
@@ -38,26 +34,34 @@ interface File {
  */
 export const AdminPanel: React.FC = () => {    
     const [users, setUsers] = useState<User[]>([]);  // Используем состояние для хранения списка пользователей
+    const [nextPage, setNextPage] = useState<string | null>(null);  // Ссылка на следующую страницу списка
     const auth_token = localStorage.getItem('token');
     const navigate = useNavigate();  // Хук для навигации между страницами
     
     /**
-     * fetchUsers - функция для загрузки пользователей с сервера.
-     * Она извлекает список пользователей из API, сортирует его и обновляет состояние компонента.
+     * fetchUsers - функция для загрузки страницы пользователей с сервера.
+     * Сервер отдаёт список постранично: без url загружается первая страница и заменяет список,
+     * с url (ссылка next) - следующая страница добавляется к уже загруженным пользователям.
      * 
      * @async
      * @function
+     * @param {string} [url] - ссылка на следующую страницу списка.
      * @throws {Error} - выбрасывает ошибку при проблемах с загрузкой данных.
      */
-    const fetchUsers = async () => {
+    const fetchUsers = async (url?: string) => {
         try {
-            const response = await fetch(`${API_BASE_URL}/api/users`);
+            const response = await fetch(url ?? `${API_BASE_URL}/api/users/`, {
+                headers: {
+                    'Authorization': `Token ${auth_token}`,
+                },
+            });
 
             if (!response.ok) {
                 throw new Error('Ошибка при загрузке пользователей');
             }
 
-            const data: User[] = await response.json();
+            const page: { next: string | null; results: User[] } = await response.json();
+            const data = url ? [...users, ...page.results] : page.results;
             
             // Сортируем пользователей: admin сначала, затем остальные в алфавитном порядке
             const sortedUsers = data.sort((a, b) => {
@@ -70,6 +74,7 @@ export const AdminPanel: React.FC = () => {
             });
             
             setUsers(sortedUsers);  // Устанавливаем полученный список пользователей в состояние
+            setNextPage(page.next);
         } catch (error) {
             console.error(error);
         }
@@ -150,21 +155,17 @@ export const AdminPanel: React.FC = () => {
     
             <ul className="admin-panel__list">
                 {users.map(user => {
-                    const totalFileSize = user.storages.reduce((total, file) => (
-                        total + (file.size || 0)
-                    ), 0);
-    
                     return (
                         <li key={user.id_user} className="admin-panel__item">
                             {Object.entries(user).map(([key, value]) => (
-                                (key !== 'password' && key !== 'id_user') && (
-                                    (key !== 'storages') ? (
+                                (key !== 'password' && key !== 'id_user' && key !== 'total_size' && key !== 'last_upload') && (
+                                    (key !== 'file_count') ? (
                                         <div key={key}>
                                             <strong>{key}:</strong> {value}
                                         </div>
                                     ) : (
                                         <div key={key}>
-                                            <strong>{key}:</strong> {` ${value.length} files; Total Size: ${totalFileSize} bytes`}
+                                            <strong>storages:</strong> {` ${user.file_count} files; Total Size: ${user.total_size} bytes`}
                                         </div>
                                     )
                                 )
@@ -179,6 +180,10 @@ export const AdminPanel: React.FC = () => {
                     );
                 })}
             </ul>
+
+            {nextPage && (
+                <button className="admin-panel__button" onClick={() => fetchUsers(nextPage)}>Показать ещё</button>
+            )}
         </div>
     );
 };